@@ -0,0 +1,119 @@
+import threading
+from collections import deque
+
+from sqlalchemy import select, update
+
+from models import db, ParkingSpot
+
+
+# Hands out free spots per lot from an in-memory free list instead of scanning
+# parking_spot on every booking. The database stays the source of truth: a
+# claim only counts once the conditional UPDATE (status 'A' -> 'O') changes
+# exactly one row, so ids that went stale (another worker took them, a crash
+# left the list out of date) are dropped and the list is rebuilt from the DB.
+#
+# On databases with row locks (PostgreSQL, MySQL) several processes would
+# otherwise queue on the same row lock when their lists agree, so there the
+# spot is picked in SQL with FOR UPDATE SKIP LOCKED instead: concurrent
+# bookings take different rows without waiting on each other. SQLite has one
+# writer at a time, which already serialises the conditional UPDATEs.
+SKIP_LOCKED_DIALECTS = {'postgresql', 'mysql', 'mariadb'}
+
+
+class SpotAllocator:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._free = {}
+        self._warmed = False
+
+    def warm(self):
+        rows = db.session.query(ParkingSpot.lot_id, ParkingSpot.id) \
+            .filter(ParkingSpot.status == 'A') \
+            .order_by(ParkingSpot.id) \
+            .all()
+        free = {}
+        for lot_id, spot_id in rows:
+            free.setdefault(lot_id, deque()).append(spot_id)
+        with self._lock:
+            self._free = free
+            self._warmed = True
+
+    def rebuild_lot(self, lot_id):
+        ids = [spot_id for (spot_id,) in db.session.query(ParkingSpot.id)
+               .filter(ParkingSpot.lot_id == lot_id, ParkingSpot.status == 'A')
+               .order_by(ParkingSpot.id)]
+        with self._lock:
+            self._free[lot_id] = deque(ids)
+        return len(ids)
+
+    def forget(self, lot_id):
+        with self._lock:
+            self._free.pop(lot_id, None)
+
+    def release(self, lot_id, spot_id):
+        with self._lock:
+            if lot_id in self._free:
+                self._free[lot_id].append(spot_id)
+
+    def free_count(self, lot_id):
+        with self._lock:
+            return len(self._free.get(lot_id, ()))
+
+    def _pop(self, lot_id):
+        with self._lock:
+            free = self._free.get(lot_id)
+            if free:
+                return free.popleft()
+        return None
+
+    def _unpop(self, lot_id, spot_id):
+        with self._lock:
+            if lot_id in self._free:
+                self._free[lot_id].appendleft(spot_id)
+
+    def _claim_skip_locked(self, lot_id):
+        spot_id = db.session.execute(
+            select(ParkingSpot.id)
+            .where(ParkingSpot.lot_id == lot_id, ParkingSpot.status == 'A')
+            .order_by(ParkingSpot.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        ).scalar()
+        if spot_id is None:
+            return None
+        db.session.execute(update(ParkingSpot).where(ParkingSpot.id == spot_id).values(status='O'))
+        return spot_id
+
+    def claim(self, lot_id):
+        # Marks one spot of the lot as occupied inside the caller's transaction
+        # and returns its id, or None when the lot is full.
+        if db.session.get_bind().dialect.name in SKIP_LOCKED_DIALECTS:
+            return self._claim_skip_locked(lot_id)
+        if not self._warmed:
+            self.warm()
+
+        rebuilt = False
+        while True:
+            spot_id = self._pop(lot_id)
+            if spot_id is None:
+                if rebuilt or not self.rebuild_lot(lot_id):
+                    return None
+                rebuilt = True
+                continue
+
+            try:
+                result = db.session.execute(
+                    update(ParkingSpot)
+                    .where(ParkingSpot.id == spot_id, ParkingSpot.status == 'A')
+                    .values(status='O')
+                )
+            except Exception:
+                # Locked database, lost connection: the spot was not taken
+                self._unpop(lot_id, spot_id)
+                raise
+            if result.rowcount == 1:
+                return spot_id
+
+
+allocator = SpotAllocator()
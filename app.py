@@ -1,52 +1,101 @@
-from flask import Flask, request, jsonify
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
-from flask_mail import Mail
+import click
+import json
+import math
+from flask import Blueprint, Flask, Response, current_app, request, jsonify, send_file
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt, get_jwt_identity
 from flask_cors import CORS
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
-from models import db, User, ParkingLot, ParkingSpot, Reservation
+from datetime import datetime, timedelta
+from models import db, PARTIAL_INDEX_DIALECTS, User, ParkingLot, ParkingSpot, Reservation
+from allocator import allocator
+from occupancy import adjust_counts
+from provisioning import add_spots, resize_lot
+from pagination import paginated_response
+from caching import cache, cached_view, bump
+from extensions import jwt, mail
+from auth import HashingBusy, RevocationUnavailable, check_password, hash_password, needs_rehash, revoke
+from exports import export_path
+import metrics
+import database
+import encoding
+from database import read_only
+from events import get_broker, lot_states, publish_lots, stream, subscriber_limit
+import rollups
+from pricing import compile_tariff, price_many, price_stay
+from search import lot_index, search_lots
+from expiry import expires_at, reschedule_lot
+from fleet import ROLE as FLEET_ROLE, release_batch, reserve_batch
+from transactions import idempotent, retry_transaction
 from config import Config
-from flask_caching import Cache
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 
 
-app = Flask(__name__)
-cache = Cache(app, config={
-    'CACHE_TYPE': 'RedisCache',
-    'CACHE_REDIS_HOST': 'localhost',
-    'CACHE_REDIS_PORT': 6380,
-    'CACHE_REDIS_DB': 0,
-    'CACHE_DEFAULT_TIMEOUT': 60
-})
-app.config.from_object(Config)
+bp = Blueprint('api', __name__)
 
-db.init_app(app)
-jwt = JWTManager(app)
-mail = Mail(app)
-CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
 
-# CORS(app, resources={r"/admin/*": {"origins": "http://127.0.0.1:5501"}})
-# CORS(app, resources={r"*": {"origins": "*"}})
+def create_app(config_object=Config, web=True):
+    # web=False builds only what background jobs need (database, cache, mail)
+    # and skips routes, JWT and CORS.
+    app = Flask(__name__)
+    app.config.from_object(config_object)
 
-CORS(app, resources={r"/*": {"origins": "http://127.0.0.1:5501"}}, supports_credentials=True)
+    database.configure(app)
+    db.init_app(app)
+    database.init_app(app, db)
+    cache.init_app(app)
+    mail.init_app(app)
+    app.cli.add_command(init_db_command)
 
+    if web:
+        metrics.init_app(app)
+        encoding.init_app(app)
+        jwt.init_app(app)
+        CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True,
+             expose_headers=['ETag'])
 
+        # CORS(app, resources={r"/admin/*": {"origins": "http://127.0.0.1:5501"}})
+        # CORS(app, resources={r"*": {"origins": "*"}})
 
+        CORS(app, resources={r"/*": {"origins": "http://127.0.0.1:5501"}}, supports_credentials=True,
+             expose_headers=['ETag'])
+        app.register_blueprint(bp)
+        app.register_error_handler(RevocationUnavailable, revocation_unavailable)
+    return app
+
+
+def revocation_unavailable(error):
+    # AUTH_REVOCATION_OUTAGE=closed and the cache is unreachable
+    return jsonify(message='Sign-in checks unavailable, please retry'), 503, {'Retry-After': '5'}
+
+
+def init_db():
+    # Creates and migrates the schema, seeds the admin user and warms the spot
+    # allocator. Runs once at startup, not per request.
+    from migrations import upgrade
 
-@app.before_request
-def create_tables():
     db.create_all()
+    upgrade()
     if not User.query.filter_by(role='admin').first():
-        admin = User(username='admin', password=generate_password_hash('admin123'), role='admin')
+        admin = User(username='admin', password=hash_password('admin123'), role='admin')
         db.session.add(admin)
         db.session.commit()
+    allocator.warm()
+
+
+@click.command('init-db')
+def init_db_command():
+    init_db()
+    click.echo('Database initialised.')
+
 
 # from tasks import sample_task
 
 
-# @app.route('/', methods=['GET'])
+# @bp.route('/', methods=['GET'])
 # def home():
 #     return (f"<h2>Hello From Backend</h2>")
-@app.route('/', methods=['GET'])
+@bp.route('/', methods=['GET'])
 def home():
     return '''
     <html>
@@ -69,27 +118,40 @@ def home():
     '''
 
 
-@app.route('/register', methods=['POST'])
+@bp.route('/register', methods=['POST'])
 def register():
     data = request.get_json()
     existing_user = User.query.filter_by(username=data['username']).first()
 
     if existing_user:
-        print("Plain password:", data['password'])
         return jsonify(message="Username already taken!"), 400
     
-    print("Plain password:", data['password'])
-    hashed_password = generate_password_hash(data['password'])
+    try:
+        hashed_password = hash_password(data['password'])
+    except HashingBusy:
+        return jsonify(message='Server busy, please retry'), 503, {'Retry-After': '1'}
     user = User(username=data['username'], password=hashed_password, role='user')
     db.session.add(user)
     db.session.commit()
+    bump('users')
     return jsonify(message='User registered successfully'), 201
 
-@app.route('/login', methods=['POST'])
+@bp.route('/login', methods=['POST'])
 def login():
     data = request.get_json()
     user = User.query.filter_by(username=data['username']).first()
-    if user and check_password_hash(user.password, data['password']):
+    try:
+        valid = check_password(user.password if user else None, data['password'])
+    except HashingBusy:
+        return jsonify(message='Too many logins at once, please retry'), 503, {'Retry-After': '1'}
+    if user and valid:
+        if needs_rehash(user.password):
+            # Move the stored hash to PASSWORD_HASH_METHOD while we have the password
+            try:
+                user.password = hash_password(data['password'])
+                db.session.commit()
+            except HashingBusy:
+                pass
         access_token = create_access_token(identity={
             'id': user.id,
             'username':user.username,
@@ -101,14 +163,44 @@ def login():
     return jsonify(message='Invalid credentials'), 401
 
 
-@app.route('/dashboard', methods=['GET'])
+@bp.route('/logout', methods=['POST'])
+@jwt_required()
+def logout():
+    revoke(get_jwt())
+    return jsonify(message='Logged out')
+
+
+@bp.route('/dashboard', methods=['GET'])
 @jwt_required()
 def dashboard():
     current_user = get_jwt_identity()
     return jsonify(message=f"Welcome {current_user['username']}! Role: {current_user['role']}")
 
 
-@app.route('/admin/lots', methods=['POST'])
+def parse_max_stay(value):
+    # None keeps the MAX_STAY_MINUTES default, 0 means no limit.
+    if value is None:
+        return None
+    try:
+        minutes = int(value)
+    except (TypeError, ValueError):
+        minutes = -1
+    if minutes < 0:
+        raise ValueError('max_stay_minutes must be a non-negative whole number')
+    return minutes
+
+
+def parse_total_spots(value):
+    try:
+        spots = int(value)
+    except (TypeError, ValueError):
+        spots = -1
+    if spots < 0:
+        raise ValueError('total_spots must be a non-negative whole number')
+    return spots
+
+
+@bp.route('/admin/lots', methods=['POST'])
 @jwt_required()
 def create_lot():
     current_user = get_jwt_identity()
@@ -118,27 +210,37 @@ def create_lot():
     data = request.get_json()
     if ParkingLot.query.filter_by(name = data['name']).first():
         return jsonify(message='Lot with this name already exists!'), 400
+    try:
+        tariff = compile_tariff(data.get('tariff'), data['price'])
+        max_stay_minutes = parse_max_stay(data.get('max_stay_minutes'))
+        total_spots = parse_total_spots(data['total_spots'])
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
     
     lot = ParkingLot(name = data['name'],
                      address = data['address'],
                      pin_code = data['pin_code'],
                      price = data['price'],
-                     total_spots = data['total_spots']
+                     total_spots = total_spots,
+                     available_count = total_spots,
+                     tariff = tariff,
+                     max_stay_minutes = max_stay_minutes
                      )
     db.session.add(lot)
+    db.session.flush()
+    add_spots(lot.id, lot.total_spots)
     db.session.commit()
-
-    for _ in range(lot.total_spots):
-        spot = ParkingSpot(lot_id=lot.id)
-        db.session.add(spot)
-    
-    db.session.commit()
+    allocator.rebuild_lot(lot.id)
+    bump('lots', 'lot-details', f'lot:{lot.id}')
+    lot_index.update(lot.id)
+    publish_lots(lot.id, change='details')
     return jsonify(message="Parking lot created with spots."), 201
 
 
-@app.route('/admin/lots', methods=["GET"])
+@bp.route('/admin/lots', methods=["GET"])
 @jwt_required()
-# @cache.cached(timeout=120, key_prefix='admin_lots')
+@cached_view('lot-details')
+@read_only
 def view_all_lots():
     current_user = get_jwt_identity()
     if current_user['role'] != 'admin':
@@ -153,12 +255,14 @@ def view_all_lots():
             "address": lot.address,
             "pin_code": lot.pin_code,
             "price": lot.price,
-            "total_spots": lot.total_spots
+            "total_spots": lot.total_spots,
+            "tariff": json.loads(lot.tariff) if lot.tariff else None,
+            "max_stay_minutes": lot.max_stay_minutes
         })
     return jsonify(lots=output)
 
 
-@app.route('/admin/lots/<int:lot_id>', methods=['PUT'])
+@bp.route('/admin/lots/<int:lot_id>', methods=['PUT'])
 @jwt_required()
 def edit_lot(lot_id):
     current_user = get_jwt_identity()
@@ -172,12 +276,36 @@ def edit_lot(lot_id):
     lot.address = data.get('address', lot.address)
     lot.pin_code = data.get('pin_code', lot.pin_code)
     lot.price = data.get('price', lot.price)
+    try:
+        if 'tariff' in data:
+            lot.tariff = compile_tariff(data['tariff'], lot.price)
+        if 'max_stay_minutes' in data:
+            max_stay_minutes = parse_max_stay(data['max_stay_minutes'])
+            if max_stay_minutes != lot.max_stay_minutes:
+                lot.max_stay_minutes = max_stay_minutes
+                reschedule_lot(lot.id, max_stay_minutes)
+        total_spots = parse_total_spots(data.get('total_spots', lot.total_spots))
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify(message=str(e)), 400
+
+    resized = total_spots != lot.total_spots
+    if resized:
+        error = resize_lot(lot, total_spots)
+        if error:
+            db.session.rollback()
+            return jsonify(message=error), 400
 
     db.session.commit()
+    if resized:
+        allocator.rebuild_lot(lot.id)
+    bump('lots', 'lot-details', f'lot:{lot.id}')
+    lot_index.update(lot.id)
+    publish_lots(lot.id, change='details')
     return jsonify(message="Parking lot updated.")
 
 
-@app.route('/admin/lots/<int:lot_id>', methods=['DELETE'])
+@bp.route('/admin/lots/<int:lot_id>', methods=['DELETE'])
 @jwt_required()
 def delete_lot(lot_id):
     current_user = get_jwt_identity()
@@ -193,102 +321,339 @@ def delete_lot(lot_id):
     ParkingSpot.query.filter_by(lot_id = lot.id).delete()
     db.session.delete(lot)
     db.session.commit()
+    allocator.forget(lot_id)
+    bump('lots', 'lot-details', f'lot:{lot_id}')
+    lot_index.update(lot_id)
+    publish_lots(lot_id, change='deleted')
     return jsonify(message="Parking lot deleted.")
 
 
-@app.route('/user/reserve/<int:lot_id>', methods=['POST'])
+@bp.route('/user/reserve/<int:lot_id>', methods=['POST'])
 @jwt_required()
+@idempotent
+@retry_transaction
 def reserve_spot(lot_id):
-    user_data = get_jwt_identity()
-    user = User.query.filter_by(id=user_data['id']).first()
-
-    active = Reservation.query.filter_by(user_id = user.id,leaving_time=None).first()
+    user_id = get_jwt_identity()['id']
+
+    # Fast path only; ux_reservation_user_active is what actually guarantees
+    # one active reservation per user when two requests race. Where that
+    # partial index cannot exist, the user row lock serializes the user's
+    # bookings and the check becomes a locking (latest committed) read.
+    active = Reservation.query.filter_by(user_id = user_id,leaving_time=None,batch_id=None)
+    if db.session.get_bind().dialect.name not in PARTIAL_INDEX_DIALECTS:
+        db.session.query(User.id).filter(User.id == user_id).with_for_update().one()
+        active = active.with_for_update()
+    active = active.first()
     if active:
         return jsonify(message='You already have a reservation!'), 400
     
-    spot = ParkingSpot.query.filter_by(lot_id=lot_id,status='A').first()
-    if not spot:
+    spot_id = allocator.claim(lot_id)
+    if spot_id is None:
+        db.session.rollback()
         return jsonify(message='No available spots in this lot'), 404
-    
-    spot.status = 'O'
 
-    reservation = Reservation(user_id = user.id, 
-                              spot_id = spot.id,
-                              parking_time=datetime.utcnow()
-                              )
-    db.session.add(reservation)
-    db.session.commit()
+    try:
+        adjust_counts(lot_id, available=-1, occupied=1)
+        parking_time = datetime.utcnow()
+        max_stay_minutes = db.session.query(ParkingLot.max_stay_minutes) \
+            .filter(ParkingLot.id == lot_id).scalar()
+        expiry = expires_at(parking_time, max_stay_minutes)
+        reservation = Reservation(user_id = user_id, 
+                                  spot_id = spot_id,
+                                  parking_time=parking_time,
+                                  expires_at=expiry
+                                  )
+        db.session.add(reservation)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        allocator.release(lot_id, spot_id)
+        return jsonify(message='You already have a reservation!'), 400
+    except Exception:
+        db.session.rollback()
+        allocator.release(lot_id, spot_id)
+        raise
+    bump('lots', f'lot:{lot_id}', f'user:{user_id}', 'reservations')
+    publish_lots(lot_id)
 
-    return jsonify(message='Spot reserved', spot_id=spot.id, reservation_id=reservation.id), 201
+    return jsonify(message='Spot reserved', spot_id=spot_id, reservation_id=reservation.id,
+                   expires_at=expiry.isoformat() if expiry else None), 201
 
 
-@app.route('/user/release', methods=['POST'])
+@bp.route('/user/release', methods=['POST'])
 @jwt_required()
+@idempotent
+@retry_transaction
 def release_spot():
     user_data = get_jwt_identity()
-    user = User.query.get(user_data['id'])
 
-    reservation = Reservation.query.filter_by(user_id = user.id, leaving_time=None).first()
-    if not reservation:
+    active = db.session.query(Reservation.id, Reservation.parking_time, Reservation.spot_id,
+                              ParkingSpot.lot_id, ParkingLot.price, ParkingLot.tariff) \
+        .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id) \
+        .join(ParkingLot, ParkingSpot.lot_id == ParkingLot.id) \
+        .filter(Reservation.user_id == user_data['id'], Reservation.leaving_time.is_(None),
+                Reservation.batch_id.is_(None)) \
+        .first()
+    if not active:
         return jsonify(message='No active reservation found.'), 404
-    
-    reservation.leaving_time = datetime.utcnow()
 
-    duration = (reservation.leaving_time - reservation.parking_time).total_seconds() / 60
-    lot = reservation.spot.lot
-    reservation.cost = round((duration/60) * lot.price, 2)
+    leaving_time = datetime.utcnow()
+    cost = price_stay(active.tariff, active.price, active.parking_time, leaving_time,
+                      current_app.config['PRICING_TIMEZONE'])
+
+    # Only the request that actually closes the reservation (leaving_time
+    # still NULL) frees the spot; a concurrent double release matches no row.
+    closed = db.session.execute(
+        update(Reservation)
+        .where(Reservation.id == active.id, Reservation.leaving_time.is_(None))
+        .values(leaving_time=leaving_time, cost=cost)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not closed:
+        db.session.rollback()
+        return jsonify(message='No active reservation found.'), 404
 
-    reservation.spot.status = 'A'
+    db.session.execute(
+        update(ParkingSpot)
+        .where(ParkingSpot.id == active.spot_id, ParkingSpot.status == 'O')
+        .values(status='A')
+        .execution_options(synchronize_session=False)
+    )
+    adjust_counts(active.lot_id, available=1, occupied=-1)
     db.session.commit()
+    allocator.release(active.lot_id, active.spot_id)
+    bump('lots', f'lot:{active.lot_id}', f"user:{user_data['id']}", 'reservations')
+    publish_lots(active.lot_id)
 
-    return jsonify(message='Spot release', cost=reservation.cost), 200
+    return jsonify(message='Spot release', cost=cost), 200
 
 
-@app.route('/user/reservations', methods=['GET'])
+@bp.route('/fleet/reserve', methods=['POST'])
 @jwt_required()
-def get_user_reservations():
-    user_data = get_jwt_identity()
-    user = db.session.get(User, user_data['id'])
+@idempotent
+@retry_transaction
+def fleet_reserve():
+    # {"lot_id": 1, "count": 50, "min_count": 40}: books min(count, free)
+    # spots if at least min_count (default count) are free, otherwise none.
+    user = get_jwt_identity()
+    if user['role'] != FLEET_ROLE:
+        return jsonify(message="Unauthorized"), 403
 
-    reservations = Reservation.query.filter_by(user_id = user.id).all()
-    output = []
-    for r in reservations:
-        lot_name = r.spot.lot.name if r.spot and r.spot.lot else "Deleted Lot"
-        output.append({
-            'reservation_id': r.id,
-            'spot_id': r.spot_id,
-            'lot_name': lot_name,
-            'parking_time': r.parking_time,
-            'leaving_time': r.leaving_time,
-            'cost': r.cost
-        })
-    return jsonify(history = output)
+    data = request.get_json(silent=True) or {}
+    try:
+        count = int(data.get('count', 0))
+        min_count = int(data.get('min_count', count))
+    except (TypeError, ValueError):
+        return jsonify(message='count and min_count must be whole numbers'), 400
+    if not 1 <= count <= current_app.config['FLEET_MAX_BATCH']:
+        return jsonify(message=f"count must be between 1 and {current_app.config['FLEET_MAX_BATCH']}"), 400
+    if not 1 <= min_count <= count:
+        return jsonify(message='min_count must be between 1 and count'), 400
+    lot = db.session.get(ParkingLot, data.get('lot_id') or 0)
+    if not lot:
+        return jsonify(message='Lot not found'), 404
+
+    batch_id, spot_ids, expiry = reserve_batch(user['id'], lot, count, min_count)
+    if batch_id is None:
+        db.session.rollback()
+        available = db.session.query(ParkingLot.available_count).filter(ParkingLot.id == lot.id).scalar()
+        return jsonify(message=f'Fewer than {min_count} spots are free in this lot',
+                       available=available), 409
+    db.session.commit()
+    allocator.rebuild_lot(lot.id)
+    bump('lots', f"lot:{lot.id}", f"user:{user['id']}", 'reservations')
+    publish_lots(lot.id)
 
+    return jsonify(message='Spots reserved', batch_id=batch_id, requested=count,
+                   reserved=len(spot_ids), spot_ids=spot_ids,
+                   expires_at=expiry.isoformat() if expiry else None), 201
 
-@app.route('/admin/dashboard', methods=['GET'])
+
+@bp.route('/fleet/release', methods=['POST'])
 @jwt_required()
-@cache.cached(timeout=60)
-def admin_dashboard():
+@idempotent
+@retry_transaction
+def fleet_release():
+    # {"batch_id": "...", "spot_ids": [...]}; without spot_ids the whole batch.
+    user = get_jwt_identity()
+    if user['role'] != FLEET_ROLE:
+        return jsonify(message="Unauthorized"), 403
+
+    data = request.get_json(silent=True) or {}
+    spot_ids = data.get('spot_ids')
+    if not data.get('batch_id') or (spot_ids is not None and not isinstance(spot_ids, list)):
+        return jsonify(message='batch_id is required and spot_ids must be a list'), 400
+
+    closed, costs = release_batch(user['id'], data['batch_id'], spot_ids)
+    if not closed:
+        db.session.rollback()
+        return jsonify(message='No active reservations in this batch'), 404
+    db.session.commit()
+
+    lot_ids = sorted({row.lot_id for row in closed})
+    for row in closed:
+        allocator.release(row.lot_id, row.spot_id)
+    bump('lots', *(f'lot:{lot_id}' for lot_id in lot_ids), f"user:{user['id']}", 'reservations')
+    publish_lots(*lot_ids)
+
+    return jsonify(message='Spots released', batch_id=data['batch_id'], released=len(closed),
+                   spot_ids=sorted(row.spot_id for row in closed),
+                   total_cost=round(sum(costs[row.id] for row in closed), 2))
+
+
+@bp.route('/admin/users/<int:user_id>/role', methods=['PUT'])
+@jwt_required()
+def set_user_role(user_id):
+    # Takes effect at the user's next login, when a token with the new role is
+    # issued. Refused while the user holds reservations: after the switch the
+    # new token could no longer release them (/fleet/release needs the fleet
+    # role).
+    current_user = get_jwt_identity()
+    if current_user['role'] != 'admin':
+        return jsonify(message="Unauthorized"), 403
+
+    role = (request.get_json(silent=True) or {}).get('role')
+    if role not in ('user', FLEET_ROLE):
+        return jsonify(message=f"role must be 'user' or '{FLEET_ROLE}'"), 400
+    user = User.query.get_or_404(user_id)
+    if user.role == 'admin':
+        return jsonify(message='Cannot change the role of an admin'), 400
+    if role != user.role:
+        active = db.session.query(func.count(Reservation.id)) \
+            .filter(Reservation.user_id == user.id, Reservation.leaving_time.is_(None)).scalar()
+        if active:
+            return jsonify(message=f'{user.username} has {active} active reservations; '
+                                   'release them before changing the role', active=active), 409
+    user.role = role
+    db.session.commit()
+    bump('users')
+    return jsonify(message=f'{user.username} is now {role}')
+
+
+@bp.route('/user/quote', methods=['GET'])
+@jwt_required()
+def quote():
+    # Price of releasing the active reservation now, or with ?lot_id=&minutes=
+    # of a stay in that lot starting now.
+    user_data = get_jwt_identity()
+    now = datetime.utcnow()
+    zone = current_app.config['PRICING_TIMEZONE']
+
+    if 'lot_id' in request.args or 'minutes' in request.args:
+        lot_id = request.args.get('lot_id', type=int)
+        if lot_id is None:
+            return jsonify(message='lot_id must be a lot id'), 400
+        max_minutes = current_app.config['QUOTE_MAX_MINUTES']
+        try:
+            minutes = float(request.args.get('minutes', 60))
+            if not math.isfinite(minutes) or not 0 <= minutes <= max_minutes:
+                raise ValueError
+        except ValueError:
+            return jsonify(message=f'minutes must be a number from 0 to {max_minutes}'), 400
+        lot = db.session.get(ParkingLot, lot_id)
+        if not lot:
+            return jsonify(message='Lot not found'), 404
+        cost = price_stay(lot.tariff, lot.price, now, now + timedelta(minutes=minutes), zone)
+        return jsonify(lot_id=lot.id, minutes=minutes, cost=cost)
+
+    active = db.session.query(Reservation.id, Reservation.parking_time, ParkingLot.id.label('lot_id'),
+                              ParkingLot.price, ParkingLot.tariff) \
+        .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id) \
+        .join(ParkingLot, ParkingSpot.lot_id == ParkingLot.id) \
+        .filter(Reservation.user_id == user_data['id'], Reservation.leaving_time.is_(None),
+                Reservation.batch_id.is_(None)) \
+        .first()
+    if not active:
+        return jsonify(message='No active reservation found.'), 404
+    minutes = (now - active.parking_time).total_seconds() / 60
+    return jsonify(reservation_id=active.id, lot_id=active.lot_id, minutes=round(minutes, 1),
+                   cost=price_stay(active.tariff, active.price, active.parking_time, now, zone))
+
+
+@bp.route('/admin/tariffs/simulate', methods=['POST'])
+@jwt_required()
+@read_only
+def simulate_tariff():
+    # What the closed reservations of a lot (optionally within start/end ISO
+    # dates) would have cost under a proposed tariff, priced in one vectorised
+    # pass. Nothing is written.
     user = get_jwt_identity()
     if user['role'] != 'admin':
         return jsonify(message="Unauthorized"), 403
 
-    # Fetch lots and spot stats
-    lots = ParkingLot.query.all()
-    total_spots = ParkingSpot.query.count()
-    available_spots = ParkingSpot.query.filter_by(status='A').count()
-    occupied_spots = ParkingSpot.query.filter_by(status='O').count()
-    total_users = User.query.filter_by(role='user').count()
+    data = request.get_json(silent=True) or {}
+    lot = db.session.get(ParkingLot, data.get('lot_id') or 0)
+    if not lot:
+        return jsonify(message='Lot not found'), 404
+    try:
+        price = float(data.get('price', lot.price))
+        tariff = compile_tariff(data.get('tariff'), price)
+        start = datetime.fromisoformat(data['start']) if data.get('start') else None
+        end = datetime.fromisoformat(data['end']) + timedelta(days=1) if data.get('end') else None
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
+
+    query = db.session.query(Reservation.parking_time, Reservation.leaving_time, Reservation.cost) \
+        .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id) \
+        .filter(ParkingSpot.lot_id == lot.id, Reservation.leaving_time.isnot(None))
+    if start:
+        query = query.filter(Reservation.parking_time >= start)
+    if end:
+        query = query.filter(Reservation.parking_time < end)
+    rows = query.all()
+    if not rows:
+        return jsonify(lot_id=lot.id, reservations=0, current_revenue=0, simulated_revenue=0)
+
+    starts, ends, costs = zip(*rows)
+    simulated = price_many(tariff, price, starts, ends, current_app.config['PRICING_TIMEZONE'])
+    current = sum(cost or 0 for cost in costs)
+    return jsonify(lot_id=lot.id,
+                   reservations=len(rows),
+                   current_revenue=round(current, 2),
+                   simulated_revenue=round(float(simulated.sum()), 2),
+                   average_change=round((float(simulated.sum()) - current) / len(rows), 2))
+
+
+def reservation_rows():
+    # Flat rows with the user and lot joined in, for listing and streaming.
+    return db.session.query(Reservation.id, Reservation.spot_id, Reservation.parking_time,
+                            Reservation.leaving_time, Reservation.cost,
+                            User.username, ParkingLot.name.label('lot_name')) \
+        .outerjoin(User, Reservation.user_id == User.id) \
+        .outerjoin(ParkingSpot, Reservation.spot_id == ParkingSpot.id) \
+        .outerjoin(ParkingLot, ParkingSpot.lot_id == ParkingLot.id)
+
+
+@bp.route('/user/reservations', methods=['GET'])
+@jwt_required()
+@cached_view(lambda identity: f"user:{identity['id']}", 'lot-details', per_user=True)
+def get_user_reservations():
+    user = get_jwt_identity()
+
+    query = reservation_rows().filter(Reservation.user_id == user['id'])
+    return paginated_response(query, lambda r: {
+        'reservation_id': r.id,
+        'spot_id': r.spot_id,
+        'lot_name': r.lot_name or "Deleted Lot",
+        'parking_time': r.parking_time,
+        'leaving_time': r.leaving_time,
+        'cost': r.cost
+    }, 'history')
 
-    # Calculate total revenue from reservations
-    total_revenue = db.session.query(db.func.sum(Reservation.cost)).scalar() or 0
 
-    # Lot-wise summary
+@bp.route('/admin/dashboard', methods=['GET'])
+@jwt_required()
+@cached_view('lots', 'reservations', 'users')
+@read_only
+def admin_dashboard():
+    user = get_jwt_identity()
+    if user['role'] != 'admin':
+        return jsonify(message="Unauthorized"), 403
+
+    # Lot-wise summary from the occupancy counters kept on each lot
+    lots = ParkingLot.query.order_by(ParkingLot.id).all()
     lot_summaries = []
     for lot in lots:
-        spots = ParkingSpot.query.filter_by(lot_id=lot.id).all()
-        available = sum(1 for s in spots if s.status == 'A')
-        occupied = sum(1 for s in spots if s.status == 'O')
         lot_summaries.append({
             "id": lot.id,
             "name": lot.name,
@@ -296,12 +661,22 @@ def admin_dashboard():
             "pin_code": lot.pin_code,
             "price": lot.price,
             "total_spots": lot.total_spots,
-            "available": available,
-            "occupied": occupied
+            "available": lot.available_count,
+            "occupied": lot.occupied_count
         })
-
-    # Recent reservations (last 10)
-    recent_reservations = Reservation.query.order_by(Reservation.parking_time.desc()).limit(10).all()
+    available_spots = sum(lot.available_count for lot in lots)
+    occupied_spots = sum(lot.occupied_count for lot in lots)
+    total_spots = available_spots + occupied_spots
+
+    total_users = db.session.query(db.func.count(User.id)).filter(User.role == 'user').scalar()
+    total_revenue = rollups.total_revenue() or 0
+
+    # Recent reservations (last 10) with their user, spot and lot in one query
+    recent_reservations = Reservation.query \
+        .options(joinedload(Reservation.user), joinedload(Reservation.spot).joinedload(ParkingSpot.lot)) \
+        .order_by(Reservation.parking_time.desc()) \
+        .limit(10) \
+        .all()
     reservations_list = []
     for r in recent_reservations:
         lot_name = r.spot.lot.name if r.spot and r.spot.lot else "Deleted Lot"
@@ -328,50 +703,62 @@ def admin_dashboard():
 
 
 
-@app.route('/user/dashboard', methods=["GET"])
+@bp.route('/user/dashboard', methods=["GET"])
 @jwt_required()
-# @cache.cached(timeout=30)
+@cached_view(lambda identity: f"user:{identity['id']}", 'lot-details', per_user=True)
 def user_dashboard():
     user = get_jwt_identity()
     
     if user['role'] != 'user':
         return jsonify(message="Unauthorized"), 403
     
-    reservations = Reservation.query.filter_by(user_id=user['id']).order_by(Reservation.parking_time.desc()).all()
-
-    active = next((r for r in reservations if r.leaving_time is None), None)
+    # Three queries whatever the length of the history: the totals, the
+    # active reservation and the five latest, each joined to its lot.
+    total_reservations, total_spent = db.session.query(
+        func.count(Reservation.id), func.coalesce(func.sum(Reservation.cost), 0)) \
+        .filter(Reservation.user_id == user['id']) \
+        .one()
+
+    active = db.session.query(Reservation.spot_id, Reservation.parking_time, ParkingLot.name) \
+        .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id) \
+        .join(ParkingLot, ParkingSpot.lot_id == ParkingLot.id) \
+        .filter(Reservation.user_id == user['id'], Reservation.leaving_time.is_(None)) \
+        .first()
     active_info = None
     if active:
-        lot = db.session.get(ParkingLot, active.spot.lot_id)
         active_info = {
-            "lot_name": lot.name,
+            "lot_name": active.name,
             "spot_id": active.spot_id,
             "parked_since": active.parking_time
         }
 
-    total_spent = sum(r.cost for r in reservations if r.cost)
-    recent = []
-    for r in reservations[:5]:
-        lot = db.session.get(ParkingLot, r.spot.lot_id)
-        recent.append({
-            "lot": lot.name,
-            "spot_id": r.spot_id,
-            "start": r.parking_time,
-            "end": r.leaving_time,
-            "cost": r.cost
-        })
+    latest = db.session.query(Reservation.spot_id, Reservation.parking_time, Reservation.leaving_time,
+                              Reservation.cost, ParkingLot.name) \
+        .outerjoin(ParkingSpot, Reservation.spot_id == ParkingSpot.id) \
+        .outerjoin(ParkingLot, ParkingSpot.lot_id == ParkingLot.id) \
+        .filter(Reservation.user_id == user['id']) \
+        .order_by(Reservation.parking_time.desc(), Reservation.id.desc()) \
+        .limit(5)
+    recent = [{
+        "lot": r.name,
+        "spot_id": r.spot_id,
+        "start": r.parking_time,
+        "end": r.leaving_time,
+        "cost": r.cost
+    } for r in latest]
 
     return jsonify({
         "active_reservations": active_info,
-        "total_reservations": len(reservations),
+        "total_reservations": total_reservations,
         "total_amount_spent": total_spent,
         "recent_history": recent
     })
 
 
-@app.route('/user/lots', methods=['GET', 'OPTIONS'])
+@bp.route('/user/lots', methods=['GET', 'OPTIONS'])
 @jwt_required(optional=True)
-# @cache.cached(timeout=60, key_prefix='user_lots')
+@cached_view('lots')
+@read_only
 def get_user_lots():
     if request.method == 'OPTIONS':
         return '', 200  # CORS preflight success response
@@ -379,42 +766,150 @@ def get_user_lots():
     lots = ParkingLot.query.all()
     result = []
     for lot in lots:
-        available_spots = ParkingSpot.query.filter_by(lot_id=lot.id, status='A').count()
         result.append({
             "id": lot.id,
             "name": lot.name,
             "address": lot.address,
             "price": lot.price,
-            "available_spots": available_spots
+            "available_spots": lot.available_count
         })
     return jsonify(lots=result)
 
-@app.route('/admin/reservations', methods=['GET'])
+
+@bp.route('/user/lots/search', methods=['GET'])
+@jwt_required(optional=True)
+@cached_view('lots')
+@read_only
+def search_user_lots():
+    # ?q=words in name/address &pin=pin code prefix &available=1 &limit=N
+    limit = request.args.get('limit', 20, type=int)
+    limit = max(1, min(limit, current_app.config['SEARCH_MAX_RESULTS']))
+    available_only = request.args.get('available', '').lower() in ('1', 'true', 'yes')
+    lots = search_lots(request.args.get('q', ''), request.args.get('pin', ''), available_only, limit)
+    return jsonify(lots=lots)
+
+
+def analytics_range():
+    # ?start=YYYY-MM-DD&end=YYYY-MM-DD (end inclusive), default the last 7 days.
+    # Raises ValueError on bad input.
+    today = datetime.utcnow().date()
+    start = datetime.fromisoformat(request.args.get('start') or (today - timedelta(days=6)).isoformat())
+    end = datetime.fromisoformat(request.args.get('end') or today.isoformat()) + timedelta(days=1)
+    if end <= start:
+        raise ValueError('end must not be before start')
+    return start, end
+
+
+@bp.route('/admin/analytics/usage', methods=['GET'])
 @jwt_required()
-@cache.cached(timeout=60, key_prefix='admin_reservations')
-def all_reservations():
+@cached_view('rollups', 'lot-details')
+@read_only
+def usage_analytics():
+    # Time series from the lot x hour rollups; ?lot_id= limits it to one lot,
+    # ?granularity=hour|day (hourly ranges are capped at 31 days).
     user = get_jwt_identity()
     if user['role'] != 'admin':
         return jsonify(message="Unauthorized"), 403
+    try:
+        start, end = analytics_range()
+        lot_id = request.args.get('lot_id', type=int)
+        granularity = request.args.get('granularity', 'day')
+        if granularity not in ('hour', 'day'):
+            raise ValueError('granularity must be hour or day')
+        if granularity == 'hour' and end - start > timedelta(days=31):
+            raise ValueError('hourly ranges are limited to 31 days')
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
+
+    spots = db.session.query(db.func.coalesce(db.func.sum(ParkingLot.total_spots), 0))
+    if lot_id is not None:
+        spots = spots.filter(ParkingLot.id == lot_id)
+    capacity = spots.scalar() * (60 if granularity == 'hour' else 1440)
+
+    series = []
+    for bucket, bookings, minutes, revenue, peak in rollups.usage_series(start, end, lot_id, granularity):
+        series.append({
+            "bucket": str(bucket),
+            "bookings": bookings,
+            "occupied_minutes": round(minutes, 1),
+            "revenue": round(revenue, 2),
+            "peak_occupancy": peak,
+            "utilisation": round(minutes / capacity, 4) if capacity else None
+        })
+    return jsonify(start=start.date().isoformat(), end=(end - timedelta(days=1)).date().isoformat(),
+                   granularity=granularity, lot_id=lot_id, series=series)
 
-    reservations = Reservation.query.order_by(Reservation.parking_time.desc()).all()
-    output = []
-    for r in reservations:
-        lot_name = r.spot.lot.name if r.spot and r.spot.lot else "Deleted Lot"
-        output.append({
-            "reservation_id": r.id,
-            "username": r.user.username,
-            "lot":lot_name,
-            "spot_id": r.spot_id,
-            "start": r.parking_time,
-            "end": r.leaving_time,
-            "cost": r.cost or 0
+
+@bp.route('/admin/analytics/lots', methods=['GET'])
+@jwt_required()
+@cached_view('rollups', 'lot-details')
+@read_only
+def lot_analytics():
+    # Per-lot totals over ?start=&end= from the rollups.
+    user = get_jwt_identity()
+    if user['role'] != 'admin':
+        return jsonify(message="Unauthorized"), 403
+    try:
+        start, end = analytics_range()
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
+
+    lots = {lot.id: lot for lot in ParkingLot.query.all()}
+    minutes_in_range = (end - start).total_seconds() / 60
+    result = []
+    for lot_id, bookings, minutes, revenue, peak in rollups.usage_by_lot(start, end):
+        lot = lots.get(lot_id)
+        capacity = lot.total_spots * minutes_in_range if lot else 0
+        result.append({
+            "lot_id": lot_id,
+            "name": lot.name if lot else "Deleted Lot",
+            "bookings": bookings,
+            "occupied_minutes": round(minutes, 1),
+            "revenue": round(revenue, 2),
+            "peak_occupancy": peak,
+            "utilisation": round(minutes / capacity, 4) if capacity else None
         })
+    return jsonify(start=start.date().isoformat(), end=(end - timedelta(days=1)).date().isoformat(),
+                   lots=result)
+
+
+@bp.route('/events/lots', methods=['GET'])
+def lot_events():
+    # Server-Sent Events: a snapshot of every lot's counters, then one event
+    # per change. Public, like the lot listing.
+    config = current_app.config
+    subscription = get_broker().subscribe(subscriber_limit(config))
+    if subscription is None:
+        retry = config['SSE_FULL_RETRY_SECONDS']
+        return Response(f"retry: {retry * 1000}\n\n", status=503, mimetype='text/event-stream',
+                        headers={'Retry-After': str(retry)})
+    snapshot = lot_states()
+    return Response(stream(subscription, snapshot, config['SSE_KEEPALIVE_SECONDS'],
+                           config['SSE_MAX_STREAM_SECONDS']),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@bp.route('/admin/reservations', methods=['GET'])
+@jwt_required()
+@cached_view('reservations')
+@read_only
+def all_reservations():
+    user = get_jwt_identity()
+    if user['role'] != 'admin':
+        return jsonify(message="Unauthorized"), 403
 
-    return jsonify(reservations=output)
+    return paginated_response(reservation_rows(), lambda r: {
+        "reservation_id": r.id,
+        "username": r.username,
+        "lot": r.lot_name or "Deleted Lot",
+        "spot_id": r.spot_id,
+        "start": r.parking_time,
+        "end": r.leaving_time,
+        "cost": r.cost or 0
+    }, 'reservations')
 
 
-@app.route('/run-task', methods=['POST'])
+@bp.route('/run-task', methods=['POST'])
 def run_task():
     from tasks import sample_task
     data = request.get_json()
@@ -422,7 +917,7 @@ def run_task():
     task = sample_task.delay(name)
     return jsonify({"message": "Task queued", "task_id": task.id}), 202
 
-@app.route('/task-status/<task_id>')
+@bp.route('/task-status/<task_id>')
 def task_status(task_id):
     from celery.result import AsyncResult
     from celery_worker import celery
@@ -430,7 +925,7 @@ def task_status(task_id):
     return jsonify({"task_id": task_id, "status": result.status, "result": result.result})
 
 #Test Email Task
-@app.route('/send-test-email', methods=['POST'])
+@bp.route('/send-test-email', methods=['POST'])
 def send_test_email():
     data = request.get_json()
     recipient = data.get('email', 'test@example.com')
@@ -444,35 +939,69 @@ def send_test_email():
     return jsonify({"message": "Email task queued!", "task_id": task.id}), 202
 
 #Trigger Daily Reminder
-@app.route('/send-daily-reminder', methods=['POST'])
+@bp.route('/send-daily-reminder', methods=['POST'])
 def trigger_daily_reminder():
     from tasks import send_daily_reminder
     task = send_daily_reminder.delay()
     return jsonify({"message": "Daily reminder task queued!", "task_id": task.id}), 202
 
 #Trigger Monthly Report
-@app.route('/send-monthly-report', methods=['POST'])
+@bp.route('/send-monthly-report', methods=['POST'])
 def trigger_monthly_report():
     from tasks import send_monthly_report
-    task = send_monthly_report.delay()
+    data = request.get_json(silent=True) or {}
+    task = send_monthly_report.delay(data.get('year'), data.get('month'))
     return jsonify({"message": "Monthly report task queued!", "task_id": task.id}), 202
 
-@app.route('/user/export', methods=['POST'])
+@bp.route('/user/export', methods=['POST'])
 @jwt_required()
 def export_csv():
     user = get_jwt_identity()
     if user['role'] != 'user':
         return jsonify(message='Unauthorized'), 403
     
+    data = request.get_json(silent=True) or {}
     from tasks import export_reservations_csv
-    export_reservations_csv.delay(user['id'], user['username'])
-
-    return jsonify(message="Your CSV export is being processed. You'll receive it via email.")
-
-if __name__== '__main__':
-    app.run(debug=True)   
+    task = export_reservations_csv.delay(user['id'], user['username'], compress=bool(data.get('gzip')))
 
+    return jsonify(message="Your CSV export is being processed. You'll receive it via email.",
+                   task_id=task.id)
 
+@bp.route('/admin/export', methods=['POST'])
+@jwt_required()
+def export_all_csv():
+    user = get_jwt_identity()
+    if user['role'] != 'admin':
+        return jsonify(message='Unauthorized'), 403
 
+    data = request.get_json(silent=True) or {}
+    try:
+        for key in ('start', 'end'):
+            if data.get(key):
+                datetime.fromisoformat(data[key])
+    except ValueError:
+        return jsonify(message='start and end must be ISO dates (YYYY-MM-DD)'), 400
 
+    from tasks import export_reservations_csv
+    task = export_reservations_csv.delay(None, user['username'], data.get('start'), data.get('end'),
+                                         compress=bool(data.get('gzip')))
+    return jsonify(message="Export queued. You'll receive it via email.", task_id=task.id), 202
+
+@bp.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    # Prometheus scrape target; keep it reachable from the monitoring network only.
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@bp.route('/exports/<name>', methods=['GET'])
+def download_export(name):
+    path = export_path(name)
+    if not path:
+        return jsonify(message='Export not found or expired'), 404
+    return send_file(path, as_attachment=True,
+                     download_name='parking_history.csv.gz' if name.endswith('.gz') else 'parking_history.csv')
 
+if __name__== '__main__':
+    app = create_app()
+    with app.app_context():
+        init_db()
+    app.run(debug=True)
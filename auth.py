@@ -0,0 +1,180 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from flask import current_app
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from caching import cache
+from extensions import jwt
+
+
+# Authentication helpers.
+#
+# Views trust the JWT identity ({id, username, role}) once the token has been
+# verified instead of re-reading the user row. Tokens can be revoked (/logout):
+# the jti is stored in the shared cache until the token would have expired.
+# To keep that check off the hot path, each process remembers recently seen
+# unrevoked jtis in an LRU for AUTH_IDENTITY_TTL seconds; a revocation from
+# another process therefore takes effect within that window.
+#
+# When the shared cache is unreachable the check follows
+# AUTH_REVOCATION_OUTAGE:
+#   open    (default) tokens are accepted unless they were revoked in this
+#           process; a logout through another process is not seen until the
+#           cache is back. Logins and browsing keep working through a Redis
+#           outage.
+#   closed  requests with a token not checked within AUTH_IDENTITY_TTL get a
+#           503 until the cache is back; no revoked token is ever accepted.
+# Logouts are always remembered in the process that served them, so the
+# revoking process keeps refusing the token even if the cache write failed.
+#
+# Password hashing runs in a bounded pool of PASSWORD_HASH_WORKERS threads
+# (hashlib releases the GIL, so hashes run in parallel on several cores) with
+# at most PASSWORD_HASH_QUEUE logins waiting; beyond that /login answers 503
+# instead of piling up blocked workers. Hashes made with anything other than
+# PASSWORD_HASH_METHOD are replaced on the next successful login. Under a
+# gevent worker (serving.py) the pool uses gevent's native threads, so a hash
+# does not stall the other requests of the worker.
+
+
+class HashingBusy(Exception):
+    pass
+
+
+class RevocationUnavailable(Exception):
+    pass
+
+
+class IdentityCache:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def fresh(self, jti, max_age):
+        with self._lock:
+            seen = self._entries.get(jti)
+            if seen is None or time.monotonic() - seen > max_age:
+                return False
+            self._entries.move_to_end(jti)
+            return True
+
+    def put(self, jti, size):
+        with self._lock:
+            self._entries[jti] = time.monotonic()
+            self._entries.move_to_end(jti)
+            while len(self._entries) > size:
+                self._entries.popitem(last=False)
+
+    def __contains__(self, jti):
+        with self._lock:
+            return jti in self._entries
+
+    def discard(self, jti):
+        with self._lock:
+            self._entries.pop(jti, None)
+
+
+identities = IdentityCache()
+revoked_here = IdentityCache()
+
+
+def _revoked_key(jti):
+    return f"revoked:{jti}"
+
+
+@jwt.token_in_blocklist_loader
+def is_revoked(jwt_header, jwt_payload):
+    config = current_app.config
+    jti = jwt_payload['jti']
+    if identities.fresh(jti, config['AUTH_IDENTITY_TTL']):
+        return False
+    if jti in revoked_here:
+        return True
+    try:
+        revoked = cache.get(_revoked_key(jti))
+    except Exception as e:
+        if config['AUTH_REVOCATION_OUTAGE'] == 'closed':
+            raise RevocationUnavailable() from e
+        print(f"[WARN] Cache unavailable, accepting token without a revocation check: {e}")
+        return False
+    if revoked:
+        return True
+    identities.put(jti, config['AUTH_IDENTITY_CACHE_SIZE'])
+    return False
+
+
+def revoke(jwt_payload):
+    jti = jwt_payload['jti']
+    identities.discard(jti)
+    revoked_here.put(jti, current_app.config['AUTH_IDENTITY_CACHE_SIZE'])
+    remaining = int(jwt_payload['exp'] - time.time()) + 1 if 'exp' in jwt_payload else 0
+    try:
+        cache.set(_revoked_key(jti), True, timeout=max(remaining, 0))
+    except Exception as e:
+        print(f"[WARN] Cache unavailable, logout only known to this process: {e}")
+
+
+_pool = None
+_slots = None
+_pool_lock = threading.Lock()
+
+
+def _executor_class():
+    # With threading monkey-patched, ThreadPoolExecutor would run greenlets
+    try:
+        from gevent import monkey
+    except ImportError:
+        return ThreadPoolExecutor
+    if monkey.is_module_patched('threading'):
+        from gevent.threadpool import ThreadPoolExecutor as NativeThreadPoolExecutor
+        return NativeThreadPoolExecutor
+    return ThreadPoolExecutor
+
+
+def _hash_call(fn, *args):
+    global _pool, _slots
+    with _pool_lock:
+        if _pool is None:
+            config = current_app.config
+            _pool = _executor_class()(max_workers=config['PASSWORD_HASH_WORKERS'],
+                                      thread_name_prefix='password-hash')
+            _slots = threading.BoundedSemaphore(config['PASSWORD_HASH_WORKERS']
+                                                + config['PASSWORD_HASH_QUEUE'])
+    if not _slots.acquire(blocking=False):
+        raise HashingBusy()
+    try:
+        return _pool.submit(fn, *args).result()
+    finally:
+        _slots.release()
+
+
+@lru_cache(maxsize=8)
+def _method_prefix(method):
+    # 'pbkdf2' -> 'pbkdf2:sha256:600000', the form stored in front of the salt
+    return generate_password_hash('', method).split('$', 1)[0]
+
+
+@lru_cache(maxsize=8)
+def _dummy_hash(method):
+    return generate_password_hash('unused', method)
+
+
+def hash_password(password):
+    return _hash_call(generate_password_hash, password, current_app.config['PASSWORD_HASH_METHOD'])
+
+
+def check_password(stored_hash, password):
+    # Unknown users are checked against a dummy hash so the response time
+    # does not tell which usernames exist.
+    if stored_hash is None:
+        _hash_call(check_password_hash, _dummy_hash(current_app.config['PASSWORD_HASH_METHOD']), password)
+        return False
+    return _hash_call(check_password_hash, stored_hash, password)
+
+
+def needs_rehash(stored_hash):
+    return stored_hash.split('$', 1)[0] != _method_prefix(current_app.config['PASSWORD_HASH_METHOD'])
@@ -0,0 +1,1500 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+
+# Benchmarks and stress checks for the parking API. Each command runs against a
+# throwaway SQLite database so it never touches instance/parking.db.
+#
+#   python benchmark.py reserve-stress --threads 300 --spots 120 --attempts 2
+#   python benchmark.py latency --reservations 1000000 --spots 50000
+#   python benchmark.py dashboard-queries --lots 5 200
+#   python benchmark.py rollups --reservations 100000 1000000
+#   python benchmark.py user-dashboard --history 10 1000 50000
+#   python benchmark.py pricing --stays 1000000
+#   python benchmark.py search --lots 1000 20000
+#   python benchmark.py sweep --reservations 100000 1000000     (needs: pip install fakeredis lupa)
+#   python benchmark.py provision --sizes 1000 10000 100000
+#   python benchmark.py mail --messages 5000     (needs: pip install aiosmtpd)
+#   python benchmark.py write-throughput --processes 4 --seconds 10
+#   python benchmark.py sse-fanout --clients 2000     (needs: pip install gunicorn gevent)
+#   python benchmark.py fleet --spots 50 500
+#   python benchmark.py startup [--repo ../other-checkout]
+#   python benchmark.py logins --methods scrypt pbkdf2:sha256:600000 --threads 8
+#   python benchmark.py conditional --lots 500 --reservations 20000
+#   python benchmark.py serving --clients 16 200 1000 --cache-latency-ms 2     (needs: pip install gunicorn gevent)
+#   python benchmark.py cache-outage --users 20 --rounds 5
+
+
+def make_app(db_path, cache_type='SimpleCache', mail_port=None):
+    from config import Config
+    Config.SQLALCHEMY_DATABASE_URI = f'sqlite:///{db_path}'
+    Config.CACHE_TYPE = cache_type
+    if mail_port:
+        Config.MAIL_SERVER = '127.0.0.1'
+        Config.MAIL_PORT = mail_port
+
+    from app import create_app, init_db
+    app = create_app(Config)
+    with app.app_context():
+        init_db()
+    return app
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(samples):
+    return {
+        'count': len(samples),
+        'p50_ms': round(percentile(samples, 50) * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3),
+    }
+
+
+def timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - start, result
+
+
+def free_port():
+    import socket
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def seed_users(app, count, prefix='user'):
+    from flask_jwt_extended import create_access_token
+    from models import db, User
+
+    with app.app_context():
+        users = [User(username=f'{prefix}{i}', password='x', role='user') for i in range(count)]
+        db.session.add_all(users)
+        db.session.commit()
+        return [create_access_token(identity={'id': u.id, 'username': u.username, 'role': u.role})
+                for u in users]
+
+
+def seed_lot(app, spots, name='Bench Lot'):
+    from models import db, ParkingLot, ParkingSpot
+
+    with app.app_context():
+        lot = ParkingLot(name=name, address='Bench Street', pin_code='600001',
+                         price=20.0, total_spots=spots, available_count=spots)
+        db.session.add(lot)
+        db.session.commit()
+        db.session.add_all([ParkingSpot(lot_id=lot.id) for _ in range(spots)])
+        db.session.commit()
+        return lot.id
+
+
+def reserve_stress(args):
+    # Three concurrent rounds against one lot, each user firing --attempts
+    # requests at once: plain reserves (a double-click), releases (a double
+    # release) and reserves that share an Idempotency-Key (a client retry).
+    # Afterwards every booking invariant is checked against the database.
+    workdir = tempfile.mkdtemp(prefix='parking-bench-')
+    app = make_app(os.path.join(workdir, 'stress.db'))
+
+    tokens = seed_users(app, args.threads)
+    lot_id = seed_lot(app, args.spots)
+    lock = threading.Lock()
+
+    def run_round(path, key=None):
+        barrier = threading.Barrier(len(tokens) * args.attempts)
+        results = [[] for _ in tokens]
+
+        def worker(index, token):
+            client = app.test_client()
+            headers = {'Authorization': f'Bearer {token}'}
+            if key:
+                headers['Idempotency-Key'] = f'{key}-{index}'
+            barrier.wait()
+            response = client.post(path, headers=headers)
+            with lock:
+                results[index].append((response.status_code, response.get_json(silent=True)))
+
+        threads = [threading.Thread(target=worker, args=(i, t))
+                   for i, t in enumerate(tokens) for _ in range(args.attempts)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    expected = min(args.threads, args.spots)
+    rounds = {}
+    failures = []
+
+    results = run_round(f'/user/reserve/{lot_id}')
+    wins = [sum(1 for status, _ in r if status == 201) for r in results]
+    rounds['double_reserve'] = dict(Counter(status for r in results for status, _ in r))
+    if max(wins) > 1:
+        failures.append('a user got two reservations from one double-click')
+    if sum(wins) != expected:
+        failures.append(f'{sum(wins)} reservations made, expected {expected}')
+
+    results = run_round('/user/release')
+    released = [sum(1 for status, _ in r if status == 200) for r in results]
+    rounds['double_release'] = dict(Counter(status for r in results for status, _ in r))
+    if released != wins:
+        failures.append('a reservation was released twice or not at all')
+
+    results = run_round(f'/user/reserve/{lot_id}', key='stress')
+    rounds['idempotent_reserve'] = dict(Counter(status for r in results for status, _ in r))
+    made = 0
+    for r in results:
+        ids = {body['reservation_id'] for status, body in r if status == 201}
+        if len(ids) > 1:
+            failures.append('an idempotent retry created a second reservation')
+        made += len(ids)
+    if made != expected:
+        failures.append(f'{made} idempotent reservations made, expected {expected}')
+
+    from models import db, ParkingLot, ParkingSpot, Reservation
+    with app.app_context():
+        active = Reservation.query.filter_by(leaving_time=None).all()
+        per_spot = Counter(r.spot_id for r in active)
+        per_user = Counter(r.user_id for r in active)
+        occupied = {s.id for s in ParkingSpot.query.filter_by(lot_id=lot_id, status='O')}
+        lot = db.session.get(ParkingLot, lot_id)
+        counters = (lot.available_count, lot.occupied_count)
+        closed = Reservation.query.filter(Reservation.leaving_time.isnot(None)).count()
+
+    invariants = {
+        'double_booked_spots': sum(1 for n in per_spot.values() if n > 1),
+        'users_with_two_active': sum(1 for n in per_user.values() if n > 1),
+        'occupied_without_reservation': len(occupied - set(per_spot)),
+        'reserved_spot_not_occupied': len(set(per_spot) - occupied),
+        'counter_mismatch': counters != (args.spots - len(occupied), len(occupied)),
+        'closed_reservations': closed,
+    }
+    if any(invariants[k] for k in invariants if k != 'closed_reservations'):
+        failures.append('database invariants violated')
+    if closed != sum(released):
+        failures.append('closed reservations do not match successful releases')
+
+    report = {
+        'threads': args.threads,
+        'attempts_per_user': args.attempts,
+        'spots': args.spots,
+        'responses': rounds,
+        'active_reservations': len(active),
+        'invariants': invariants,
+        'failures': failures,
+    }
+    print(json.dumps(report, indent=2))
+    return 1 if failures else 0
+
+
+def sqlite_datetime(value):
+    # The storage format SQLAlchemy's SQLite DateTime type uses.
+    return value.isoformat(' ', 'microseconds')
+
+
+def seed_history(app, lots, spots, users, reservations):
+    # Raw executemany keeps seeding a million rows in the tens of seconds.
+    from flask_jwt_extended import create_access_token
+    from models import db
+
+    rng = random.Random(42)
+    spots_per_lot = spots // lots
+    start = datetime(2024, 1, 1)
+
+    with app.app_context():
+        conn = db.engine.raw_connection()
+        try:
+            cur = conn.cursor()
+            cur.executemany('INSERT INTO parking_lot (id, name, address, pin_code, price, total_spots, '
+                            'available_count) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            [(i, f'Lot {i}', f'{i} Bench Street', f'{600000 + i}', 20.0,
+                              spots_per_lot, spots_per_lot)
+                             for i in range(1, lots + 1)])
+            cur.executemany('INSERT INTO parking_spot (id, lot_id, status) VALUES (?, ?, ?)',
+                            [(i, (i - 1) // spots_per_lot + 1, 'A')
+                             for i in range(1, spots_per_lot * lots + 1)])
+            cur.executemany('INSERT INTO user (username, password, role) VALUES (?, ?, ?)',
+                            [(f'bench{i}', 'x', 'user') for i in range(users)])
+            user_ids = [row[0] for row in cur.execute("SELECT id FROM user WHERE role = 'user'")]
+
+            batch = []
+            for i in range(reservations):
+                parked = start + timedelta(minutes=rng.randrange(0, 60 * 24 * 365))
+                left = parked + timedelta(minutes=rng.randrange(10, 600))
+                batch.append((rng.randrange(1, spots_per_lot * lots + 1), rng.choice(user_ids),
+                              sqlite_datetime(parked), sqlite_datetime(left),
+                              round(rng.uniform(5, 200), 2)))
+                if len(batch) == 50000:
+                    cur.executemany('INSERT INTO reservation (spot_id, user_id, parking_time, leaving_time, cost) '
+                                    'VALUES (?, ?, ?, ?, ?)', batch)
+                    batch = []
+            if batch:
+                cur.executemany('INSERT INTO reservation (spot_id, user_id, parking_time, leaving_time, cost) '
+                                'VALUES (?, ?, ?, ?, ?)', batch)
+            conn.commit()
+        finally:
+            conn.close()
+
+        admin = create_access_token(identity={'id': 1, 'username': 'admin', 'role': 'admin'})
+        tokens = [create_access_token(identity={'id': uid, 'username': f'bench{uid}', 'role': 'user'})
+                  for uid in user_ids]
+    return admin, tokens
+
+
+def measure_endpoints(app, admin_token, user_tokens, lots, samples):
+    rng = random.Random(7)
+    client = app.test_client()
+    timings = {'reserve_spot': [], 'release_spot': [], 'admin_dashboard': [], 'user_reservations': []}
+
+    for token in rng.sample(user_tokens, min(samples, len(user_tokens))):
+        headers = {'Authorization': f'Bearer {token}'}
+        elapsed, response = timed(lambda: client.post(f'/user/reserve/{rng.randint(1, lots)}', headers=headers))
+        assert response.status_code == 201, response.get_json()
+        timings['reserve_spot'].append(elapsed)
+        elapsed, response = timed(lambda: client.post('/user/release', headers=headers))
+        assert response.status_code == 200, response.get_json()
+        timings['release_spot'].append(elapsed)
+        elapsed, _ = timed(lambda: client.get('/user/reservations', headers=headers))
+        timings['user_reservations'].append(elapsed)
+
+    headers = {'Authorization': f'Bearer {admin_token}'}
+    for _ in range(max(1, samples // 10)):
+        elapsed, _ = timed(lambda: client.get('/admin/dashboard', headers=headers))
+        timings['admin_dashboard'].append(elapsed)
+
+    return {name: summarize(values) for name, values in timings.items()}
+
+
+def latency(args):
+    from sqlalchemy import text
+    from migrations import upgrade
+    from models import db
+
+    workdir = tempfile.mkdtemp(prefix='parking-bench-')
+    app = make_app(os.path.join(workdir, 'latency.db'), cache_type='NullCache')
+
+    seed_start = time.perf_counter()
+    admin_token, user_tokens = seed_history(app, args.lots, args.spots, args.users, args.reservations)
+    seed_seconds = time.perf_counter() - seed_start
+
+    # "Before": the same database as it looked before the indexes were declared.
+    with app.app_context():
+        with db.engine.begin() as conn:
+            for table in db.metadata.sorted_tables:
+                for index in table.indexes:
+                    conn.execute(text(f'DROP INDEX IF EXISTS {index.name}'))
+            conn.execute(text('DROP TABLE IF EXISTS schema_version'))
+    before = measure_endpoints(app, admin_token, user_tokens, args.lots, args.samples)
+
+    with app.app_context():
+        migrate_seconds, applied = timed(upgrade)
+    after = measure_endpoints(app, admin_token, user_tokens, args.lots, args.samples)
+
+    print(json.dumps({
+        'lots': args.lots,
+        'spots': args.spots,
+        'users': args.users,
+        'reservations': args.reservations,
+        'seed_seconds': round(seed_seconds, 1),
+        'migrations_applied': applied,
+        'migrate_seconds': round(migrate_seconds, 2),
+        'before': before,
+        'after': after,
+    }, indent=2))
+    return 0
+
+
+class StatementCounter:
+    # Counts SQL statements issued on the app's engine while active.
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        from sqlalchemy import event
+        event.listen(self.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        from sqlalchemy import event
+        event.remove(self.engine, 'before_cursor_execute', self._on_execute)
+
+
+def dashboard_queries(args):
+    from models import db
+
+    workdir = tempfile.mkdtemp(prefix='parking-bench-')
+    app = make_app(os.path.join(workdir, 'dashboard.db'), cache_type='NullCache')
+    client = app.test_client()
+    with app.app_context():
+        from flask_jwt_extended import create_access_token
+        token = create_access_token(identity={'id': 1, 'username': 'admin', 'role': 'admin'})
+    headers = {'Authorization': f'Bearer {token}'}
+    tokens = seed_users(app, 10)
+
+    counts = {}
+    seeded = 0
+    for lots in sorted(args.lots):
+        for i in range(seeded, lots):
+            lot_id = seed_lot(app, args.spots, name=f'Lot {i}')
+            client.post(f'/user/reserve/{lot_id}', headers={'Authorization': f'Bearer {tokens[i % 10]}'})
+        seeded = lots
+        client.get('/admin/dashboard', headers=headers)  # warm-up
+        with app.app_context():
+            with StatementCounter(db.engine) as counter:
+                response = client.get('/admin/dashboard', headers=headers)
+        assert response.status_code == 200
+        assert response.get_json()['total_lots'] == lots
+        counts[lots] = counter.count
+
+    print(json.dumps({'statements_per_dashboard': counts}, indent=2))
+    return 0 if len(set(counts.values())) == 1 else 1
+
+
+def user_dashboard(args):
+    # Uncached /user/dashboard for users whose histories differ in length;
+    # time and statement count should not grow with the history.
+    from models import db, Reservation
+
+    workdir = tempfile.mkdtemp(prefix='parking-bench-')
+    app = make_app(os.path.join(workdir, 'user-dashboard.db'), cache_type='NullCache')
+    lot_id = seed_lot(app, 100)
+    tokens = seed_users(app, len(args.history))
+    client = app.test_client()
+    start = datetime(2024, 1, 1)
+
+    report = {}
+    for i, (size, token) in enumerate(zip(sorted(args.history), tokens)):
+        headers = {'Authorization': f'Bearer {token}'}
+        with app.app_context():
+            user_id = i + 2  # after the admin
+            db.session.execute(Reservation.__table__.insert(), [{
+                'spot_id': 1 + n % 100, 'user_id': user_id,
+                'parking_time': start + timedelta(hours=n),
+                'leaving_time': start + timedelta(hours=n, minutes=30), 'cost': 10.0,
+            } for n in range(size)])
+            db.session.commit()
+        assert client.post(f'/user/reserve/{lot_id}', headers=headers).status_code == 201
+
+        response = client.get('/user/dashboard', headers=headers)
+        assert response.get_json()['total_reservations'] == size + 1
+        samples = [timed(lambda: client.get('/user/dashboard', headers=headers))[0]
+                   for _ in range(args.samples)]
+        with app.app_context():
+            with StatementCounter(db.engine) as counter:
+                client.get('/user/dashboard', headers=headers)
+        report[size] = {**summarize(samples), 'statements': counter.count}
+
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+def rollup_dashboard(args):
+    # /admin/dashboard (uncached) as reservation history grows: the revenue
+    # total from a full SUM(cost) versus the rollup watermark, plus how long
+    # the rollup task takes to fold the history.
+    from sqlalchemy import func
+    from models import db, Reservation
+    import rollups
+
+    report = {}
+    for size in sorted(args.reservations):
+        workdir = tempfile.mkdtemp(prefix='parking-bench-')
+        app = make_app(os.path.join(workdir, 'rollup.db'), cache_type='NullCache')
+        admin_token, _ = seed_history(app, args.lots, args.lots * 50, 1000, size)
+        client = app.test_client()
+        headers = {'Authorization': f'Bearer {admin_token}'}
+
+        with app.app_context():
+            def full_sum():
+                return db.session.query(func.sum(Reservation.cost)).scalar()
+            sum_samples = [timed(full_sum)[0] for _ in range(args.samples)]
+            fold_seconds, _ = timed(rollups.run_rollup)
+            rollup_samples = [timed(rollups.total_revenue)[0] for _ in range(args.samples)]
+
+        dashboard = [timed(lambda: client.get('/admin/dashboard', headers=headers))[0]
+                     for _ in range(args.samples)]
+        report[size] = {
+            'revenue_full_sum': summarize(sum_samples),
+            'revenue_from_rollups': summarize(rollup_samples),
+            'dashboard': summarize(dashboard),
+            'initial_fold_seconds': round(fold_seconds, 2),
+        }
+
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+BENCH_TARIFF = {
+    'periods': [
+        {'days': ['sat', 'sun'], 'rate': 20},
+        {'days': ['mon', 'tue', 'wed', 'thu', 'fri'], 'from': '08:00', 'to': '20:00', 'rate': 60},
+        {'from': '22:00', 'to': '06:00', 'rate': 10},
+    ],
+    'tiers': [{'after_minutes': 180, 'multiplier': 0.5}],
+    'daily_cap': 300,
+    'grace_minutes': 10,
+}
+
+
+def pricing_batch(args):
+    # Prices the same random stays one at a time (what a loop over the
+    # reservation history costs) and in one price_many() call, and checks
+    # that both agree. The loop only runs over the first --loop-stays.
+    import numpy as np
+    import pricing
+
+    spec = pricing.compile_tariff(BENCH_TARIFF, 40)
+    rng = np.random.default_rng(7)
+    origin = np.datetime64('2024-01-01T00:00:00')
+    starts = origin + rng.integers(0, 365 * 24 * 3600, args.stays).astype('timedelta64[s]')
+    ends = starts + (rng.exponential(180, args.stays) * 60).astype('int64').astype('timedelta64[s]')
+
+    loop_count = min(args.loop_stays, args.stays)
+    loop_starts = starts[:loop_count].astype(datetime)
+    loop_ends = ends[:loop_count].astype(datetime)
+    loop_seconds, looped = timed(lambda: [
+        pricing.price_stay(spec, 40, start, end, args.timezone)
+        for start, end in zip(loop_starts, loop_ends)])
+    vector_seconds, vectorised = timed(lambda: pricing.price_many(spec, 40, starts, ends, args.timezone))
+
+    # Float noise can round a half-cent tie either way
+    mismatches = int(np.count_nonzero(np.abs(vectorised[:loop_count] - np.array(looped)) > 0.011))
+    print(json.dumps({
+        'stays': args.stays,
+        'loop': {'stays': loop_count, 'seconds': round(loop_seconds, 3),
+                 'stays_per_second': round(loop_count / loop_seconds)},
+        'vectorised': {'stays': args.stays, 'seconds': round(vector_seconds, 3),
+                       'stays_per_second': round(args.stays / vector_seconds)},
+        'mismatches': mismatches,
+    }, indent=2))
+    return 1 if mismatches else 0
+
+
+CITIES = ['Chennai', 'Bengaluru', 'Mumbai', 'Delhi', 'Hyderabad', 'Pune', 'Kolkata', 'Jaipur']
+STREETS = ['MG Road', 'Anna Salai', 'Link Road', 'Park Street', 'Ring Road', 'Station Road',
+           'Church Street', 'Lake View', 'Market Lane', 'Temple Street']
+
+
+def lot_search(args):
+    # /user/lots/search against the full /user/lots listing the client used
+    # to filter, uncached, as the number of lots grows.
+    from sqlalchemy import insert
+    from models import db, ParkingLot
+    from search import lot_index
+
+    rng = random.Random(11)
+    report = {}
+    for size in sorted(args.lots):
+        workdir = tempfile.mkdtemp(prefix='parking-bench-')
+        app = make_app(os.path.join(workdir, 'search.db'), cache_type='NullCache')
+        with app.app_context():
+            db.session.execute(insert(ParkingLot), [{
+                'name': f'{rng.choice(STREETS)} Parking {i}',
+                'address': f'{rng.randint(1, 400)} {rng.choice(STREETS)}, {rng.choice(CITIES)}',
+                'pin_code': str(rng.randint(100000, 999999)),
+                'price': 20.0, 'total_spots': 10, 'available_count': rng.choice([0, 5]),
+            } for i in range(size)])
+            db.session.commit()
+            build_seconds, _ = timed(lot_index.rebuild)
+
+        client = app.test_client()
+        client.get('/user/lots/search?q=warm')  # records the cache version
+        queries = ['q=anna+salai+chennai', 'q=park&available=1', 'pin=56', 'q=lake+view&pin=6',
+                   'q=parking+12', 'q=mg']
+        listing = [timed(lambda: client.get('/user/lots'))[0] for _ in range(args.samples)]
+        searches = {}
+        for query in queries:
+            samples = []
+            for _ in range(args.samples):
+                seconds, response = timed(lambda: client.get(f'/user/lots/search?{query}'))
+                assert response.status_code == 200
+                samples.append(seconds)
+            searches[query] = summarize(samples)
+        report[size] = {
+            'index_build_seconds': round(build_seconds, 3),
+            'full_listing': summarize(listing),
+            'search': searches,
+        }
+
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+def expiry_sweep(args):
+    # Time of one expiry sweep over --expired overdue reservations among
+    # --active active ones, as the closed history grows, plus a check that
+    # spots and lot counters end up consistent.
+    import fakeredis
+    from sqlalchemy import func, text
+    from models import db, ParkingLot, ParkingSpot, Reservation
+    from occupancy import find_drift
+    import expiry
+
+    report = {}
+    for size in sorted(args.reservations):
+        workdir = tempfile.mkdtemp(prefix='parking-bench-')
+        app = make_app(os.path.join(workdir, 'sweep.db'), cache_type='NullCache')
+        seed_history(app, args.lots, args.active, args.active, size)
+        now = datetime.utcnow()
+        with app.app_context():
+            user_ids = [uid for (uid,) in db.session.execute(text("SELECT id FROM user WHERE role = 'user'"))]
+            rows = []
+            for i, user_id in enumerate(user_ids[:args.active]):
+                overdue = i < args.expired
+                parked = now - timedelta(hours=30 if overdue else 1)
+                rows.append({'spot_id': i + 1, 'user_id': user_id, 'parking_time': parked,
+                             'expires_at': parked + timedelta(hours=24), 'cost': 0.0})
+            db.session.execute(Reservation.__table__.insert(), rows)
+            db.session.execute(text("UPDATE parking_spot SET status = 'O' WHERE id <= :n"), {'n': len(rows)})
+            db.session.commit()
+            from occupancy import reconcile
+            reconcile()
+            db.session.execute(text('ANALYZE'))
+            db.session.commit()
+
+            plan = [row[-1] for row in db.session.execute(text(
+                'EXPLAIN QUERY PLAN SELECT id FROM reservation WHERE leaving_time IS NULL '
+                'AND expires_at <= :now ORDER BY expires_at LIMIT 500'), {'now': now})]
+            seconds, closed = timed(lambda: expiry.sweep(now=now, client=fakeredis.FakeRedis()))
+            report[size] = {
+                'closed': len(closed),
+                'seconds': round(seconds, 3),
+                'still_active': db.session.query(func.count(Reservation.id))
+                    .filter(Reservation.leaving_time.is_(None)).scalar(),
+                'occupied_spots': db.session.query(func.count(ParkingSpot.id))
+                    .filter(ParkingSpot.status == 'O').scalar(),
+                'occupied_count': db.session.query(func.sum(ParkingLot.occupied_count)).scalar(),
+                'counter_drift': len(find_drift()),
+                'plan': plan,
+            }
+
+    print(json.dumps(report, indent=2))
+    consistent = all(r['closed'] == args.expired and r['counter_drift'] == 0
+                     and r['still_active'] == r['occupied_spots'] == r['occupied_count']
+                     for r in report.values())
+    return 0 if consistent else 1
+
+
+def provision(args):
+    import tracemalloc
+    from flask_jwt_extended import create_access_token
+    from models import db, ParkingLot, ParkingSpot
+
+    workdir = tempfile.mkdtemp(prefix='parking-bench-')
+    app = make_app(os.path.join(workdir, 'provision.db'), cache_type='NullCache')
+    client = app.test_client()
+    with app.app_context():
+        token = create_access_token(identity={'id': 1, 'username': 'admin', 'role': 'admin'})
+    headers = {'Authorization': f'Bearer {token}'}
+
+    def one_at_a_time(size):
+        # The previous create_lot: commit the lot, then one ORM object per spot.
+        with app.app_context():
+            lot = ParkingLot(name=f'Legacy {size}', address='Bench Street', pin_code='600001',
+                             price=20.0, total_spots=size)
+            db.session.add(lot)
+            db.session.commit()
+            for _ in range(size):
+                db.session.add(ParkingSpot(lot_id=lot.id))
+            db.session.commit()
+
+    def bulk(size):
+        response = client.post('/admin/lots', headers=headers, json={
+            'name': f'Bulk {size}', 'address': 'Bench Street', 'pin_code': '600001',
+            'price': 20.0, 'total_spots': size})
+        assert response.status_code == 201, response.get_json()
+        return response
+
+    def measure(fn, size):
+        tracemalloc.start()
+        elapsed, _ = timed(lambda: fn(size))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return {'seconds': round(elapsed, 3), 'peak_mb': round(peak / 2 ** 20, 1)}
+
+    results = {}
+    for size in args.sizes:
+        results[size] = {'bulk': measure(bulk, size)}
+        if not args.skip_baseline:
+            results[size]['one_at_a_time'] = measure(one_at_a_time, size)
+
+    lot_id = client.get('/admin/lots', headers=headers).get_json()['lots'][0]['id']
+    largest = max(args.sizes)
+    for target in (largest * 2, largest // 2):
+        elapsed, response = timed(lambda: client.put(f'/admin/lots/{lot_id}', headers=headers,
+                                                     json={'total_spots': target}))
+        assert response.status_code == 200, response.get_json()
+        results[f'resize_to_{target}'] = {'seconds': round(elapsed, 3)}
+
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+def mail_throughput(args):
+    try:
+        from aiosmtpd.controller import Controller
+    except ImportError:
+        print('benchmark.py mail needs a local SMTP sink: pip install aiosmtpd', file=sys.stderr)
+        return 2
+
+    class Sink:
+        # Accepts everything except recipients starting with "reject".
+        def __init__(self):
+            self.received = 0
+
+        async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+            if address.startswith('reject'):
+                return '550 mailbox unavailable'
+            envelope.rcpt_tos.append(address)
+            return '250 OK'
+
+        async def handle_DATA(self, server, session, envelope):
+            self.received += 1
+            return '250 Message accepted'
+
+    port = free_port()
+    sink = Sink()
+    controller = Controller(sink, hostname='127.0.0.1', port=port)
+    controller.start()
+    try:
+        workdir = tempfile.mkdtemp(prefix='parking-bench-')
+        app = make_app(os.path.join(workdir, 'mail.db'), mail_port=port)
+        app.config['MAIL_RETRY_BACKOFF'] = 0
+
+        from flask_mail import Message
+        from extensions import mail
+        from mailing import chunked, merge_results, send_messages, user_email
+
+        messages = [{'subject': 'Daily Parking Reminder',
+                     'recipients': [user_email(('reject' if i % 100 == 0 else 'user') + str(i))],
+                     'body': "Don't forget to reserve your parking spot today!"}
+                    for i in range(args.messages)]
+
+        def batched():
+            with app.app_context():
+                return merge_results([send_messages(mail, chunk)
+                                      for chunk in chunked(messages, args.batch_size)], 'batched')
+
+        def one_connection_per_message():
+            sent = failed = 0
+            with app.app_context():
+                for data in messages:
+                    try:
+                        mail.send(Message(subject=data['subject'], recipients=data['recipients'],
+                                          body=data['body']))
+                        sent += 1
+                    except Exception:
+                        failed += 1
+            return {'sent': sent, 'failed': failed}
+
+        results = {}
+        for name, fn in (('batched', batched), ('one_connection_per_message', one_connection_per_message)):
+            elapsed, outcome = timed(fn)
+            results[name] = {'seconds': round(elapsed, 2),
+                             'messages_per_second': round(args.messages / elapsed, 1),
+                             'sent': outcome['sent'], 'failed': outcome['failed']}
+        results['sink_received'] = sink.received
+    finally:
+        controller.stop()
+
+    print(json.dumps(results, indent=2))
+    return 0
+
+
+STARTUP_PROBE = """
+import json, os, sys, tempfile, time
+start = time.perf_counter()
+import tasks
+import_seconds = time.perf_counter() - start
+if sys.argv[1] == 'import':
+    print(json.dumps({'import_seconds': import_seconds}))
+    sys.exit()
+
+from config import Config
+Config.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'startup.db')
+Config.CACHE_TYPE = 'NullCache'
+try:
+    from app import create_app, init_db
+    app = create_app(Config)
+    with app.app_context():
+        init_db()
+except ImportError:
+    from app import app  # trees from before the app factory
+from sqlalchemy import event
+from models import db
+
+client = app.test_client()
+client.get('/')
+statements = [0]
+with app.app_context():
+    event.listen(db.engine, 'before_cursor_execute', lambda *a: statements.__setitem__(0, statements[0] + 1))
+result = {}
+for path in ('/', '/user/lots'):
+    statements[0] = 0
+    n = int(sys.argv[2])
+    start = time.perf_counter()
+    for _ in range(n):
+        client.get(path)
+    result[path] = {'requests_per_second': round(n / (time.perf_counter() - start), 1),
+                    'statements_per_request': statements[0] / n}
+print(json.dumps(result))
+"""
+
+
+def fleet_booking(args):
+    # Booking and releasing N spots: N single /user/reserve + /user/release
+    # calls (one account each, as operators had to) against one /fleet call.
+    from flask_jwt_extended import create_access_token
+    from models import db, User
+    from occupancy import find_drift
+
+    report = {}
+    for size in sorted(args.spots):
+        workdir = tempfile.mkdtemp(prefix='parking-bench-')
+        app = make_app(os.path.join(workdir, 'fleet.db'), cache_type='NullCache')
+        lot_id = seed_lot(app, size)
+        tokens = seed_users(app, size)
+        with app.app_context():
+            operator = User(username='operator', password='x', role='fleet')
+            db.session.add(operator)
+            db.session.commit()
+            fleet_token = create_access_token(identity={'id': operator.id, 'username': 'operator',
+                                                        'role': 'fleet'})
+        client = app.test_client()
+
+        def singles(path):
+            for token in tokens:
+                response = client.post(path, headers={'Authorization': f'Bearer {token}'})
+                assert response.status_code in (200, 201), response.get_json()
+
+        headers = {'Authorization': f'Bearer {fleet_token}'}
+        single_reserve, _ = timed(lambda: singles(f'/user/reserve/{lot_id}'))
+        single_release, _ = timed(lambda: singles('/user/release'))
+        bulk_reserve, response = timed(lambda: client.post(
+            '/fleet/reserve', json={'lot_id': lot_id, 'count': size}, headers=headers))
+        assert response.get_json()['reserved'] == size, response.get_json()
+        batch_id = response.get_json()['batch_id']
+        bulk_release, response = timed(lambda: client.post(
+            '/fleet/release', json={'batch_id': batch_id}, headers=headers))
+        assert response.get_json()['released'] == size, response.get_json()
+        with app.app_context():
+            drift = find_drift()
+
+        report[size] = {
+            'single_reserve_seconds': round(single_reserve, 3),
+            'single_release_seconds': round(single_release, 3),
+            'fleet_reserve_seconds': round(bulk_reserve, 3),
+            'fleet_release_seconds': round(bulk_release, 3),
+            'reserve_speedup': round(single_reserve / bulk_reserve, 1),
+            'release_speedup': round(single_release / bulk_release, 1),
+            'counter_drift': len(drift),
+        }
+
+    print(json.dumps(report, indent=2))
+    return 0 if all(r['counter_drift'] == 0 for r in report.values()) else 1
+
+
+def logins(args):
+    # /login throughput per hashing method with --threads concurrent clients,
+    # reported per core of the hashing pool. Users start with a legacy hash so
+    # the first round also measures the rehash on login.
+    from werkzeug.security import generate_password_hash
+    from models import db, User
+    import auth
+
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    report = {'cores': cores, 'threads': args.threads}
+    for method in args.methods:
+        from config import Config
+        Config.PASSWORD_HASH_METHOD = method
+        Config.PASSWORD_HASH_WORKERS = min(args.threads, cores)
+        Config.PASSWORD_HASH_QUEUE = args.threads
+        auth._pool = None  # one pool per configuration
+        workdir = tempfile.mkdtemp(prefix='parking-bench-')
+        app = make_app(os.path.join(workdir, 'logins.db'))
+        legacy = generate_password_hash('secret', 'pbkdf2:sha256:1000')
+        with app.app_context():
+            db.session.add_all([User(username=f'login{i}', password=legacy, role='user')
+                                for i in range(args.users)])
+            db.session.commit()
+
+        def run(seconds):
+            counts = Counter()
+            deadline = time.perf_counter() + seconds
+
+            def client_loop(offset):
+                client = app.test_client()
+                i = offset
+                while time.perf_counter() < deadline:
+                    response = client.post('/login', json={'username': f'login{i % args.users}',
+                                                           'password': 'secret'})
+                    counts[response.status_code] += 1
+                    i += args.threads
+
+            threads = [threading.Thread(target=client_loop, args=(n,)) for n in range(args.threads)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            return counts, time.perf_counter() - start
+
+        rehash_seconds, _ = timed(lambda: [app.test_client().post(
+            '/login', json={'username': f'login{i}', 'password': 'secret'}) for i in range(args.users)])
+        counts, elapsed = run(args.seconds)
+        with app.app_context():
+            upgraded = db.session.query(User).filter(
+                User.role == 'user', User.password.like(f"{auth._method_prefix(method)}$%")).count()
+        per_second = counts[200] / elapsed
+        report[method] = {
+            'logins_per_second': round(per_second, 1),
+            'logins_per_second_per_core': round(per_second / Config.PASSWORD_HASH_WORKERS, 1),
+            'statuses': dict(counts),
+            'first_login_with_rehash_ms': round(rehash_seconds / args.users * 1000, 1),
+            'rehashed_users': f'{upgraded}/{args.users}',
+        }
+
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+def conditional_get(args):
+    # Cached GETs as the frontend makes them: a full 200 from the view cache
+    # against a revalidation answered 304 from the ETag, the body sizes with
+    # and without gzip, and stdlib json against orjson for the same payloads.
+    from flask.json.provider import DefaultJSONProvider
+    from flask_jwt_extended import create_access_token
+    from sqlalchemy import insert
+    from models import db, ParkingLot, Reservation
+
+    workdir = tempfile.mkdtemp(prefix='parking-bench-')
+    app = make_app(os.path.join(workdir, 'conditional.db'))
+    lot_id = seed_lot(app, 100)
+    user_token = seed_users(app, 1)[0]
+    start = datetime(2024, 1, 1)
+    with app.app_context():
+        db.session.execute(insert(ParkingLot), [{
+            'name': f'Lot {i}', 'address': f'{i} {STREETS[i % len(STREETS)]}', 'pin_code': '600001',
+            'price': 20.0, 'total_spots': 10, 'available_count': 10,
+        } for i in range(args.lots)])
+        db.session.execute(insert(Reservation), [{
+            'spot_id': 1 + n % 100, 'user_id': 2, 'parking_time': start + timedelta(hours=n),
+            'leaving_time': start + timedelta(hours=n, minutes=30), 'cost': 10.0,
+        } for n in range(args.reservations)])
+        db.session.commit()
+        admin_token = create_access_token(identity={'id': 1, 'username': 'admin', 'role': 'admin'})
+        stdlib = DefaultJSONProvider(app)
+
+    client = app.test_client()
+    endpoints = {
+        '/admin/dashboard': admin_token,
+        '/admin/reservations?limit=100': admin_token,
+        '/user/lots': user_token,
+    }
+    report = {'lots': args.lots + 1, 'reservations': args.reservations, 'lot_id': lot_id}
+    for path, token in endpoints.items():
+        headers = {'Authorization': f'Bearer {token}'}
+        first = client.get(path, headers=headers)
+        etag = first.headers['ETag']
+        full = [timed(lambda: client.get(path, headers=headers))[0] for _ in range(args.samples)]
+        revalidated = []
+        for _ in range(args.samples):
+            seconds, response = timed(lambda: client.get(
+                path, headers={**headers, 'If-None-Match': etag}))
+            assert response.status_code == 304
+            revalidated.append(seconds)
+        gzipped = client.get(path, headers={**headers, 'Accept-Encoding': 'gzip'})
+        assert gzipped.headers.get('Content-Encoding') == 'gzip'
+
+        payload = first.get_json()
+        with app.app_context():
+            encode_stdlib = [timed(lambda: stdlib.dumps(payload))[0] for _ in range(args.samples)]
+            encode_fast = [timed(lambda: app.json.dumps(payload))[0] for _ in range(args.samples)]
+        report[path] = {
+            'full_200': summarize(full),
+            'revalidated_304': summarize(revalidated),
+            'body_bytes': len(first.get_data()),
+            'gzip_bytes': len(gzipped.get_data()),
+            'encode_stdlib_json': summarize(encode_stdlib),
+            f'encode_{type(app.json).__name__}': summarize(encode_fast),
+        }
+
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+def startup(args):
+    import statistics
+    import subprocess
+
+    repo = os.path.abspath(args.repo)
+
+    def probe(*argv):
+        output = subprocess.run([sys.executable, '-c', STARTUP_PROBE, *argv], cwd=repo,
+                                capture_output=True, text=True, check=True).stdout
+        return json.loads(output.strip().splitlines()[-1])
+
+    imports = [probe('import')['import_seconds'] for _ in range(args.runs)]
+    report = {
+        'repo': repo,
+        'worker_import_seconds': {'median': round(statistics.median(imports), 3),
+                                  'min': round(min(imports), 3)},
+        'requests': probe('requests', str(args.requests)),
+    }
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+def cache_outage(args):
+    # The app with its Redis cache unreachable (a closed port), once per
+    # AUTH_REVOCATION_OUTAGE policy. Each user browses, books with a retried
+    # Idempotency-Key and releases; then one user logs out and reuses the
+    # token. No request may fail with a 500 and the reused token must be
+    # refused (401, or 503 when the policy is closed).
+    import contextlib
+    import io
+    import uuid
+    from config import Config
+
+    report = {}
+    for policy in args.policies:
+        Config.AUTH_REVOCATION_OUTAGE = policy
+        Config.CACHE_REDIS_HOST = '127.0.0.1'
+        Config.CACHE_REDIS_PORT = free_port()
+        Config.SLOW_REQUEST_MS = 10 ** 9
+        workdir = tempfile.mkdtemp(prefix='parking-bench-')
+        app = make_app(os.path.join(workdir, 'outage.db'), 'RedisCache')
+        lot_id = seed_lot(app, args.users)
+        tokens = seed_users(app, args.users)
+        statuses = {}
+        lock = threading.Lock()
+
+        def user_loop(token):
+            client = app.test_client()
+            headers = {'Authorization': f'Bearer {token}'}
+            local = Counter()
+            for _ in range(args.rounds):
+                retry = {**headers, 'Idempotency-Key': uuid.uuid4().hex}
+                for name, method, path, sent in (
+                        ('lots', 'get', '/user/lots', {}),
+                        ('search', 'get', '/user/lots/search?q=Bench', {}),
+                        ('reservations', 'get', '/user/reservations', headers),
+                        ('reserve', 'post', f'/user/reserve/{lot_id}', retry),
+                        ('reserve-retry', 'post', f'/user/reserve/{lot_id}', retry),
+                        ('release', 'post', '/user/release', headers)):
+                    local[(name, getattr(client, method)(path, headers=sent).status_code)] += 1
+            with lock:
+                for (name, status), count in local.items():
+                    statuses.setdefault(name, Counter())[status] += count
+
+        log = io.StringIO()
+        with contextlib.redirect_stdout(log):
+            threads = [threading.Thread(target=user_loop, args=(t,)) for t in tokens]
+            elapsed, _ = timed(lambda: ([t.start() for t in threads], [t.join() for t in threads]))
+            client = app.test_client()
+            headers = {'Authorization': f'Bearer {tokens[0]}'}
+            logout = client.post('/logout', headers=headers).status_code
+            reused = client.get('/user/reservations', headers=headers).status_code
+
+        report[policy] = {
+            'statuses': {name: dict(counts) for name, counts in statuses.items()},
+            'server_errors': sum(count for counts in statuses.values()
+                                 for status, count in counts.items() if status == 500),
+            'logout': logout,
+            'revoked_token_reused': reused,
+            'warnings': log.getvalue().count('[WARN]'),
+            'requests_per_second': round(sum(sum(c.values()) for c in statuses.values()) / elapsed, 1),
+        }
+    print(json.dumps(report, indent=2))
+    return 1 if any(r['server_errors'] or r['revoked_token_reused'] not in (401, 503)
+                    for r in report.values()) else 0
+
+
+SQLITE_MODES = {
+    # The pre-tuning defaults: rollback journal, fsync on every commit.
+    'legacy': {'SQLITE_JOURNAL_MODE': 'DELETE', 'SQLITE_SYNCHRONOUS': 'FULL', 'SQLITE_MMAP_SIZE': 0},
+    'tuned': {},
+}
+
+
+def write_worker(db_path, mode, user_ids, lot_id, seconds, threads, queue):
+    # One process: its threads loop reserve/release for their own users.
+    from config import Config
+    for key, value in SQLITE_MODES[mode].items():
+        setattr(Config, key, value)
+    Config.SQLALCHEMY_DATABASE_URI = f'sqlite:///{db_path}'
+    Config.CACHE_TYPE = 'SimpleCache'
+    Config.SLOW_REQUEST_MS = 10 ** 9
+
+    from flask_jwt_extended import create_access_token
+    from app import create_app
+    app = create_app(Config)
+    with app.app_context():
+        tokens = [create_access_token(identity={'id': i, 'username': f'user{i}', 'role': 'user'})
+                  for i in user_ids]
+
+    statuses = Counter()
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def loop(my_tokens):
+        client = app.test_client()
+        local = Counter()
+        while time.monotonic() < deadline:
+            for token in my_tokens:
+                headers = {'Authorization': f'Bearer {token}'}
+                for path in (f'/user/reserve/{lot_id}', '/user/release'):
+                    try:
+                        local[client.post(path, headers=headers).status_code] += 1
+                    except Exception as e:
+                        local[type(e).__name__] += 1
+        with lock:
+            statuses.update(local)
+
+    workers = [threading.Thread(target=loop, args=(tokens[i::threads],)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    queue.put(dict(statuses))
+
+
+def write_throughput(args):
+    import multiprocessing
+
+    ctx = multiprocessing.get_context('spawn')
+    users = args.processes * args.threads * 2
+    report = {'processes': args.processes, 'threads_per_process': args.threads,
+              'seconds': args.seconds, 'modes': {}}
+
+    for mode in args.modes:
+        workdir = tempfile.mkdtemp(prefix='parking-bench-')
+        db_path = os.path.join(workdir, 'writes.db')
+        app = make_app(db_path)
+        seed_users(app, users)
+        lot_id = seed_lot(app, users)
+        from models import db
+        with app.app_context():
+            db.engine.dispose()
+
+        queue = ctx.Queue()
+        ids = list(range(2, users + 2))   # id 1 is the seeded admin
+        procs = [ctx.Process(target=write_worker,
+                             args=(db_path, mode, ids[p::args.processes], lot_id,
+                                   args.seconds, args.threads, queue))
+                 for p in range(args.processes)]
+        for p in procs:
+            p.start()
+        totals = Counter()
+        for _ in procs:
+            totals.update(queue.get())
+        for p in procs:
+            p.join()
+
+        ok = totals.get(201, 0) + totals.get(200, 0)
+        report['modes'][mode] = {
+            'writes_per_second': round(ok / args.seconds, 1),
+            'responses': {str(k): v for k, v in totals.items()},
+            'errors': sum(v for k, v in totals.items() if k not in (200, 201)),
+        }
+
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+def sse_fanout(args):
+    # Starts one gunicorn gevent worker, parks --clients idle /events/lots
+    # streams on it, then reserves a spot and times how long the event takes
+    # to reach every stream. Needs: pip install gunicorn gevent
+    import selectors
+    import socket
+    import subprocess
+    import urllib.request
+
+    workdir = tempfile.mkdtemp(prefix='parking-bench-')
+    db_path = os.path.join(workdir, 'sse.db')
+    app = make_app(db_path)
+    token = seed_users(app, 1)[0]
+    lot_id = seed_lot(app, 10)
+
+    port = free_port()
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_path}', CACHE_TYPE='SimpleCache',
+               EVENTS_REDIS_URL='', SSE_MAX_SUBSCRIBERS=str(args.clients))
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-k', 'gevent', '-w', '1',
+         '--worker-connections', str(args.clients + 100), '-b', f'127.0.0.1:{port}',
+         '--log-level', 'warning', 'app:create_app()'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    try:
+        for _ in range(100):
+            try:
+                urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=1)
+                break
+            except OSError:
+                time.sleep(0.1)
+
+        selector = selectors.DefaultSelector()
+        request = f'GET /events/lots HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n'.encode()
+        buffers = {}
+        start = time.perf_counter()
+        for _ in range(args.clients):
+            sock = socket.create_connection(('127.0.0.1', port))
+            sock.sendall(request)
+            sock.setblocking(False)
+            selector.register(sock, selectors.EVENT_READ)
+            buffers[sock] = b''
+
+        def read_until(marker, timeout):
+            waiting = {sock for sock, data in buffers.items() if marker not in data}
+            arrived = []
+            deadline = time.perf_counter() + timeout
+            while waiting and time.perf_counter() < deadline:
+                for key, _ in selector.select(timeout=0.5):
+                    sock = key.fileobj
+                    buffers[sock] += sock.recv(65536)
+                    if sock in waiting and marker in buffers[sock]:
+                        waiting.discard(sock)
+                        arrived.append(time.perf_counter())
+            return arrived
+
+        connected = read_until(b'event: snapshot', args.timeout)
+        connect_seconds = time.perf_counter() - start
+
+        worker_rss = None
+        children = subprocess.run(['pgrep', '-P', str(server.pid)], capture_output=True, text=True)
+        for pid in children.stdout.split():
+            with open(f'/proc/{pid}/status') as status:
+                for line in status:
+                    if line.startswith('VmRSS'):
+                        worker_rss = line.split(None, 1)[1].strip()
+
+        reserved_at = time.perf_counter()
+        reserve = urllib.request.Request(f'http://127.0.0.1:{port}/user/reserve/{lot_id}', method='POST',
+                                         headers={'Authorization': f'Bearer {token}'})
+        urllib.request.urlopen(reserve, timeout=10)
+        delivered = [t - reserved_at for t in read_until(b'"change": "availability"', args.timeout)]
+
+        report = {
+            'clients': args.clients,
+            'streams_open': len(connected),
+            'seconds_to_open_all': round(connect_seconds, 2),
+            'worker_rss': worker_rss,
+            'event_delivered_to': len(delivered),
+            'delivery_ms': summarize(delivered) if delivered else None,
+        }
+        print(json.dumps(report, indent=2))
+        for sock in buffers:
+            sock.close()
+        return 0 if len(delivered) == args.clients else 1
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def remote_cache(app, config, args, kwargs):
+    # Flask-Caching backend factory (CACHE_TYPE='benchmark.remote_cache'): a
+    # per-process cache that waits BENCH_CACHE_LATENCY_MS on every call, as a
+    # round trip to a Redis on another host would.
+    from flask_caching.backends import SimpleCache
+
+    delay = float(os.environ.get('BENCH_CACHE_LATENCY_MS', 0)) / 1000
+
+    class RemoteCache(SimpleCache):
+
+        def get(self, key):
+            time.sleep(delay)
+            return super().get(key)
+
+        def get_many(self, *keys):
+            time.sleep(delay)
+            return [SimpleCache.get(self, key) for key in keys]
+
+        def set(self, key, value, timeout=None):
+            time.sleep(delay)
+            return super().set(key, value, timeout)
+
+        def add(self, key, value, timeout=None):
+            time.sleep(delay)
+            return super().add(key, value, timeout)
+
+        def delete(self, key):
+            time.sleep(delay)
+            return super().delete(key)
+
+    return RemoteCache.factory(app, config, args, kwargs)
+
+
+async def http_client(port, connection, requests, deadline, timeout, latencies, failures):
+    # Issues the (path, token) requests in turn on a keep-alive connection
+    # until the deadline; reconnects after an error or a closed connection.
+    import asyncio
+    import re
+
+    for n in itertools.count():
+        if time.perf_counter() >= deadline:
+            break
+        path, token = requests[n % len(requests)]
+        start = time.perf_counter()
+        try:
+            if connection is None:
+                connection = await asyncio.wait_for(asyncio.open_connection('127.0.0.1', port), timeout)
+            reader, writer = connection
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: bench\r\n'
+                         f'Authorization: Bearer {token}\r\n\r\n'.encode())
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout)
+            length = re.search(rb'content-length: *(\d+)', head, re.I)
+            await asyncio.wait_for(reader.readexactly(int(length.group(1)) if length else 0), timeout)
+            if head.split(None, 2)[1] != b'200':
+                failures.append(head.split(None, 2)[1].decode())
+            else:
+                latencies.append(time.perf_counter() - start)
+            if re.search(rb'connection: *close', head, re.I):
+                raise ConnectionResetError()
+        except (OSError, EOFError, asyncio.TimeoutError, asyncio.IncompleteReadError) as exc:
+            failures.append(type(exc).__name__)
+            if connection is not None:
+                connection[1].close()
+            connection = None
+    if connection is not None:
+        connection[1].close()
+
+
+def serving_modes(args):
+    # The same routes under serving.py's sync (gthread) and async (gevent)
+    # modes with the same number of workers: --clients keep-alive connections
+    # loop over a read mix for --seconds each. Reports throughput, latency
+    # percentiles and failed requests per mode and concurrency. With a local
+    # cache and SQLite the requests are CPU-bound; --cache-latency-ms adds a
+    # network round trip per cache call, the wait the async mode overlaps.
+    # Needs: pip install gunicorn gevent
+    import asyncio
+    import subprocess
+    import urllib.request
+
+    workdir = tempfile.mkdtemp(prefix='parking-bench-')
+    db_path = os.path.join(workdir, 'serving.db')
+    app = make_app(db_path)
+    lot_id = seed_lot(app, 50)
+    tokens = seed_users(app, 200)
+    paths = ['/user/lots', '/user/dashboard', '/user/lots/search?q=bench',
+             f'/user/quote?lot_id={lot_id}&minutes=90']
+    rng = random.Random(5)
+    requests = [(rng.choice(paths), rng.choice(tokens)) for _ in range(1000)]
+
+    async def load(port, clients):
+        # Connections are opened 100 at a time before the timed phase; a burst
+        # of connects overflows the SYN backlog and measures TCP retransmits.
+        connections = []
+        for i in range(0, clients, 100):
+            connections += await asyncio.gather(*[
+                asyncio.open_connection('127.0.0.1', port) for _ in range(min(100, clients - i))])
+        latencies, failures = [], []
+        deadline = time.perf_counter() + args.seconds
+        await asyncio.gather(*[
+            http_client(port, connection, requests[i:] + requests[:i], deadline, args.timeout,
+                        latencies, failures)
+            for i, connection in enumerate(connections)])
+        return latencies, failures
+
+    report = {'workers': args.workers, 'threads_per_sync_worker': args.threads,
+              'seconds': args.seconds, 'cache_latency_ms': args.cache_latency_ms}
+    for mode in args.modes:
+        port = free_port()
+        env = dict(os.environ, DATABASE_URL=f'sqlite:///{db_path}', CACHE_TYPE='benchmark.remote_cache',
+                   BENCH_CACHE_LATENCY_MS=str(args.cache_latency_ms), EVENTS_REDIS_URL='', SERVING_MODE=mode, WEB_BIND=f'127.0.0.1:{port}',
+                   WEB_WORKERS=str(args.workers), WEB_THREADS=str(args.threads),
+                   WEB_WORKER_CONNECTIONS=str(max(args.clients) + 100))
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'serving.py', '--log-level', 'warning',
+             'app:create_app()'],
+            cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+        try:
+            for _ in range(100):
+                try:
+                    urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=1)
+                    break
+                except OSError:
+                    time.sleep(0.1)
+            results = {}
+            for clients in sorted(args.clients):
+                asyncio.run(load(port, min(clients, 10)))  # warm the view caches
+                latencies, failures = asyncio.run(load(port, clients))
+                results[clients] = {
+                    'requests_per_second': round(len(latencies) / args.seconds, 1),
+                    **(summarize(latencies) if latencies else {'count': 0}),
+                    'p999_ms': round(percentile(latencies, 99.9) * 1000, 3) if latencies else None,
+                    'max_ms': round(max(latencies) * 1000, 3) if latencies else None,
+                    'failed': dict(Counter(failures)),
+                }
+            report[mode] = results
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Parking app benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    stress = commands.add_parser('reserve-stress',
+                                 help='concurrent reserves/releases against one lot; fails on any '
+                                      'double-booking, double release or duplicate retry')
+    stress.add_argument('--threads', type=int, default=300, help='users')
+    stress.add_argument('--spots', type=int, default=120)
+    stress.add_argument('--attempts', type=int, default=2, help='simultaneous requests per user')
+    stress.set_defaults(func=reserve_stress)
+
+    lat = commands.add_parser('latency',
+                              help='p50/p99 of the hot endpoints before and after the index migration')
+    lat.add_argument('--lots', type=int, default=100)
+    lat.add_argument('--spots', type=int, default=50000)
+    lat.add_argument('--users', type=int, default=10000)
+    lat.add_argument('--reservations', type=int, default=1000000)
+    lat.add_argument('--samples', type=int, default=200)
+    lat.set_defaults(func=latency)
+
+    dash = commands.add_parser('dashboard-queries',
+                               help='fails if /admin/dashboard statement count grows with the number of lots')
+    dash.add_argument('--lots', type=int, nargs='+', default=[5, 200])
+    dash.add_argument('--spots', type=int, default=10)
+    dash.set_defaults(func=dashboard_queries)
+
+    mine = commands.add_parser('user-dashboard',
+                               help='uncached /user/dashboard as one user\'s history grows')
+    mine.add_argument('--history', type=int, nargs='+', default=[10, 1000, 50000])
+    mine.add_argument('--samples', type=int, default=100)
+    mine.set_defaults(func=user_dashboard)
+
+    roll = commands.add_parser('rollups',
+                               help='admin dashboard revenue cost with and without the usage rollups')
+    roll.add_argument('--reservations', type=int, nargs='+', default=[100000, 1000000])
+    roll.add_argument('--lots', type=int, default=20)
+    roll.add_argument('--samples', type=int, default=50)
+    roll.set_defaults(func=rollup_dashboard)
+
+    price = commands.add_parser('pricing',
+                                help='per-stay tariff pricing vs the vectorised batch mode')
+    price.add_argument('--stays', type=int, default=1000000)
+    price.add_argument('--loop-stays', type=int, default=100000)
+    price.add_argument('--timezone', default='Asia/Kolkata')
+    price.set_defaults(func=pricing_batch)
+
+    find = commands.add_parser('search',
+                               help='/user/lots/search latency vs the full /user/lots listing')
+    find.add_argument('--lots', type=int, nargs='+', default=[1000, 20000])
+    find.add_argument('--samples', type=int, default=50)
+    find.set_defaults(func=lot_search)
+
+    sweep = commands.add_parser('sweep',
+                                help='expiry sweep time as the reservation history grows')
+    sweep.add_argument('--reservations', type=int, nargs='+', default=[100000, 1000000])
+    sweep.add_argument('--lots', type=int, default=20)
+    sweep.add_argument('--active', type=int, default=5000)
+    sweep.add_argument('--expired', type=int, default=2000)
+    sweep.set_defaults(func=expiry_sweep)
+
+    prov = commands.add_parser('provision',
+                               help='time lot creation and resizing for different spot counts')
+    prov.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    prov.add_argument('--skip-baseline', action='store_true',
+                      help='do not time the old one-ORM-object-per-spot path')
+    prov.set_defaults(func=provision)
+
+    mail = commands.add_parser('mail', help='bulk mail throughput against a local SMTP sink')
+    mail.add_argument('--messages', type=int, default=5000)
+    mail.add_argument('--batch-size', type=int, default=500)
+    mail.set_defaults(func=mail_throughput)
+
+    writes = commands.add_parser('write-throughput',
+                                 help='reserve/release throughput from several processes sharing one '
+                                      'SQLite file, legacy journal settings vs WAL')
+    writes.add_argument('--processes', type=int, default=4)
+    writes.add_argument('--threads', type=int, default=4, help='threads per process')
+    writes.add_argument('--seconds', type=float, default=10)
+    writes.add_argument('--modes', nargs='+', choices=sorted(SQLITE_MODES), default=['legacy', 'tuned'])
+    writes.set_defaults(func=write_throughput)
+
+    fanout = commands.add_parser('sse-fanout',
+                                 help='idle /events/lots streams on one gevent worker and the time '
+                                      'one change takes to reach them all')
+    fanout.add_argument('--clients', type=int, default=2000)
+    fanout.add_argument('--timeout', type=float, default=30)
+    fanout.set_defaults(func=sse_fanout)
+
+    bulk = commands.add_parser('fleet', help='one fleet booking vs N single reserve/release calls')
+    bulk.add_argument('--spots', type=int, nargs='+', default=[50, 500])
+    bulk.set_defaults(func=fleet_booking)
+
+    login = commands.add_parser('logins', help='/login throughput per password hashing method')
+    login.add_argument('--methods', nargs='+', default=['scrypt', 'pbkdf2:sha256:600000'])
+    login.add_argument('--threads', type=int, default=8)
+    login.add_argument('--users', type=int, default=20)
+    login.add_argument('--seconds', type=float, default=10)
+    login.set_defaults(func=logins)
+
+    cond = commands.add_parser('conditional',
+                               help='cached GETs: full 200 vs If-None-Match 304, gzip sizes, '
+                                    'json vs orjson encoding')
+    cond.add_argument('--lots', type=int, default=500)
+    cond.add_argument('--reservations', type=int, default=20000)
+    cond.add_argument('--samples', type=int, default=200)
+    cond.set_defaults(func=conditional_get)
+
+    serve = commands.add_parser('serving',
+                                help='throughput and tail latency of the sync and async serving '
+                                     'modes (serving.py) by concurrency')
+    serve.add_argument('--modes', nargs='+', default=['sync', 'async'], choices=['sync', 'async'])
+    serve.add_argument('--clients', type=int, nargs='+', default=[16, 200, 1000])
+    serve.add_argument('--workers', type=int, default=2)
+    serve.add_argument('--threads', type=int, default=8)
+    serve.add_argument('--seconds', type=float, default=10)
+    serve.add_argument('--timeout', type=float, default=30)
+    serve.add_argument('--cache-latency-ms', type=float, default=0)
+    serve.set_defaults(func=serving_modes)
+
+    start = commands.add_parser('startup',
+                                help='worker import time and single-client requests/second')
+    start.add_argument('--repo', default=os.path.dirname(os.path.abspath(__file__)),
+                       help='checkout to measure, e.g. a git worktree of an older commit')
+    start.add_argument('--runs', type=int, default=5)
+    start.add_argument('--requests', type=int, default=2000)
+    start.set_defaults(func=startup)
+
+    outage = commands.add_parser('cache-outage',
+                                 help='requests with the cache backend unreachable, per '
+                                      'AUTH_REVOCATION_OUTAGE policy')
+    outage.add_argument('--policies', nargs='+', default=['open', 'closed'],
+                        choices=['open', 'closed'])
+    outage.add_argument('--users', type=int, default=20)
+    outage.add_argument('--rounds', type=int, default=5)
+    outage.set_defaults(func=cache_outage)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+import hashlib
+import uuid
+from functools import wraps
+
+from flask import Response, current_app, g, make_response, request
+from flask_caching import Cache
+from flask_jwt_extended import get_jwt_identity
+
+from metrics import record_cache
+
+cache = Cache()
+
+
+# Versioned cache keys. Every cached view names the scopes its data depends
+# on; the current version token of each scope is part of the cache key, so a
+# write only has to bump the scopes it touched and every dependent entry is
+# bypassed at once. Entries can therefore live for a long time without ever
+# being served stale.
+#
+# Scopes used by the app:
+#   'lots'          availability or details of any lot
+#   'lot-details'   lot names/addresses/prices (create, edit, delete)
+#   'lot:<id>'      anything about one lot
+#   'user:<id>'     one user's reservations
+#   'reservations'  any reservation
+#   'users'         user accounts
+#   'rollups'       usage rollups (bumped by tasks.rollup_lot_usage)
+#
+# The same key doubles as the response's ETag: it changes exactly when the
+# cached entry would, so a client revalidating with If-None-Match gets a 304
+# after one round trip for the versions, without a cache read or a query.
+# Views served from a lagging read replica (DATABASE_READ_URL) send no ETag,
+# as a fresh version could be paired with an old body.
+#
+# The cache is an optimisation, never a dependency: when the backend fails
+# (Redis down or timing out) versions() hands out fresh tokens that match no
+# entry, cached views run the live view without an ETag, and bump() warns and
+# carries on, since it runs after the write has committed.
+
+def _version_key(scope):
+    return f"version:{scope}"
+
+
+def _current_versions(scopes):
+    # None when the cache backend is unavailable
+    keys = [_version_key(s) for s in scopes]
+    try:
+        values = cache.get_many(*keys)
+        result = []
+        for key, value in zip(keys, values):
+            if value is None:
+                # A missing version (first use, eviction, cache flush) starts a new
+                # namespace instead of falling back to one that may hold old data.
+                cache.add(key, uuid.uuid4().hex, timeout=0)
+                value = cache.get(key) or 'none'
+            result.append(value)
+        return result
+    except Exception as e:
+        print(f"[WARN] Cache unavailable, reading versions: {e}")
+        return None
+
+
+def versions(*scopes):
+    result = _current_versions(scopes)
+    if result is None:
+        # Tokens no entry was ever stored under, so nothing old is served
+        result = [uuid.uuid4().hex for _ in scopes]
+    return result
+
+
+def bump(*scopes):
+    for scope in scopes:
+        try:
+            cache.set(_version_key(scope), uuid.uuid4().hex, timeout=0)
+        except Exception as e:
+            print(f"[WARN] Cache unavailable, version {scope!r} not bumped: {e}")
+
+
+def _etag(key):
+    return hashlib.sha1(key.encode()).hexdigest()[:20]
+
+
+def _validators(response, etag):
+    if etag:
+        response.set_etag(etag, weak=True)
+    # The entry is per role or user; the browser must revalidate every time
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def cached_view(*scopes, timeout=None, per_user=False):
+    # Caches successful GET responses of a JWT view. Keys include the caller's
+    # role (and id when per_user is set) so identities never share an entry.
+    # Scopes may be callables taking the JWT identity, e.g.
+    # lambda identity: f"user:{identity['id']}".
+    def decorator(view):
+        replica_view = getattr(view, 'read_only', False)
+
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET':
+                return view(*args, **kwargs)
+
+            identity = get_jwt_identity() or {}
+            names = [s(identity) if callable(s) else s for s in scopes]
+            owner = identity.get('role', 'anonymous')
+            if per_user:
+                owner += f":{identity.get('id')}"
+            current = _current_versions(names)
+            if current is None:
+                record_cache(request.endpoint, False)
+                return view(*args, **kwargs)
+            key = ':'.join([
+                'view', request.path, request.query_string.decode(), owner, *current
+            ])
+
+            etag = None
+            if not (replica_view and current_app.config.get('DATABASE_READ_URL')):
+                etag = _etag(key)
+                if request.if_none_match.contains_weak(etag):
+                    record_cache(request.endpoint, True)
+                    return _validators(Response(status=304), etag)
+
+            try:
+                cached = cache.get(key)
+            except Exception as e:
+                print(f"[WARN] Cache unavailable, reading {request.endpoint}: {e}")
+                record_cache(request.endpoint, False)
+                return view(*args, **kwargs)
+            record_cache(request.endpoint, cached is not None)
+            if cached is not None:
+                data, status, mimetype = cached
+                return _validators(Response(data, status=status, mimetype=mimetype), etag)
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                _validators(response, etag)
+                ttl = timeout
+                if g.get('read_only') and current_app.config.get('DATABASE_READ_URL'):
+                    # Built from a replica that may lag behind the write that
+                    # bumped the version; keep it only briefly.
+                    ttl = current_app.config['READ_REPLICA_CACHE_TIMEOUT']
+                try:
+                    cache.set(key, (response.get_data(), response.status_code, response.mimetype),
+                              timeout=ttl)
+                except Exception as e:
+                    print(f"[WARN] Cache unavailable, storing {request.endpoint}: {e}")
+            return response
+        return wrapper
+    return decorator
@@ -7,6 +7,10 @@ celery = Celery('tasks', broker=Config.CELERY_BROKER_URL,
                 include=['tasks'])
 celery.conf.timezone = 'Asia/Kolkata'
 
+# Task durations for /metrics
+from metrics import connect_celery
+connect_celery(celery)
+
 # # Auto-discover tasks from tasks.py
 # celery.autodiscover_tasks(['tasks'])
 
@@ -20,6 +24,26 @@ celery.conf.beat_schedule = {
         'task': 'tasks.send_monthly_report',
         'schedule': crontab(day_of_month=1, hour=8, minute=0),  # 1st day of month at 8 AM
     },
+    'reconcile-lot-counters': {
+        'task': 'tasks.reconcile_lot_counters',
+        'schedule': crontab(minute='*/15'),  # Every 15 minutes
+    },
+    'rollup-lot-usage': {
+        'task': 'tasks.rollup_lot_usage',
+        'schedule': crontab(minute='*/5'),  # Every 5 minutes
+    },
+    'sweep-expired-reservations': {
+        'task': 'tasks.sweep_expired_reservations',
+        'schedule': 60.0,  # Every minute
+    },
+    'purge-idempotency-keys': {
+        'task': 'tasks.purge_idempotency_keys',
+        'schedule': crontab(minute=0),  # Hourly
+    },
+    'purge-expired-exports': {
+        'task': 'tasks.purge_expired_exports',
+        'schedule': crontab(minute=30),  # Hourly
+    },
     'test-hello-task': {
         'task': 'tasks.print_hello',
         'schedule': 10.0,  # Every 10 seconds
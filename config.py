@@ -1,20 +1,123 @@
 import os
 
 class Config:
-    SECRET_KEY = 'mysecretkey'
-    SQLALCHEMY_DATABASE_URI = 'sqlite:///parking.db'
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'mysecretkey')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    JWT_SECRET_KEY = 'superjwtsecret'
+    JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'superjwtsecret')
+
+    # Database (see database.py). A relative SQLite path lives in instance/.
+    # DATABASE_READ_URL optionally serves the read-only views (a replica).
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///parking.db')
+    DATABASE_READ_URL = os.environ.get('DATABASE_READ_URL')
+    READ_REPLICA_CACHE_TIMEOUT = int(os.environ.get('READ_REPLICA_CACHE_TIMEOUT', 5))
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+
+    # Cache (Flask-Caching). CACHE_TYPE=SimpleCache runs without Redis.
+    CACHE_TYPE = os.environ.get('CACHE_TYPE', 'RedisCache')
+    CACHE_REDIS_HOST = os.environ.get('CACHE_REDIS_HOST', 'localhost')
+    CACHE_REDIS_PORT = int(os.environ.get('CACHE_REDIS_PORT', 6380))
+    CACHE_REDIS_DB = int(os.environ.get('CACHE_REDIS_DB', 0))
+    CACHE_DEFAULT_TIMEOUT = int(os.environ.get('CACHE_DEFAULT_TIMEOUT', 3600))
+    REPORT_CACHE_TIMEOUT = int(os.environ.get('REPORT_CACHE_TIMEOUT', 90 * 24 * 3600))
 
     # Celery & Redis
-    CELERY_BROKER_URL = 'redis://localhost:6380/0'
-    CELERY_RESULT_BACKEND = 'redis://localhost:6380/0'
+    CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6380/0')
+    CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', 'redis://localhost:6380/0')
 
     # Mail (MailHog)
-    MAIL_SERVER = 'localhost'
-    MAIL_PORT = 1025
+    MAIL_SERVER = os.environ.get('MAIL_SERVER', 'localhost')
+    MAIL_PORT = int(os.environ.get('MAIL_PORT', 1025))
     MAIL_USE_TLS = False
     MAIL_USE_SSL = False
     MAIL_USERNAME = None
     MAIL_PASSWORD = None
     MAIL_DEFAULT_SENDER = 'noreply@parkingapp.com'
+
+    # CSV exports: built in a spooled temp file, mailed as an attachment up to
+    # EXPORT_ATTACH_MAX_BYTES, otherwise stored in EXPORT_DIR and linked
+    EXPORT_DIR = os.environ.get('EXPORT_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                           'instance', 'exports'))
+    EXPORT_BASE_URL = os.environ.get('EXPORT_BASE_URL', 'http://127.0.0.1:5000')
+    EXPORT_ATTACH_MAX_BYTES = int(os.environ.get('EXPORT_ATTACH_MAX_BYTES', 5 * 1024 * 1024))
+    EXPORT_SPOOL_BYTES = int(os.environ.get('EXPORT_SPOOL_BYTES', 8 * 1024 * 1024))
+    EXPORT_TTL = int(os.environ.get('EXPORT_TTL', 3 * 24 * 3600))
+
+    # Bulk mail: recipients per Celery subtask (one SMTP connection each) and
+    # per-recipient retries before a message is counted as failed
+    MAIL_BATCH_SIZE = int(os.environ.get('MAIL_BATCH_SIZE', 500))
+    MAIL_RETRIES = int(os.environ.get('MAIL_RETRIES', 2))
+    MAIL_RETRY_BACKOFF = float(os.environ.get('MAIL_RETRY_BACKOFF', 1.0))
+
+    # Instrumentation (/metrics): requests slower than SLOW_REQUEST_MS are
+    # logged with their SQL; Celery workers keep task timings in a Redis hash
+    SLOW_REQUEST_MS = int(os.environ.get('SLOW_REQUEST_MS', 500))
+    METRICS_REDIS_KEY = os.environ.get('METRICS_REDIS_KEY', 'metrics:celery')
+    CELERY_QUEUE = os.environ.get('CELERY_QUEUE', 'celery')
+
+    # Booking transactions: retries after a deadlock/serialization failure or a
+    # locked SQLite database, and how long Idempotency-Key responses are kept
+    TRANSACTION_RETRIES = int(os.environ.get('TRANSACTION_RETRIES', 3))
+    IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', 24 * 3600))
+
+    # Live lot events (/events/lots): fanned out through Redis pub/sub when
+    # EVENTS_REDIS_URL is reachable, otherwise within one process. Redis calls
+    # time out after EVENTS_REDIS_TIMEOUT seconds; after a failure Redis is
+    # tried again every EVENTS_RETRY_SECONDS
+    EVENTS_REDIS_URL = os.environ.get('EVENTS_REDIS_URL', 'redis://localhost:6380/0')
+    EVENTS_REDIS_TIMEOUT = float(os.environ.get('EVENTS_REDIS_TIMEOUT', 0.5))
+    EVENTS_RETRY_SECONDS = int(os.environ.get('EVENTS_RETRY_SECONDS', 30))
+    SSE_KEEPALIVE_SECONDS = int(os.environ.get('SSE_KEEPALIVE_SECONDS', 15))
+    # Open streams per process, how long one stream lasts before the browser
+    # reconnects, and when a refused browser tries again
+    SSE_MAX_SUBSCRIBERS = int(os.environ.get('SSE_MAX_SUBSCRIBERS', 2000))
+    # Without gevent every stream holds a thread; 2 of the default 8 WEB_THREADS
+    SSE_SYNC_MAX_SUBSCRIBERS = int(os.environ.get('SSE_SYNC_MAX_SUBSCRIBERS', 2))
+    SSE_MAX_STREAM_SECONDS = int(os.environ.get('SSE_MAX_STREAM_SECONDS', 600))
+    SSE_FULL_RETRY_SECONDS = int(os.environ.get('SSE_FULL_RETRY_SECONDS', 30))
+
+    # Usage rollups (rollups.py): reservations closed less than
+    # ROLLUP_LAG_SECONDS ago wait for the next run, so a slow commit with an
+    # earlier leaving_time is never skipped
+    ROLLUP_BATCH_SIZE = int(os.environ.get('ROLLUP_BATCH_SIZE', 5000))
+    ROLLUP_LAG_SECONDS = int(os.environ.get('ROLLUP_LAG_SECONDS', 120))
+
+    # Tariffs (pricing.py) are evaluated in local time; /user/quote prices
+    # stays of up to QUOTE_MAX_MINUTES
+    PRICING_TIMEZONE = os.environ.get('PRICING_TIMEZONE', 'Asia/Kolkata')
+    QUOTE_MAX_MINUTES = int(os.environ.get('QUOTE_MAX_MINUTES', 366 * 24 * 60))
+
+    # Lot search (search.py); each process rebuilds its index at least this often
+    SEARCH_MAX_RESULTS = 100
+    SEARCH_INDEX_MAX_AGE = int(os.environ.get('SEARCH_INDEX_MAX_AGE', 300))
+
+    # Reservation expiry (expiry.py): default max stay for lots without their
+    # own (0 = no limit), and the sweeper's batch size and Redis lock
+    MAX_STAY_MINUTES = int(os.environ.get('MAX_STAY_MINUTES', 24 * 60))
+    SWEEP_BATCH_SIZE = int(os.environ.get('SWEEP_BATCH_SIZE', 500))
+    SWEEP_LOCK_SECONDS = int(os.environ.get('SWEEP_LOCK_SECONDS', 120))
+    SWEEP_LOCK_REDIS_URL = os.environ.get('SWEEP_LOCK_REDIS_URL', CELERY_BROKER_URL)
+
+    # Authentication (auth.py). Stored hashes made with another method are
+    # upgraded at the next successful login; e.g. 'pbkdf2:sha256:600000'.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+    PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', 32))
+    AUTH_IDENTITY_CACHE_SIZE = int(os.environ.get('AUTH_IDENTITY_CACHE_SIZE', 10000))
+    AUTH_IDENTITY_TTL = int(os.environ.get('AUTH_IDENTITY_TTL', 30))
+    # 'open' or 'closed': token checks while the cache is unreachable (auth.py)
+    AUTH_REVOCATION_OUTAGE = os.environ.get('AUTH_REVOCATION_OUTAGE', 'open')
+
+    # Most spots one fleet booking (fleet.py) may claim
+    FLEET_MAX_BATCH = int(os.environ.get('FLEET_MAX_BATCH', 500))
+
+    # Response compression (encoding.py): bodies smaller than this are sent
+    # as they are; the level is gzip's 1-9 (brotli's 0-11 when installed)
+    COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+    COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL', 5))
@@ -0,0 +1,82 @@
+from functools import partial, wraps
+
+from flask import g, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+
+# Engine setup, driven by the DATABASE_* / SQLITE_* / DB_POOL_* settings in
+# config.py (all read from the environment).
+#
+# SQLite gets WAL journaling (readers no longer block the writer),
+# synchronous=NORMAL (safe with WAL, one fsync per checkpoint instead of per
+# commit), a busy timeout so a writer waits for the lock instead of failing
+# with "database is locked", and memory-mapped reads. Server databases get a
+# sized connection pool with pre-ping and recycling.
+#
+# With DATABASE_READ_URL set (a replica, or a second pool on the same
+# database), views decorated with @read_only run their queries there. Anything
+# that flushes still goes to the primary.
+
+READ_BIND = 'read'
+
+
+def engine_options(url, config):
+    if make_url(url).get_backend_name() == 'sqlite':
+        return {}
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True,
+    }
+
+
+def configure(app):
+    # Fills in engine options and the read bind; call before db.init_app(app).
+    config = app.config
+    config.setdefault('SQLALCHEMY_ENGINE_OPTIONS',
+                      engine_options(config['SQLALCHEMY_DATABASE_URI'], config))
+    read_url = config.get('DATABASE_READ_URL')
+    if read_url:
+        binds = dict(config.get('SQLALCHEMY_BINDS') or {})
+        binds.setdefault(READ_BIND, {'url': read_url, **engine_options(read_url, config)})
+        config['SQLALCHEMY_BINDS'] = binds
+
+
+def _sqlite_pragmas(config, dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout = {int(config['SQLITE_BUSY_TIMEOUT_MS'])}")
+    cursor.execute(f"PRAGMA journal_mode = {config['SQLITE_JOURNAL_MODE']}")
+    cursor.execute(f"PRAGMA synchronous = {config['SQLITE_SYNCHRONOUS']}")
+    cursor.execute(f"PRAGMA mmap_size = {int(config['SQLITE_MMAP_SIZE'])}")
+    cursor.close()
+
+
+def init_app(app, db):
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite':
+                event.listen(engine, 'connect', partial(_sqlite_pragmas, app.config))
+
+
+class RoutingSession(Session):
+    # Sends the queries of a @read_only view to the read bind when one is
+    # configured.
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and has_request_context()
+                and g.get('read_only') and READ_BIND in self._db.engines):
+            return self._db.engines[READ_BIND]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_only(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.read_only = True
+        return view(*args, **kwargs)
+    wrapper.read_only = True  # seen by caching.cached_view
+    return wrapper
@@ -0,0 +1,90 @@
+import gzip
+
+from flask import current_app, request
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Response encoding: JSON through orjson and compression of large bodies.
+#
+# OrjsonProvider replaces Flask's json module for jsonify and request.get_json.
+# Datetimes still go through Flask's default hook, so they keep the HTTP date
+# format the frontend parses. Without orjson installed the app keeps Flask's
+# DefaultJSONProvider.
+#
+# compress_response gzips (or, with the brotli package installed, brotli
+# encodes) JSON, text and CSV bodies of at least COMPRESS_MIN_BYTES when the
+# client accepts it. Streams (/events/lots) and files sent with send_file are
+# left alone.
+
+COMPRESSIBLE = {'application/json', 'text/html', 'text/plain', 'text/csv'}
+
+
+class OrjsonProvider(DefaultJSONProvider):
+
+    def _options(self):
+        options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        return options
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._options()).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        data = orjson.dumps(obj, default=self.default, option=self._options())
+        return self._app.response_class(data, mimetype=self.mimetype)
+
+
+def _encoding(accept):
+    if brotli is not None and accept['br']:
+        return 'br'
+    if accept['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress_response(response):
+    config = current_app.config
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE):
+        return response
+
+    data = response.get_data()
+    if len(data) < config['COMPRESS_MIN_BYTES']:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = _encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    if encoding == 'br':
+        response.set_data(brotli.compress(data, quality=config['COMPRESS_LEVEL']))
+    else:
+        response.set_data(gzip.compress(data, compresslevel=config['COMPRESS_LEVEL'], mtime=0))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_app(app):
+    if orjson is not None:
+        app.json = OrjsonProvider(app)
+    app.after_request(compress_response)
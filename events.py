@@ -0,0 +1,253 @@
+import json
+import threading
+import time
+
+from flask import current_app
+
+from models import db, ParkingLot
+
+
+# Live lot availability for the frontend (Server-Sent Events on /events/lots).
+#
+# Writes that change a lot call publish_lots() after their commit. Each event
+# carries the lot's current counters rather than a +1/-1, so a client that
+# missed one is corrected by the next. Events fan out through Redis pub/sub
+# (EVENTS_REDIS_URL) so every web process sees writes made by the others and
+# by Celery workers; without Redis they stay within the process, and Redis is
+# tried again every EVENTS_RETRY_SECONDS. Publishing never waits longer than
+# EVENTS_REDIS_TIMEOUT, so a hung Redis cannot hold up a booking.
+#
+# Each process keeps one Redis subscription and hands events to its own
+# subscribers. A subscriber only holds the latest event per lot, so a slow or
+# idle client costs one small dict however busy the lots are. Serving
+# thousands of open streams needs a greenlet worker, see README.
+#
+# A process holds at most SSE_MAX_SUBSCRIBERS streams; beyond that
+# /events/lots answers 503 and the page tries again later. Without gevent
+# (sync serving mode, the development server) each open stream holds a worker
+# thread until it ends, so the limit is SSE_SYNC_MAX_SUBSCRIBERS instead and
+# leaves most threads to ordinary requests. Streams end after
+# SSE_MAX_STREAM_SECONDS and the browser reconnects (with a fresh snapshot),
+# so clients spread over the processes again after a restart or scale-out.
+
+CHANNEL = 'parking:lots'
+
+
+class Subscription:
+
+    def __init__(self, broker):
+        self._broker = broker
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._pending = {}
+
+    def put(self, event):
+        with self._lock:
+            self._pending[event['lot_id']] = event
+        self._ready.set()
+
+    def get(self, timeout):
+        # Events that arrived since the last call; [] after timeout seconds.
+        self._ready.wait(timeout)
+        self._ready.clear()
+        with self._lock:
+            events, self._pending = list(self._pending.values()), {}
+        return events
+
+    def close(self):
+        self._broker.unsubscribe(self)
+
+
+class LocalBroker:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+
+    def subscribe(self, limit=None):
+        # None when limit subscribers are already connected
+        subscription = Subscription(self)
+        with self._lock:
+            if limit is not None and len(self._subscribers) >= limit:
+                return None
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def deliver(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.put(event)
+
+    def has_listeners(self):
+        return self.subscriber_count() > 0
+
+    def publish(self, event):
+        self.deliver(event)
+
+
+class RedisBroker(LocalBroker):
+
+    def __init__(self, url, timeout, retry_seconds):
+        import redis
+
+        super().__init__()
+        # Publishing runs inside booking requests, so it gets a short socket
+        # timeout; the subscription has its own connection that may idle.
+        self._client = redis.Redis.from_url(url, socket_connect_timeout=timeout, socket_timeout=timeout)
+        self._listen_client = redis.Redis.from_url(url, socket_connect_timeout=timeout,
+                                                   socket_keepalive=True, health_check_interval=30)
+        self._retry_seconds = retry_seconds
+        self._down_until = 0
+        self._listener = None
+
+    def ping(self):
+        self._client.ping()
+
+    def adopt(self, broker):
+        # Takes over the subscribers of the LocalBroker used while Redis was down
+        with broker._lock:
+            subscribers, broker._subscribers = broker._subscribers, set()
+        for subscription in subscribers:
+            subscription._broker = self
+        with self._lock:
+            self._subscribers |= subscribers
+        if subscribers:
+            self._start_listener()
+
+    def has_listeners(self):
+        # Subscribers may be connected to any process.
+        return True
+
+    def publish(self, event):
+        # While Redis is failing, events only reach this process's streams
+        # and publishing is not retried for EVENTS_RETRY_SECONDS, so bookings
+        # do not each wait out the socket timeout.
+        if time.monotonic() < self._down_until:
+            self.deliver(event)
+            return
+        try:
+            self._client.publish(CHANNEL, json.dumps(event))
+        except Exception:
+            self._down_until = time.monotonic() + self._retry_seconds
+            self.deliver(event)
+            raise
+
+    def subscribe(self, limit=None):
+        self._start_listener()
+        return super().subscribe(limit)
+
+    def _start_listener(self):
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='lot-events', daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._listen_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CHANNEL)
+                for message in pubsub.listen():
+                    self.deliver(json.loads(message['data']))
+            except Exception as e:
+                print(f"[WARN] Lot event subscription lost: {e}")
+                time.sleep(1)
+
+
+_broker = None
+_retry_at = 0
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    # Redis when EVENTS_REDIS_URL answers, otherwise in-process only; the
+    # connection is tried again every EVENTS_RETRY_SECONDS so a process that
+    # started while Redis was down joins the others once it is back.
+    global _broker, _retry_at
+    config = current_app.config
+    with _broker_lock:
+        if _broker is None:
+            _broker = LocalBroker()
+        url = config.get('EVENTS_REDIS_URL')
+        if url and not isinstance(_broker, RedisBroker) and time.monotonic() >= _retry_at:
+            _retry_at = time.monotonic() + config['EVENTS_RETRY_SECONDS']
+            broker = RedisBroker(url, config['EVENTS_REDIS_TIMEOUT'], config['EVENTS_RETRY_SECONDS'])
+            try:
+                broker.ping()
+            except Exception:
+                print("[WARN] Redis unavailable; lot events stay within this process")
+            else:
+                broker.adopt(_broker)
+                _broker = broker
+        return _broker
+
+
+def subscriber_limit(config):
+    try:
+        from gevent import monkey
+    except ImportError:
+        return config['SSE_SYNC_MAX_SUBSCRIBERS']
+    if monkey.is_module_patched('socket'):
+        return config['SSE_MAX_SUBSCRIBERS']
+    return config['SSE_SYNC_MAX_SUBSCRIBERS']
+
+
+def lot_states(lot_ids=None):
+    query = db.session.query(ParkingLot.id, ParkingLot.available_count, ParkingLot.occupied_count,
+                             ParkingLot.total_spots)
+    if lot_ids is not None:
+        query = query.filter(ParkingLot.id.in_(lot_ids))
+    return [{'lot_id': lot_id, 'available': available, 'occupied': occupied, 'total': total}
+            for lot_id, available, occupied, total in query]
+
+
+def publish_lots(*lot_ids, change='availability'):
+    # change: 'availability' (spot taken or freed), 'details' (lot created or
+    # edited; clients re-fetch the listing) or 'deleted'.
+    broker = get_broker()
+    if not broker.has_listeners():
+        return
+    if change == 'deleted':
+        events = [{'lot_id': lot_id} for lot_id in lot_ids]
+    else:
+        events = lot_states(lot_ids)
+    for event in events:
+        event['change'] = change
+        try:
+            broker.publish(event)
+        except Exception as e:
+            print(f"[WARN] Could not publish lot event: {e}")
+
+
+def sse(event, name=None):
+    lines = f"event: {name}\n" if name else ''
+    return f"{lines}data: {json.dumps(event)}\n\n"
+
+
+def stream(subscription, snapshot, keepalive, max_seconds):
+    # Body of an event-stream response; the snapshot is read before streaming
+    # so the generator never needs a database session.
+    deadline = time.monotonic() + max_seconds
+    try:
+        yield 'retry: 3000\n\n'
+        yield sse(snapshot, 'snapshot')
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            events = subscription.get(min(keepalive, remaining))
+            if not events and remaining > keepalive:
+                yield ': keepalive\n\n'
+            for event in events:
+                yield sse(event)
+    finally:
+        subscription.close()
@@ -0,0 +1,164 @@
+from collections import Counter
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import bindparam, case, select, update
+
+from models import db, ParkingLot, ParkingSpot, Reservation, User
+from mailing import user_email
+from occupancy import adjust_counts
+from pricing import price_stay
+
+
+# Auto-expiry of forgotten reservations.
+#
+# Every reservation gets expires_at = parking_time + the lot's max stay
+# (ParkingLot.max_stay_minutes, MAX_STAY_MINUTES when unset, 0 for no limit).
+# tasks.sweep_expired_reservations closes the overdue ones in batches of
+# SWEEP_BATCH_SIZE: each batch is one UPDATE pricing the stays up to the sweep
+# time (CASE on id), one UPDATE freeing their spots and one counter update
+# per lot. Overdue rows are found through ix_reservation_active_expiry, which
+# only holds active reservations, so a sweep reads the expired rows and not
+# the reservation history.
+#
+# A Redis lock (SWEEP_LOCK_SECONDS, renewed per batch) keeps sweeps on
+# several beat or worker nodes from overlapping; the conditional UPDATE
+# (leaving_time IS NULL) keeps a user's own release and the sweeper from
+# both closing the same reservation.
+
+LOCK_NAME = 'parking:sweep-expired'
+
+
+def max_stay(lot_max_stay):
+    minutes = lot_max_stay if lot_max_stay is not None else current_app.config['MAX_STAY_MINUTES']
+    return minutes or None
+
+
+def expires_at(parking_time, lot_max_stay):
+    minutes = max_stay(lot_max_stay)
+    return parking_time + timedelta(minutes=minutes) if minutes else None
+
+
+def reschedule_lot(lot_id, lot_max_stay):
+    # Applies a changed max stay to the lot's active reservations. Bounded by
+    # the lot's spot count.
+    rows = db.session.query(Reservation.id, Reservation.parking_time) \
+        .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id) \
+        .filter(ParkingSpot.lot_id == lot_id, Reservation.leaving_time.is_(None)) \
+        .all()
+    if rows:
+        db.session.execute(
+            update(Reservation.__table__)
+            .where(Reservation.__table__.c.id == bindparam('reservation_id'))
+            .values(expires_at=bindparam('expiry')),
+            [{'reservation_id': row.id, 'expiry': expires_at(row.parking_time, lot_max_stay)}
+             for row in rows])
+    return len(rows)
+
+
+def _overdue(now, limit):
+    return db.session.query(Reservation.id, Reservation.spot_id, Reservation.user_id,
+                            Reservation.parking_time, Reservation.expires_at,
+                            ParkingSpot.lot_id, ParkingLot.name.label('lot_name'),
+                            ParkingLot.price, ParkingLot.tariff, User.username) \
+        .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id) \
+        .join(ParkingLot, ParkingSpot.lot_id == ParkingLot.id) \
+        .join(User, Reservation.user_id == User.id) \
+        .filter(Reservation.leaving_time.is_(None), Reservation.expires_at <= now) \
+        .order_by(Reservation.expires_at) \
+        .limit(limit) \
+        .all()
+
+
+def close_reservations(rows, now):
+    # Closes the given active reservations at now, each priced by its lot's
+    # tariff, in one UPDATE; then frees their spots in one UPDATE and moves
+    # the lot counters. Rows need id, spot_id, lot_id, parking_time, price and
+    # tariff. Returns (rows actually closed, {reservation id: cost}); a row
+    # closed concurrently by someone else is left out. The caller commits.
+    zone = current_app.config['PRICING_TIMEZONE']
+    costs = {row.id: price_stay(row.tariff, row.price, row.parking_time, now, zone) for row in rows}
+    statement = update(Reservation) \
+        .where(Reservation.id.in_(costs), Reservation.leaving_time.is_(None)) \
+        .values(leaving_time=now, cost=case(costs, value=Reservation.id)) \
+        .execution_options(synchronize_session=False)
+
+    if db.session.get_bind().dialect.update_returning:
+        closed_ids = set(db.session.execute(statement.returning(Reservation.id)).scalars())
+    else:
+        # No RETURNING (MySQL): lock the rows still open, then close exactly
+        # those. Matching leaving_time == now afterwards would miss on DATETIME
+        # columns that drop the microseconds.
+        closed_ids = set(db.session.execute(
+            select(Reservation.id)
+            .where(Reservation.id.in_(costs), Reservation.leaving_time.is_(None))
+            .with_for_update()).scalars())
+        if closed_ids:
+            db.session.execute(statement.where(Reservation.id.in_(closed_ids)))
+
+    closed = [row for row in rows if row.id in closed_ids]
+    if closed:
+        db.session.execute(
+            update(ParkingSpot)
+            .where(ParkingSpot.id.in_([row.spot_id for row in closed]), ParkingSpot.status == 'O')
+            .values(status='A')
+            .execution_options(synchronize_session=False)
+        )
+        for lot_id, count in Counter(row.lot_id for row in closed).items():
+            adjust_counts(lot_id, available=count, occupied=-count)
+    return closed, costs
+
+
+def close_batch(now, batch_size):
+    # Closes up to batch_size overdue reservations in one transaction. Returns
+    # the number of overdue rows read and those this call actually closed
+    # (a user may release one in the meantime).
+    rows = _overdue(now, batch_size)
+    if not rows:
+        db.session.rollback()
+        return 0, []
+    closed, costs = close_reservations(rows, now)
+    db.session.commit()
+    return len(rows), [dict(row._mapping, leaving_time=now, cost=costs[row.id]) for row in closed]
+
+
+def _lock_client():
+    import redis
+    return redis.Redis.from_url(current_app.config['SWEEP_LOCK_REDIS_URL'])
+
+
+def sweep(now=None, client=None):
+    # Returns the closed reservations, or None when another node holds the lock.
+    from redis.exceptions import LockError
+
+    config = current_app.config
+    lock = (client or _lock_client()).lock(LOCK_NAME, timeout=config['SWEEP_LOCK_SECONDS'],
+                                           blocking=False)
+    if not lock.acquire():
+        return None
+
+    closed = []
+    try:
+        while True:
+            read, batch = close_batch(now or datetime.utcnow(), config['SWEEP_BATCH_SIZE'])
+            closed.extend(batch)
+            if read < config['SWEEP_BATCH_SIZE']:
+                break
+            lock.reacquire()
+    finally:
+        try:
+            lock.release()
+        except LockError:
+            pass  # expired while the last batch ran
+    return closed
+
+
+def expiry_message(row):
+    return {
+        "subject": "Your parking reservation has ended",
+        "recipients": [user_email(row['username'])],
+        "body": (f"Hello {row['username']},\n\n"
+                 f"Your reservation of spot {row['spot_id']} at {row['lot_name']} passed the "
+                 f"lot's maximum stay and was closed at {row['leaving_time']:%Y-%m-%d %H:%M} UTC.\n"
+                 f"Amount charged: ₹{row['cost']:.2f}\n"),
+    }
@@ -0,0 +1,134 @@
+import csv
+import gzip
+import io
+import os
+import secrets
+import shutil
+import tempfile
+import time
+
+from flask import current_app
+from sqlalchemy import func, select
+
+from models import db, User, ParkingLot, ParkingSpot, Reservation
+
+
+# Streaming CSV exports. Rows come from one joined query read in yield_per
+# batches and are written straight into a spooled temp file (optionally
+# gzipped), so a worker never holds a whole history in memory. Small files are
+# mailed as attachments; larger ones are moved to EXPORT_DIR and the user gets
+# a link to /exports/<name>, which stays valid for EXPORT_TTL seconds.
+# tasks.purge_expired_exports deletes the expired files nobody asked for again.
+
+BATCH_SIZE = 2000
+
+
+def export_query(user_id=None, start=None, end=None):
+    # All reservations when user_id is None (with a User column), otherwise one
+    # user's. Returns (query, header).
+    columns = [ParkingLot.name, Reservation.spot_id, Reservation.parking_time,
+               Reservation.leaving_time, Reservation.cost]
+    if user_id is None:
+        columns.insert(0, User.username)
+    query = select(*columns) \
+        .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id) \
+        .join(ParkingLot, ParkingSpot.lot_id == ParkingLot.id)
+    if user_id is None:
+        query = query.join(User, Reservation.user_id == User.id)
+    else:
+        query = query.where(Reservation.user_id == user_id)
+    if start:
+        query = query.where(Reservation.parking_time >= start)
+    if end:
+        query = query.where(Reservation.parking_time < end)
+
+    header = ['Lot', 'Spot ID', 'Start', 'End', 'Cost']
+    if user_id is None:
+        header.insert(0, 'User')
+    return query, header
+
+
+def count_rows(query):
+    return db.session.execute(select(func.count()).select_from(query.subquery())).scalar()
+
+
+def write_csv(query, header, compress=False, progress=None):
+    # Returns (spooled file positioned at 0, rows written). progress is called
+    # with the running row count after every batch.
+    spooled = tempfile.SpooledTemporaryFile(max_size=current_app.config['EXPORT_SPOOL_BYTES'])
+    binary = gzip.GzipFile(fileobj=spooled, mode='wb') if compress else spooled
+    text = io.TextIOWrapper(binary, encoding='utf-8', newline='')
+    writer = csv.writer(text)
+
+    writer.writerow(header)
+
+    rows = 0
+    result = db.session.execute(
+        query.order_by(Reservation.parking_time, Reservation.id)
+        .execution_options(yield_per=BATCH_SIZE)
+    )
+    for batch in result.partitions():
+        for row in batch:
+            *prefix, parking_time, leaving_time, cost = row
+            writer.writerow(prefix + [str(parking_time),
+                                      str(leaving_time) if leaving_time else 'Active',
+                                      cost or 0])
+        rows += len(batch)
+        if progress:
+            progress(rows)
+
+    text.flush()
+    text.detach()
+    if compress:
+        binary.close()
+    spooled.seek(0)
+    return spooled, rows
+
+
+def size_of(fileobj):
+    fileobj.seek(0, os.SEEK_END)
+    size = fileobj.tell()
+    fileobj.seek(0)
+    return size
+
+
+def store_export(fileobj, compress=False):
+    # Moves a finished export into EXPORT_DIR under an unguessable name.
+    directory = current_app.config['EXPORT_DIR']
+    os.makedirs(directory, exist_ok=True)
+    name = f"{secrets.token_urlsafe(24)}.csv" + (".gz" if compress else "")
+    with open(os.path.join(directory, name), 'wb') as out:
+        shutil.copyfileobj(fileobj, out)
+    return name
+
+
+def export_path(name):
+    # Path of a stored export, or None when it does not exist or has expired.
+    if os.path.basename(name) != name:
+        return None
+    path = os.path.join(current_app.config['EXPORT_DIR'], name)
+    if not os.path.isfile(path):
+        return None
+    if time.time() - os.path.getmtime(path) > current_app.config['EXPORT_TTL']:
+        os.remove(path)
+        return None
+    return path
+
+
+def purge_exports():
+    # Deletes stored exports older than EXPORT_TTL; returns how many.
+    directory = current_app.config['EXPORT_DIR']
+    cutoff = time.time() - current_app.config['EXPORT_TTL']
+    deleted = 0
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                deleted += 1
+        except FileNotFoundError:
+            pass  # removed by a download of the expired link meanwhile
+    return deleted
@@ -0,0 +1,8 @@
+from flask_jwt_extended import JWTManager
+from flask_mail import Mail
+
+# Extension instances shared by the web app and the Celery workers; they are
+# bound to an app in app.create_app(). The database lives in models.db and the
+# cache in caching.cache.
+jwt = JWTManager()
+mail = Mail()
@@ -0,0 +1,95 @@
+import uuid
+from datetime import datetime
+
+from sqlalchemy import insert, select, update
+
+from allocator import SKIP_LOCKED_DIALECTS
+from expiry import close_reservations, expires_at
+from models import db, ParkingLot, ParkingSpot, Reservation
+from occupancy import adjust_counts
+
+
+# Bulk bookings for users with the 'fleet' role (fleet operators, events).
+#
+# A fleet booking claims up to `count` spots of one lot in one transaction:
+# one conditional UPDATE picks and marks the spots ('A' -> 'O', so a spot
+# taken concurrently is never claimed twice), one executemany INSERT adds the
+# reservations and one UPDATE moves the lot counters. The reservations share
+# a batch_id and are released (and priced) together, or a subset by spot id.
+# ux_reservation_user_active ignores batch rows, so the one-active-reservation
+# rule still holds for the account's own bookings.
+#
+# Partial fulfilment: the request names `count` and `min_count` (default:
+# count). If at least min_count spots are free, min(count, free) are booked;
+# otherwise nothing is booked.
+
+ROLE = 'fleet'
+RETURNING_DIALECTS = {'sqlite', 'postgresql'}
+
+
+def claim_spots(lot_id, count):
+    # Marks up to count free spots of the lot occupied inside the caller's
+    # transaction and returns their ids.
+    dialect = db.session.get_bind().dialect.name
+    free = select(ParkingSpot.id) \
+        .where(ParkingSpot.lot_id == lot_id, ParkingSpot.status == 'A') \
+        .order_by(ParkingSpot.id) \
+        .limit(count)
+    if dialect in SKIP_LOCKED_DIALECTS:
+        free = free.with_for_update(skip_locked=True)
+
+    if dialect in RETURNING_DIALECTS:
+        statement = update(ParkingSpot) \
+            .where(ParkingSpot.id.in_(free.scalar_subquery()), ParkingSpot.status == 'A') \
+            .values(status='O') \
+            .returning(ParkingSpot.id) \
+            .execution_options(synchronize_session=False)
+        return sorted(db.session.execute(statement).scalars())
+
+    # MySQL has neither RETURNING nor LIMIT in an IN subquery; the rows are
+    # already locked by the SELECT ... FOR UPDATE.
+    ids = list(db.session.execute(free).scalars())
+    if ids:
+        db.session.execute(
+            update(ParkingSpot)
+            .where(ParkingSpot.id.in_(ids), ParkingSpot.status == 'A')
+            .values(status='O')
+            .execution_options(synchronize_session=False)
+        )
+    return ids
+
+
+def reserve_batch(user_id, lot, count, min_count):
+    # Returns (batch_id, spot ids, expiry), or (None, [], None) when fewer than
+    # min_count spots could be claimed; the caller commits or rolls back.
+    spot_ids = claim_spots(lot.id, count)
+    if len(spot_ids) < min_count or not spot_ids:
+        return None, [], None
+
+    batch_id = uuid.uuid4().hex
+    parking_time = datetime.utcnow()
+    expiry = expires_at(parking_time, lot.max_stay_minutes)
+    db.session.execute(insert(Reservation), [
+        {'user_id': user_id, 'spot_id': spot_id, 'parking_time': parking_time,
+         'expires_at': expiry, 'batch_id': batch_id, 'cost': 0.0}
+        for spot_id in spot_ids
+    ])
+    adjust_counts(lot.id, available=-len(spot_ids), occupied=len(spot_ids))
+    return batch_id, spot_ids, expiry
+
+
+def release_batch(user_id, batch_id, spot_ids=None):
+    # Closes the batch's active reservations (or those on spot_ids) in one
+    # priced UPDATE. Returns the closed rows and their costs.
+    query = db.session.query(Reservation.id, Reservation.spot_id, Reservation.parking_time,
+                             ParkingSpot.lot_id, ParkingLot.price, ParkingLot.tariff) \
+        .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id) \
+        .join(ParkingLot, ParkingSpot.lot_id == ParkingLot.id) \
+        .filter(Reservation.batch_id == batch_id, Reservation.user_id == user_id,
+                Reservation.leaving_time.is_(None))
+    if spot_ids is not None:
+        query = query.filter(Reservation.spot_id.in_(spot_ids))
+    rows = query.all()
+    if not rows:
+        return [], {}
+    return close_reservations(rows, datetime.utcnow())
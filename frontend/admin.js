@@ -1,5 +1,9 @@
 const { createApp } = Vue;
 
+// Chart.js instances live outside Vue's reactive state
+let pieChart = null;
+let barChart = null;
+
 createApp({
     data() {
         return {
@@ -14,8 +18,10 @@ createApp({
             },
             reservations: [],
             allReservations: [],
+            reservationsCursor: null,
             cards: [],
-            chartsInitialized: false
+            chartsInitialized: false,
+            events: null
         }
     },
     methods: {
@@ -30,7 +36,7 @@ createApp({
             }
 
             try {
-                const response = await fetch('http://127.0.0.1:5000/admin/dashboard', {
+                const response = await fetchJSON('http://127.0.0.1:5000/admin/dashboard', {
                     method: 'GET',
                     headers: {
                         'Authorization': `Bearer ${token}`,
@@ -42,22 +48,17 @@ createApp({
 
 
                 if (response.ok) {
-                    const data = await response.json();
+                    const data = response.data;
                     this.summary = data;
                     this.reservations = data.reservations;
 
-                    this.cards = [
-                        { title: 'Total Lots', value: data.total_lots },
-                        { title: 'Total Spots', value: data.total_spots },
-                        { title: 'Available', value: data.available_spots },
-                        { title: 'Occupied', value: data.occupied_spots },
-                        { title: 'Total Users', value: data.total_users },
-                        { title: 'Revenue (₹)', value: (data.total_revenue || 0).toFixed(2) }
-                    ];
+                    this.buildCards();
 
                     if (!this.chartsInitialized) {
                         this.initCharts();
                         this.chartsInitialized = true;
+                    } else {
+                        this.updateCharts();
                     }
                 } else {
                     alert('Failed to load dashboard data');
@@ -67,17 +68,67 @@ createApp({
                 console.error('Error fetching dashboard:', error);
             }
         },
-        async fetchAllReservations() {
+        buildCards() {
+            const data = this.summary;
+            this.cards = [
+                { title: 'Total Lots', value: data.total_lots },
+                { title: 'Total Spots', value: data.total_spots },
+                { title: 'Available', value: data.available_spots },
+                { title: 'Occupied', value: data.occupied_spots },
+                { title: 'Total Users', value: data.total_users },
+                { title: 'Revenue (₹)', value: (data.total_revenue || 0).toFixed(2) }
+            ];
+        },
+        subscribeToLots() {
+            // Occupancy is pushed by the server; lot edits trigger a reload.
+            // Revenue and recent history refresh with the next full load.
+            this.events = openLotEvents({
+                // Sent again on every reconnect, covering changes missed in between
+                onSnapshot: (e) => {
+                    JSON.parse(e.data).forEach(state => this.applyLotState(state));
+                },
+                onMessage: (e) => {
+                    const state = JSON.parse(e.data);
+                    if (state.change !== 'availability' || !this.applyLotState(state)) {
+                        this.fetchDashboard();
+                    }
+                },
+                onRefused: () => this.fetchDashboard()
+            });
+        },
+        applyLotState(state) {
+            const lot = this.summary.lots.find(l => l.id === state.lot_id);
+            if (!lot) return false;
+            lot.available = state.available;
+            lot.occupied = state.occupied;
+            this.summary.available_spots = this.summary.lots.reduce((n, l) => n + l.available, 0);
+            this.summary.occupied_spots = this.summary.lots.reduce((n, l) => n + l.occupied, 0);
+            this.buildCards();
+            this.updateCharts();
+            return true;
+        },
+        updateCharts() {
+            if (!pieChart || !barChart) return;
+            pieChart.data.datasets[0].data = [this.summary.available_spots, this.summary.occupied_spots];
+            barChart.data.labels = this.summary.lots.map(lot => lot.name);
+            barChart.data.datasets[0].data = this.summary.lots.map(lot => lot.occupied);
+            pieChart.update();
+            barChart.update();
+        },
+        async fetchAllReservations(cursor = null) {
             const token = localStorage.getItem('token');
+            let url = 'http://127.0.0.1:5000/admin/reservations?limit=100';
+            if (cursor) url += `&cursor=${encodeURIComponent(cursor)}`;
             try {
-                const response = await fetch('http://127.0.0.1:5000/admin/reservations', {
+                const response = await fetchJSON(url, {
                     headers: { 'Authorization': `Bearer ${token}` },
                     credentials: 'include',
                     mode: 'cors'
                 });
                 if (response.ok) {
-                    const data = await response.json();
-                    this.allReservations = data.reservations;
+                    const data = response.data;
+                    this.allReservations = cursor ? this.allReservations.concat(data.reservations) : data.reservations;
+                    this.reservationsCursor = data.next_cursor;
                 }
             } catch (error) {
                 console.error('Error fetching all reservations:', error);
@@ -85,7 +136,7 @@ createApp({
         },
         initCharts() {
             const ctx1 = document.getElementById('spotsPieChart');
-            new Chart(ctx1, {
+            pieChart = new Chart(ctx1, {
                 type: 'pie',
                 data: {
                     labels: ['Available', 'Occupied'],
@@ -102,7 +153,7 @@ createApp({
             // alert(labels)
             // alert(occupiedData)
 
-            new Chart(ctx2, {
+            barChart = new Chart(ctx2, {
                 type: 'bar',
                 data: {
                     labels: labels,
@@ -126,9 +177,12 @@ createApp({
         },
 
 
+        loadMoreReservations() {
+            if (this.reservationsCursor) this.fetchAllReservations(this.reservationsCursor);
+        },
         logout() {
-            localStorage.clear();
-            window.location.href = 'index.html';
+            if (this.events) this.events.close();
+            endSession();
         },
         goToLotManagement() {
             window.location.href = 'admin_lots.html';
@@ -138,9 +192,13 @@ createApp({
             return new Date(dateString).toLocaleString();
         }
     },
-    mounted() {
-        this.fetchDashboard();
+    async mounted() {
+        await this.fetchDashboard();
+        this.subscribeToLots();
         this.fetchAllReservations();
+    },
+    beforeUnmount() {
+        if (this.events) this.events.close();
     }
 }).mount('#adminDashboardApp');
 
@@ -134,8 +134,7 @@ createApp({
         },
 
         logout() {
-            localStorage.clear();
-            window.location.href = 'index.html';
+            endSession();
         }
     },
 
@@ -0,0 +1,28 @@
+// Conditional GETs for the cached API views. The last ETag and body of each
+// URL are kept for the lifetime of the page; the next request for the URL
+// sends If-None-Match, and a 304 is answered from the kept body.
+const conditionalCache = new Map();
+
+async function fetchJSON(url, options = {}) {
+    const kept = conditionalCache.get(url);
+    const headers = { ...(options.headers || {}) };
+    if (kept) headers['If-None-Match'] = kept.etag;
+
+    const response = await fetch(url, { ...options, headers });
+    if (response.status === 304 && kept) {
+        // A copy, so callers may update what they get without touching the kept body
+        return { ok: true, status: 200, data: structuredClone(kept.data), response };
+    }
+    if (!response.ok) {
+        return { ok: false, status: response.status, data: null, response };
+    }
+
+    const data = await response.json();
+    const etag = response.headers.get('ETag');
+    if (etag) {
+        conditionalCache.set(url, { etag, data: structuredClone(data) });
+    } else {
+        conditionalCache.delete(url);
+    }
+    return { ok: true, status: response.status, data, response };
+}
@@ -0,0 +1,29 @@
+// Live lot events (/events/lots). A stream the server ends is reopened by the
+// browser itself. A refused one (503: the server holds as many streams as it
+// allows) closes the EventSource, so it is opened again after a pause, and
+// onRefused runs so the page can re-fetch what the stream keeps current.
+const LOT_EVENTS_RETRY_MS = 30000;
+
+function openLotEvents({ onSnapshot, onMessage, onRefused }) {
+    let source = null;
+    let timer = null;
+
+    const connect = () => {
+        source = new EventSource('http://127.0.0.1:5000/events/lots');
+        if (onSnapshot) source.addEventListener('snapshot', onSnapshot);
+        source.onmessage = onMessage;
+        source.onerror = () => {
+            if (source.readyState !== EventSource.CLOSED) return; // the browser retries
+            if (onRefused) onRefused();
+            timer = setTimeout(connect, LOT_EVENTS_RETRY_MS);
+        };
+    };
+    connect();
+
+    return {
+        close() {
+            clearTimeout(timer);
+            source.close();
+        }
+    };
+}
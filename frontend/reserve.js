@@ -6,6 +6,9 @@ createApp({
             lots: [],
             activeReservation: null,
             message: "",
+            events: null,
+            search: { q: "", pin: "", available: false },
+            searchTimer: null,
         };
     },
     methods: {
@@ -18,14 +21,22 @@ createApp({
                 return;
             }
 
+            // Any filter goes through the server-side search index
+            let url = "http://127.0.0.1:5000/user/lots";
+            if (this.search.q || this.search.pin || this.search.available) {
+                const params = new URLSearchParams({ q: this.search.q, pin: this.search.pin, limit: 100 });
+                if (this.search.available) params.set("available", "1");
+                url = `http://127.0.0.1:5000/user/lots/search?${params}`;
+            }
+
             try {
-                const response = await fetch("http://127.0.0.1:5000/user/lots", {
+                const response = await fetchJSON(url, {
                     headers: { Authorization: `Bearer ${token}` },
                     credentials: 'include',
                     mode: 'cors'
                 });
                 if (response.ok) {
-                    const data = await response.json();
+                    const data = response.data;
                     this.lots = data.lots; // Directly use backend response
                 }
             } catch (error) {
@@ -33,16 +44,42 @@ createApp({
                 this.message = "Error loading lots";
             }
         },
+        searchLots() {
+            clearTimeout(this.searchTimer);
+            this.searchTimer = setTimeout(() => this.fetchLots(), 250);
+        },
+        subscribeToLots() {
+            // Live availability: the server pushes each lot's counters when they
+            // change, so the list no longer has to be re-fetched.
+            this.events = openLotEvents({
+                onSnapshot: (e) => {
+                    JSON.parse(e.data).forEach((state) => this.applyLotState(state));
+                },
+                onMessage: (e) => {
+                    const state = JSON.parse(e.data);
+                    if (state.change === "availability") {
+                        this.applyLotState(state);
+                    } else {
+                        this.fetchLots(); // lot created, edited or deleted
+                    }
+                },
+                onRefused: () => this.fetchLots()
+            });
+        },
+        applyLotState(state) {
+            const lot = this.lots.find((l) => l.id === state.lot_id);
+            if (lot) lot.available_spots = state.available;
+        },
         async fetchActiveReservation() {
             const token = localStorage.getItem("token");
             try {
-                const response = await fetch("http://127.0.0.1:5000/user/dashboard", {
+                const response = await fetchJSON("http://127.0.0.1:5000/user/dashboard", {
                     headers: { Authorization: `Bearer ${token}` },
                     credentials: 'include',
                     mode: 'cors'
                 });
                 if (response.ok) {
-                    const data = await response.json();
+                    const data = response.data;
                     if (data.active_reservations) {
                         this.activeReservation = {
                             lot_name: data.active_reservations.lot_name,
@@ -75,7 +112,6 @@ createApp({
                 const data = await response.json();
                 if (response.ok) {
                     this.message = `Reservation successful! Spot ID: ${data.spot_id}`;
-                    this.fetchLots();
                     this.fetchActiveReservation();
                 } else {
                     this.message = data.message || "Failed to reserve spot";
@@ -100,7 +136,6 @@ createApp({
                     this.message = `Spot released! Cost ₹${data.cost}`;
                     alert(this.message);
                     this.activeReservation = null;
-                    this.fetchLots();
                 } else {
                     this.message = data.message || "Failed to release spot";
                 }
@@ -111,8 +146,8 @@ createApp({
             }
         },
         logout() {
-            localStorage.clear();
-            window.location.href = "index.html";
+            if (this.events) this.events.close();
+            endSession();
         },
         goBack() {
             window.location.href = "user_dashboard.html";
@@ -121,8 +156,12 @@ createApp({
             return new Date(dateString).toLocaleString();
         },
     },
-    mounted() {
-        this.fetchLots();
+    async mounted() {
+        await this.fetchLots();
+        this.subscribeToLots();
         this.fetchActiveReservation();
     },
+    beforeUnmount() {
+        if (this.events) this.events.close();
+    },
 }).mount("#reserveApp");
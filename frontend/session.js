@@ -0,0 +1,15 @@
+// Logout shared by the pages: revokes the token on the server, forgets the
+// session and returns to the login page.
+function endSession() {
+    const token = localStorage.getItem('token');
+    if (token) {
+        // keepalive lets the request finish after navigation
+        fetch('http://127.0.0.1:5000/logout', {
+            method: 'POST',
+            headers: { Authorization: `Bearer ${token}` },
+            keepalive: true
+        }).catch(() => {});
+    }
+    localStorage.clear();
+    window.location.href = 'index.html';
+}
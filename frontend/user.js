@@ -71,8 +71,7 @@ createApp({
             }
         },
         logout() {
-            localStorage.clear();
-            window.location.href = 'index.html';
+            endSession();
         },
         goToReservePage() {
             window.location.href = 'reserve.html';
@@ -84,14 +83,15 @@ createApp({
         initCharts() {
             const token = localStorage.getItem('token');
 
-            fetch('http://127.0.0.1:5000/user/reservations', {
+            // Full history streamed as NDJSON, one reservation per line
+            fetch('http://127.0.0.1:5000/user/reservations?format=ndjson', {
                 headers: { 'Authorization': `Bearer ${token}` },
                 credentials: 'include',
                 mode: 'cors'
             })
-                .then(response => response.json())
-                .then(data => {
-                    const fullHistory = data.history;  // Full reservations data
+                .then(response => response.text())
+                .then(text => {
+                    const fullHistory = text.split('\n').filter(line => line).map(line => JSON.parse(line));
                     const lots = {};
                     const monthlySpending = {};
 
@@ -3,11 +3,12 @@ const { createApp } = Vue;
 createApp({
     data() {
         return {
-            reservations: []
+            reservations: [],
+            nextCursor: null
         };
     },
     methods: {
-        async fetchHistory() {
+        async fetchHistory(cursor = null) {
             const token = localStorage.getItem('token');
             const role = localStorage.getItem('role');
 
@@ -17,25 +18,32 @@ createApp({
                 return;
             }
 
+            let url = 'http://127.0.0.1:5000/user/reservations?limit=50';
+            if (cursor) url += `&cursor=${encodeURIComponent(cursor)}`;
+
             try {
-                const response = await fetch('http://127.0.0.1:5000/user/reservations', {
+                const response = await fetchJSON(url, {
                     headers: { 'Authorization': `Bearer ${token}` },
                     credentials: 'include',
                     mode: 'cors'
                 });
                 if (response.ok) {
-                    const data = await response.json();
-                    this.reservations = data.history || [];
+                    const data = response.data;
+                    const page = data.history || [];
+                    this.reservations = cursor ? this.reservations.concat(page) : page;
+                    this.nextCursor = data.next_cursor;
                 } else {
-                    console.error('Failed to fetch history:', await response.text());
+                    console.error('Failed to fetch history:', await response.response.text());
                 }
             } catch (error) {
                 console.error('Error fetching history:', error);
             }
         },
+        loadMore() {
+            if (this.nextCursor) this.fetchHistory(this.nextCursor);
+        },
         logout() {
-            localStorage.clear();
-            window.location.href = 'index.html';
+            endSession();
         },
         goBack() {
             window.location.href = 'user_dashboard.html';
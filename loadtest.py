@@ -0,0 +1,302 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import defaultdict
+
+from benchmark import percentile, seed_history
+
+
+# Load test for the parking API. Seeds lots, spots, users and reservation
+# history into a throwaway database, then runs concurrent virtual users that
+# log in and cycle through a weighted mix of requests. Everything runs
+# in-process by default with local stand-ins (SQLite, fakeredis or an
+# in-memory cache, mail suppressed), so results are comparable across commits.
+# --cache fakeredis needs `pip install fakeredis`.
+#
+#   python loadtest.py --clients 50 --duration 30 --output load.json
+#   python loadtest.py --database-url postgresql://localhost/parking_load
+#   python loadtest.py --url http://127.0.0.1:5000    # an already running server
+#
+# The report is JSON: throughput and p50/p95/p99 latency per endpoint, plus SQL
+# statements per request when the app runs in-process. Each client logs in once
+# before the timed phase ('initial_login'); throughput figures cover the timed
+# phase only.
+
+PASSWORD = 'loadtest'
+
+MIX = {
+    'login': 1,
+    'user_lots': 40,
+    'reserve': 12,
+    'release': 12,
+    'user_dashboard': 25,
+    'admin_dashboard': 5,
+    'user_reservations': 4,
+}
+
+
+def fakeredis_cache(app, config, args, kwargs):
+    # Flask-Caching backend factory: CACHE_TYPE='loadtest.fakeredis_cache'.
+    import fakeredis
+    from flask_caching.backends import RedisCache
+
+    return RedisCache(host=fakeredis.FakeStrictRedis(), **kwargs)
+
+
+CACHE_TYPES = {
+    'fakeredis': 'loadtest.fakeredis_cache',
+    'simple': 'SimpleCache',
+    'none': 'NullCache',
+    'redis': 'RedisCache',
+}
+
+
+class InProcessTarget:
+    # Calls the WSGI app directly and counts the SQL each request issues.
+
+    def __init__(self, app):
+        from sqlalchemy import event
+        from models import db
+
+        self.app = app
+        self.local = threading.local()
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self.local.statements = getattr(self.local, 'statements', 0) + 1
+
+    def client(self):
+        return self.app.test_client()
+
+    def request(self, client, method, path, token=None, body=None):
+        headers = {'Authorization': f'Bearer {token}'} if token else {}
+        self.local.statements = 0
+        response = client.open(path, method=method, headers=headers, json=body)
+        return response.status_code, response.get_json(silent=True), self.local.statements
+
+
+class HttpTarget:
+    # Sends real HTTP requests to a running server; SQL counts are unknown.
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def client(self):
+        return None
+
+    def request(self, client, method, path, token=None, body=None):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with urllib.request.urlopen(req) as response:
+                status, payload = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, payload = e.code, e.read()
+        try:
+            payload = json.loads(payload)
+        except ValueError:
+            payload = None
+        return status, payload, None
+
+
+class Stats:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.statements = defaultdict(list)
+
+    def record(self, name, elapsed, status, statements):
+        with self.lock:
+            self.latencies[name].append(elapsed)
+            self.statuses[name][status] += 1
+            if statements is not None:
+                self.statements[name].append(statements)
+
+    def report(self, wall_seconds):
+        endpoints = {}
+        for name, values in sorted(self.latencies.items()):
+            sql = self.statements.get(name)
+            endpoints[name] = {
+                'requests': len(values),
+                'throughput_rps': round(len(values) / wall_seconds, 1),
+                'p50_ms': round(percentile(values, 50) * 1000, 2),
+                'p95_ms': round(percentile(values, 95) * 1000, 2),
+                'p99_ms': round(percentile(values, 99) * 1000, 2),
+                'statuses': dict(self.statuses[name]),
+                'sql_per_request': round(sum(sql) / len(sql), 2) if sql else None,
+            }
+        total = sum(len(v) for v in self.latencies.values())
+        return {
+            'total_requests': total,
+            'throughput_rps': round(total / wall_seconds, 1),
+            'endpoints': endpoints,
+        }
+
+
+def virtual_user(target, stats, username, admin_token, lot_ids, ready, duration, seed):
+    # Logs in, waits for every other client to do the same, then runs the mix
+    # for duration seconds. Logins before the barrier are reported separately.
+    rng = random.Random(seed)
+    client = target.client()
+    names, weights = zip(*MIX.items())
+    token = None
+    active = False
+
+    def call(name, method, path, body=None, auth=True):
+        start = time.perf_counter()
+        status, payload, statements = target.request(client, method, path,
+                                                     token=(admin_token if name == 'admin_dashboard'
+                                                            else token) if auth else None,
+                                                     body=body)
+        stats.record(name, time.perf_counter() - start, status, statements)
+        return status, payload
+
+    status, payload = call('initial_login', 'POST', '/login', auth=False,
+                           body={'username': username, 'password': PASSWORD})
+    if status == 200:
+        token = payload['token']
+    ready.wait()
+    deadline = time.monotonic() + duration
+
+    while time.monotonic() < deadline:
+        name = 'login' if token is None else rng.choices(names, weights)[0]
+        if name == 'reserve' and active:
+            name = 'release'
+        elif name == 'release' and not active:
+            name = 'reserve'
+
+        if name == 'login':
+            status, payload = call('login', 'POST', '/login', auth=False,
+                                   body={'username': username, 'password': PASSWORD})
+            if status == 200:
+                token = payload['token']
+        elif name == 'user_lots':
+            call(name, 'GET', '/user/lots')
+        elif name == 'reserve':
+            status, _ = call(name, 'POST', f'/user/reserve/{rng.choice(lot_ids)}')
+            active = active or status == 201
+        elif name == 'release':
+            status, _ = call(name, 'POST', '/user/release')
+            active = active and status not in (200, 404)
+        elif name == 'user_dashboard':
+            call(name, 'GET', '/user/dashboard')
+        elif name == 'admin_dashboard':
+            call(name, 'GET', '/admin/dashboard')
+        elif name == 'user_reservations':
+            call(name, 'GET', '/user/reservations?limit=20')
+
+
+def build_app(args):
+    from config import Config
+
+    workdir = tempfile.mkdtemp(prefix='parking-load-')
+    Config.SQLALCHEMY_DATABASE_URI = args.database_url or f"sqlite:///{os.path.join(workdir, 'load.db')}"
+    Config.CACHE_TYPE = CACHE_TYPES[args.cache]
+    Config.MAIL_SUPPRESS_SEND = True
+
+    from app import create_app, init_db
+    app = create_app(Config)
+    with app.app_context():
+        init_db()
+    return app
+
+
+def seed(app, args):
+    # Every load-test user shares one password hash so seeding stays fast.
+    from werkzeug.security import generate_password_hash
+    from models import db, User
+
+    admin_token, _ = seed_history(app, args.lots, args.spots, args.users, args.reservations)
+    with app.app_context():
+        User.query.filter(User.role == 'user').update({'password': generate_password_hash(PASSWORD)})
+        db.session.commit()
+        usernames = [u for (u,) in db.session.query(User.username).filter(User.role == 'user')]
+    return admin_token, usernames
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Parking API load test')
+    parser.add_argument('--lots', type=int, default=50)
+    parser.add_argument('--spots', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--reservations', type=int, default=100000)
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--cache', choices=sorted(CACHE_TYPES), default='fakeredis')
+    parser.add_argument('--database-url', help='defaults to a temporary SQLite file')
+    parser.add_argument('--url', help='load an already running server instead (seed it yourself)')
+    parser.add_argument('--admin-token', help='admin JWT to use with --url')
+    parser.add_argument('--lot-ids', type=int, nargs='+', help='lots to reserve in with --url')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    if args.url:
+        target = HttpTarget(args.url)
+        admin_token = args.admin_token
+        usernames = [f'bench{i}' for i in range(args.users)]
+        lot_ids = args.lot_ids or list(range(1, args.lots + 1))
+    else:
+        app = build_app(args)
+        admin_token, usernames = seed(app, args)
+        target = InProcessTarget(app)
+        lot_ids = list(range(1, args.lots + 1))
+
+    stats = Stats()
+    rng = random.Random(args.seed)
+    chosen = rng.sample(usernames, min(args.clients, len(usernames)))
+    ready = threading.Barrier(len(chosen) + 1)
+    threads = [threading.Thread(target=virtual_user,
+                                args=(target, stats, name, admin_token, lot_ids, ready,
+                                      args.duration, args.seed + i))
+               for i, name in enumerate(chosen)]
+    login_start = time.perf_counter()
+    for t in threads:
+        t.start()
+    ready.wait()
+    start = time.perf_counter()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+
+    report = {
+        'commit': git_commit(),
+        'config': {k: getattr(args, k) for k in ('lots', 'spots', 'users', 'reservations', 'clients',
+                                                 'duration', 'cache', 'url')},
+        'database': 'external' if args.url else (args.database_url or 'sqlite'),
+        'login_phase_seconds': round(start - login_start, 2),
+        'wall_seconds': round(wall, 2),
+        **stats.report(wall),
+    }
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
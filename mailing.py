@@ -0,0 +1,83 @@
+import smtplib
+import time
+from itertools import islice
+
+from flask import current_app
+from flask_mail import Message
+
+
+# Batched mail delivery. Bulk jobs split their recipients into chunks (see
+# tasks.send_mail_batch); each chunk is sent over one SMTP connection, a
+# failed delivery is retried on a fresh connection and then recorded
+# instead of aborting the rest of the chunk.
+#
+# Messages travel between Celery tasks as plain dicts:
+#   {"subject": ..., "recipients": [...], "body": ... and/or "html": ...}
+
+def user_email(username):
+    return f"{username}@example.com"
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _close(connection):
+    if connection is not None:
+        try:
+            connection.__exit__(None, None, None)
+        except (smtplib.SMTPException, OSError):
+            pass
+
+
+def send_messages(mail, messages, retries=None, backoff=None):
+    # Returns {"sent": n, "failed": [{"recipients": [...], "error": "..."}]}.
+    config = current_app.config
+    retries = config.get('MAIL_RETRIES', 2) if retries is None else retries
+    backoff = config.get('MAIL_RETRY_BACKOFF', 1.0) if backoff is None else backoff
+
+    sent, failed = 0, []
+    connection = None
+    try:
+        for data in messages:
+            msg = Message(subject=data['subject'], recipients=data['recipients'],
+                          body=data.get('body'), html=data.get('html'))
+            for attempt in range(retries + 1):
+                try:
+                    if connection is None:
+                        connection = mail.connect()
+                        connection.__enter__()
+                    connection.send(msg)
+                    sent += 1
+                    break
+                except smtplib.SMTPRecipientsRefused as e:
+                    # The server answered and the connection is still usable;
+                    # retrying a rejected mailbox would not help.
+                    failed.append({"recipients": data['recipients'], "error": str(e)})
+                    break
+                except (smtplib.SMTPException, OSError) as e:
+                    _close(connection)
+                    connection = None
+                    if attempt == retries:
+                        failed.append({"recipients": data['recipients'], "error": str(e)})
+                    else:
+                        time.sleep(backoff * (attempt + 1))
+    finally:
+        _close(connection)
+    return {"sent": sent, "failed": failed}
+
+
+def merge_results(results, label):
+    sent = sum(r['sent'] for r in results)
+    failed = [f for r in results for f in r['failed']]
+    return {
+        "job": label,
+        "sent": sent,
+        "failed": len(failed),
+        "failed_recipients": [r for f in failed for r in f['recipients']][:100],
+    }
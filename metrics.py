@@ -0,0 +1,262 @@
+import bisect
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# In-process instrumentation exposed in the Prometheus text format on /metrics.
+#
+# Web process: every request records its latency per route, the number of SQL
+# statements it issued and the time spent in them (SQLAlchemy cursor events),
+# and cached views count hits and misses. Requests slower than
+# SLOW_REQUEST_MS are logged with the SQL they ran.
+#
+# Celery workers run in other processes, so task durations are accumulated in
+# a Redis hash (METRICS_REDIS_KEY on the broker) and read back at scrape time,
+# together with the broker queue depth.
+#
+# Recording is a dict update under a lock per request; nothing is formatted
+# until /metrics is scraped.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+TASK_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0)
+MAX_LOGGED_STATEMENTS = 200
+
+logger = logging.getLogger('parking.slow')
+
+
+class Registry:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        self.help = {}
+
+    def describe(self, name, kind, text):
+        self.help[name] = (kind, text)
+
+    def inc(self, name, labels=(), amount=1):
+        with self.lock:
+            self.counters[name, labels] += amount
+
+    def observe(self, name, labels, value, buckets):
+        with self.lock:
+            hist = self.histograms.get((name, labels))
+            if hist is None:
+                hist = self.histograms[name, labels] = [buckets, [0] * len(buckets), 0, 0.0]
+            index = bisect.bisect_left(buckets, value)
+            if index < len(buckets):
+                hist[1][index] += 1
+            hist[2] += 1
+            hist[3] += value
+
+    def snapshot(self):
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {k: (v[0], list(v[1]), v[2], v[3]) for k, v in self.histograms.items()}
+        return counters, histograms
+
+
+registry = Registry()
+registry.describe('http_requests_total', 'counter', 'Requests by route, method and status.')
+registry.describe('http_request_duration_seconds', 'histogram', 'Request latency by route.')
+registry.describe('http_request_sql_statements', 'histogram', 'SQL statements issued per request.')
+registry.describe('http_request_sql_seconds', 'histogram', 'Time spent in SQL per request.')
+registry.describe('cache_requests_total', 'counter', 'Cached view lookups by view and result.')
+registry.describe('celery_task_duration_seconds', 'histogram', 'Celery task run time by task.')
+registry.describe('celery_tasks_total', 'counter', 'Finished Celery tasks by task and state.')
+registry.describe('celery_queue_length', 'gauge', 'Messages waiting in the broker queue.')
+
+
+def _labels(**labels):
+    return tuple(sorted(labels.items()))
+
+
+def record_cache(view, hit):
+    registry.inc('cache_requests_total', _labels(view=view, result='hit' if hit else 'miss'))
+
+
+# SQL statement hooks. Registered once on the Engine class, so they see every
+# engine the app creates (including binds); outside a request they only pay
+# for one has_request_context() call.
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        conn.info.setdefault('metrics_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('metrics_start')
+    if not starts or not has_request_context():
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    stats = g.get('sql_stats')
+    if stats is None:
+        return
+    stats[0] += 1
+    stats[1] += elapsed
+    if len(stats[2]) < MAX_LOGGED_STATEMENTS:
+        stats[2].append((elapsed, statement))
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(context):
+    starts = context.connection.info.get('metrics_start') if context.connection is not None else None
+    if starts:
+        starts.pop()
+
+
+def _start_request():
+    g.request_start = time.perf_counter()
+    g.sql_stats = [0, 0.0, []]
+
+
+def _finish_request(response):
+    start = g.get('request_start')
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+    statements, sql_time, logged = g.sql_stats
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    labels = _labels(route=route, method=request.method)
+
+    registry.inc('http_requests_total', _labels(route=route, method=request.method,
+                                                status=str(response.status_code)))
+    registry.observe('http_request_duration_seconds', labels, elapsed, LATENCY_BUCKETS)
+    registry.observe('http_request_sql_statements', labels, statements, STATEMENT_BUCKETS)
+    registry.observe('http_request_sql_seconds', labels, sql_time, LATENCY_BUCKETS)
+
+    if elapsed * 1000 >= current_app.config['SLOW_REQUEST_MS']:
+        lines = [f"{elapsed * 1000:.1f} ms  {request.method} {request.full_path.rstrip('?')} -> "
+                 f"{response.status_code}  ({statements} SQL statements, {sql_time * 1000:.1f} ms)"]
+        lines += [f"  {t * 1000:8.2f} ms  {' '.join(s.split())}" for t, s in logged]
+        logger.warning('\n'.join(lines))
+    return response
+
+
+def init_app(app):
+    app.config.setdefault('SLOW_REQUEST_MS', 500)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+
+
+# Celery
+
+def _redis():
+    import redis
+    from config import Config
+    return redis.Redis.from_url(Config.CELERY_BROKER_URL, socket_timeout=0.5,
+                                socket_connect_timeout=0.5)
+
+
+def connect_celery(celery):
+    # Hooks task_prerun/task_postrun in the worker. Each finished task adds one
+    # pipelined round trip to Redis.
+    from celery.signals import task_postrun, task_prerun
+    from config import Config
+
+    started = {}
+    client = _redis()
+
+    @task_prerun.connect(weak=False)
+    def on_prerun(task_id=None, **kwargs):
+        started[task_id] = time.perf_counter()
+
+    @task_postrun.connect(weak=False)
+    def on_postrun(task_id=None, task=None, state=None, **kwargs):
+        start = started.pop(task_id, None)
+        if start is None or task is None:
+            return
+        elapsed = time.perf_counter() - start
+        name = task.name
+        fields = {f"{name}|count": 1, f"{name}|state={state}": 1}
+        for bound in TASK_BUCKETS:
+            if elapsed <= bound:
+                fields[f"{name}|le={bound}"] = 1
+                break
+        try:
+            pipe = client.pipeline(transaction=False)
+            for field, amount in fields.items():
+                pipe.hincrby(Config.METRICS_REDIS_KEY, field, amount)
+            pipe.hincrbyfloat(Config.METRICS_REDIS_KEY, f"{name}|sum", elapsed)
+            pipe.execute()
+        except Exception:
+            pass
+
+
+def _celery_samples():
+    # Worker histograms from the Redis hash plus the queue depth. Returns
+    # (counters, histograms, gauges) in the registry's shapes.
+    from config import Config
+
+    counters, histograms, gauges = {}, {}, {}
+    try:
+        client = _redis()
+        raw = client.hgetall(Config.METRICS_REDIS_KEY)
+        gauges['celery_queue_length', _labels(queue=Config.CELERY_QUEUE)] = client.llen(Config.CELERY_QUEUE)
+    except Exception:
+        return counters, histograms, gauges
+
+    per_task = defaultdict(lambda: [TASK_BUCKETS, [0] * len(TASK_BUCKETS), 0, 0.0])
+    for field, value in raw.items():
+        name, _, key = field.decode().partition('|')
+        hist = per_task[name]
+        if key == 'count':
+            hist[2] = int(value)
+        elif key == 'sum':
+            hist[3] = float(value)
+        elif key.startswith('le='):
+            hist[1][TASK_BUCKETS.index(float(key[3:]))] = int(value)
+        elif key.startswith('state='):
+            counters['celery_tasks_total', _labels(task=name, state=key[6:])] = float(value)
+    for name, hist in per_task.items():
+        histograms['celery_task_duration_seconds', _labels(task=name)] = tuple(hist)
+    return counters, histograms, gauges
+
+
+# Prometheus text exposition
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def render():
+    counters, histograms = registry.snapshot()
+    celery_counters, celery_histograms, gauges = _celery_samples()
+    counters.update(celery_counters)
+    histograms.update(celery_histograms)
+
+    samples = defaultdict(list)
+    for (name, labels), value in sorted(counters.items()):
+        samples[name].append(f"{name}{_format_labels(labels)} {value:g}")
+    for (name, labels), value in sorted(gauges.items()):
+        samples[name].append(f"{name}{_format_labels(labels)} {value:g}")
+    for (name, labels), (buckets, counts, count, total) in sorted(histograms.items()):
+        cumulative = 0
+        for bound, n in zip(buckets, counts):
+            cumulative += n
+            samples[name].append(f"{name}_bucket{_format_labels(labels, [('le', f'{bound:g}')])} {cumulative}")
+        samples[name].append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}")
+        samples[name].append(f"{name}_sum{_format_labels(labels)} {total:g}")
+        samples[name].append(f"{name}_count{_format_labels(labels)} {count}")
+
+    lines = []
+    for name in sorted(samples):
+        kind, text = registry.help.get(name, ('untyped', name))
+        lines.append(f"# HELP {name} {text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(samples[name])
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,194 @@
+from datetime import timedelta
+
+from sqlalchemy import bindparam, inspect, select, text
+
+from models import db
+
+
+# Versioned schema migrations for databases created before a model change.
+# db.create_all() only creates missing tables, so indexes and columns added to
+# existing tables have to be applied here. The highest applied version is kept
+# in the schema_version table. Every step must be safe to run against a fresh
+# database that create_all() already built with the latest schema.
+#
+#   python migrations.py            # upgrade instance/parking.db
+
+MIGRATIONS = []
+
+
+def migration(version):
+    def register(step):
+        MIGRATIONS.append((version, step))
+        return step
+    return register
+
+
+def _create_indexes(conn, model, *names):
+    for index in model.__table__.indexes:
+        if index.name in names:
+            index.create(conn, checkfirst=True)
+
+
+def _add_column(conn, model, name):
+    table = model.__table__
+    if name in {c['name'] for c in inspect(conn).get_columns(table.name)}:
+        return
+    column = table.c[name]
+    ddl = f'{name} {column.type.compile(dialect=conn.dialect)}'
+    if column.server_default is not None:
+        ddl += f" DEFAULT '{column.server_default.arg}'"
+    if not column.nullable:
+        ddl += ' NOT NULL'
+    quoted = conn.dialect.identifier_preparer.quote(table.name)
+    conn.execute(text(f'ALTER TABLE {quoted} ADD COLUMN {ddl}'))
+
+
+@migration(1)
+def add_hot_path_indexes(conn):
+    from models import ParkingLot, ParkingSpot, Reservation
+
+    _create_indexes(conn, ParkingLot, 'ix_parking_lot_name')
+    _create_indexes(conn, ParkingSpot, 'ix_parking_spot_lot_status')
+    _create_indexes(conn, Reservation, 'ix_reservation_user_leaving', 'ix_reservation_parking_time')
+
+
+@migration(2)
+def add_lot_occupancy_counters(conn):
+    from models import ParkingLot
+
+    _add_column(conn, ParkingLot, 'available_count')
+    _add_column(conn, ParkingLot, 'occupied_count')
+    conn.execute(text(
+        "UPDATE parking_lot SET "
+        "available_count = (SELECT COUNT(*) FROM parking_spot "
+        "WHERE parking_spot.lot_id = parking_lot.id AND parking_spot.status = 'A'), "
+        "occupied_count = (SELECT COUNT(*) FROM parking_spot "
+        "WHERE parking_spot.lot_id = parking_lot.id AND parking_spot.status = 'O')"
+    ))
+
+
+@migration(3)
+def add_user_history_index(conn):
+    from models import Reservation
+
+    _create_indexes(conn, Reservation, 'ix_reservation_user_parking_time')
+
+
+@migration(4)
+def add_active_reservation_constraint(conn):
+    from models import Reservation
+
+    duplicates = conn.execute(text(
+        "SELECT user_id FROM reservation WHERE leaving_time IS NULL "
+        "GROUP BY user_id HAVING COUNT(*) > 1"
+    )).scalars().all()
+    if duplicates:
+        raise RuntimeError(f"Users with more than one active reservation: {duplicates}. "
+                           "Release the extra reservations, then run the migration again.")
+    # The index now also refers to batch_id; before migration 9 adds that
+    # column, migration 9 creates the index instead. Dialects without partial
+    # indexes skip it (see models.PARTIAL_INDEX_DIALECTS).
+    if 'batch_id' in {c['name'] for c in inspect(conn).get_columns('reservation')}:
+        _create_indexes(conn, Reservation, 'ux_reservation_user_active')
+
+
+@migration(5)
+def add_leaving_time_index(conn):
+    from models import Reservation
+
+    _create_indexes(conn, Reservation, 'ix_reservation_leaving_time')
+
+
+@migration(6)
+def add_lot_tariff(conn):
+    from models import ParkingLot
+
+    _add_column(conn, ParkingLot, 'tariff')
+
+
+@migration(7)
+def add_reservation_expiry(conn):
+    from flask import current_app
+    from models import ParkingLot, Reservation
+
+    _add_column(conn, ParkingLot, 'max_stay_minutes')
+    _add_column(conn, Reservation, 'expires_at')
+    _create_indexes(conn, Reservation, 'ix_reservation_active_expiry')
+
+    # Reservations already active get the default max stay; the sweeper
+    # closes the ones past it on its next run.
+    minutes = current_app.config['MAX_STAY_MINUTES']
+    table = Reservation.__table__
+    rows = conn.execute(select(table.c.id, table.c.parking_time)
+                        .where(table.c.leaving_time.is_(None), table.c.expires_at.is_(None))).all()
+    if minutes and rows:
+        conn.execute(table.update().where(table.c.id == bindparam('reservation_id'))
+                     .values(expires_at=bindparam('expiry')),
+                     [{'reservation_id': row.id, 'expiry': row.parking_time + timedelta(minutes=minutes)}
+                      for row in rows])
+
+
+@migration(8)
+def widen_password_hash(conn):
+    # scrypt hashes are longer than the old 120 characters; SQLite does not
+    # enforce VARCHAR lengths.
+    dialect = conn.dialect.name
+    if dialect == 'postgresql':
+        conn.execute(text('ALTER TABLE "user" ALTER COLUMN password TYPE VARCHAR(255)'))
+    elif dialect in ('mysql', 'mariadb'):
+        conn.execute(text('ALTER TABLE `user` MODIFY password VARCHAR(255) NOT NULL'))
+
+
+@migration(9)
+def add_fleet_batches(conn):
+    from models import Reservation
+
+    _add_column(conn, Reservation, 'batch_id')
+    _create_indexes(conn, Reservation, 'ix_reservation_batch')
+    # Rebuilt so that fleet batch rows are left out of the one-active rule
+    for index in Reservation.__table__.indexes:
+        if index.name == 'ux_reservation_user_active':
+            index.drop(conn, checkfirst=True)
+            index.create(conn)
+
+
+@migration(10)
+def drop_unfiltered_active_index(conn):
+    # Migration 4 used to build ux_reservation_user_active on MySQL as a plain
+    # unique index on user_id, which allows one reservation per user ever.
+    # ix_reservation_user_leaving still covers the user_id foreign key.
+    from models import PARTIAL_INDEX_DIALECTS
+
+    if conn.dialect.name in PARTIAL_INDEX_DIALECTS:
+        return
+    if 'ux_reservation_user_active' in {i['name'] for i in inspect(conn).get_indexes('reservation')}:
+        conn.execute(text('DROP INDEX ux_reservation_user_active ON reservation'))
+
+
+def current_version(conn):
+    conn.execute(text('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)'))
+    return conn.execute(text('SELECT MAX(version) FROM schema_version')).scalar() or 0
+
+
+def upgrade():
+    # Must run inside an app context; returns the versions that were applied.
+    applied = []
+    with db.engine.begin() as conn:
+        version = current_version(conn)
+        for number, step in sorted(MIGRATIONS, key=lambda m: m[0]):
+            if number <= version:
+                continue
+            step(conn)
+            conn.execute(text('INSERT INTO schema_version (version) VALUES (:version)'),
+                         {'version': number})
+            applied.append(number)
+    return applied
+
+
+if __name__ == '__main__':
+    from app import create_app
+
+    with create_app(web=False).app_context():
+        db.create_all()
+        applied = upgrade()
+        print(f"Applied migrations: {applied}" if applied else "Schema is up to date")
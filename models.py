@@ -1,12 +1,18 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+from database import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+# Dialects with partial (filtered) indexes. Elsewhere (MySQL, MariaDB) the
+# partial indexes below are not created and reserve_spot locks the user row
+# instead.
+PARTIAL_INDEX_DIALECTS = ('sqlite', 'postgresql')
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(100), unique=True, nullable=False)
-    password = db.Column(db.String(120), nullable=False)
+    password = db.Column(db.String(255), nullable=False)
     role = db.Column(db.String(10), default='user')
 
 
@@ -17,6 +23,14 @@ class ParkingLot(db.Model):
     pin_code = db.Column(db.String(200))
     price = db.Column(db.Float, nullable=False)
     total_spots = db.Column(db.Integer, nullable=False)
+    available_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    occupied_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    tariff = db.Column(db.Text)  # JSON, see pricing.py; NULL means price per hour
+    max_stay_minutes = db.Column(db.Integer)  # NULL: MAX_STAY_MINUTES, 0: no limit
+
+    __table_args__ = (
+        db.Index('ix_parking_lot_name', 'name'),
+    )
 
     spots = db.relationship('ParkingSpot', backref='lot', lazy=True)
 
@@ -26,6 +40,10 @@ class ParkingSpot(db.Model):
     lot_id = db.Column(db.Integer, db.ForeignKey('parking_lot.id'), nullable=False)
     status = db.Column(db.String(10),default="A")
 
+    __table_args__ = (
+        db.Index('ix_parking_spot_lot_status', 'lot_id', 'status'),
+    )
+
     reservations = db.relationship('Reservation',backref='spot',lazy=True)
 
 
@@ -36,5 +54,69 @@ class Reservation(db.Model):
     parking_time = db.Column(db.DateTime, default = datetime.utcnow)
     leaving_time = db.Column(db.DateTime, nullable=True)
     cost = db.Column(db.Float, default=0.0)
+    expires_at = db.Column(db.DateTime, nullable=True)
+    batch_id = db.Column(db.String(32), nullable=True)  # fleet bookings, see fleet.py
+
+    __table_args__ = (
+        db.Index('ix_reservation_user_leaving', 'user_id', 'leaving_time'),
+        db.Index('ix_reservation_user_parking_time', 'user_id', 'parking_time', 'id'),
+        db.Index('ix_reservation_parking_time', 'parking_time'),
+        db.Index('ix_reservation_leaving_time', 'leaving_time', 'id'),
+        # At most one active reservation per user outside fleet batches,
+        # enforced by the database. Without the WHERE clause it would allow
+        # one reservation per user ever, so other dialects skip it.
+        db.Index('ux_reservation_user_active', 'user_id', unique=True,
+                 sqlite_where=db.text('leaving_time IS NULL AND batch_id IS NULL'),
+                 postgresql_where=db.text('leaving_time IS NULL AND batch_id IS NULL'))
+        .ddl_if(dialect=PARTIAL_INDEX_DIALECTS),
+        db.Index('ix_reservation_batch', 'batch_id'),
+        # Overdue active reservations for the expiry sweeper (expiry.py)
+        db.Index('ix_reservation_active_expiry', 'expires_at',
+                 sqlite_where=db.text('leaving_time IS NULL'),
+                 postgresql_where=db.text('leaving_time IS NULL')),
+    )
+
+    user = db.relationship('User', backref='reservations')
+
+
+class IdempotencyKey(db.Model):
+    # Stored response of a POST sent with an Idempotency-Key header. status is
+    # NULL while the first request is still running.
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False)
+    key = db.Column(db.String(100), nullable=False)
+    method = db.Column(db.String(10), nullable=False)
+    path = db.Column(db.String(200), nullable=False)
+    status = db.Column(db.Integer)
+    body = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ux_idempotency_user_key', 'user_id', 'key', unique=True),
+        db.Index('ix_idempotency_created_at', 'created_at'),
+    )
+
+class LotUsageHourly(db.Model):
+    # Rollup of closed reservations per lot and hour, filled by
+    # tasks.rollup_lot_usage (see rollups.py).
+    id = db.Column(db.Integer, primary_key=True)
+    lot_id = db.Column(db.Integer, nullable=False)
+    hour = db.Column(db.DateTime, nullable=False)
+    bookings = db.Column(db.Integer, nullable=False, default=0)
+    occupied_minutes = db.Column(db.Float, nullable=False, default=0.0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+    peak_occupancy = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ux_lot_usage_lot_hour', 'lot_id', 'hour', unique=True),
+        db.Index('ix_lot_usage_hour', 'hour'),
+    )
+
 
-    user = db.relationship('User', backref='reservations')
\ No newline at end of file
+class RollupWatermark(db.Model):
+    # Position of the last reservation folded into the rollups, ordered by
+    # (leaving_time, id), and the running revenue total up to it.
+    name = db.Column(db.String(50), primary_key=True)
+    leaving_time = db.Column(db.DateTime)
+    reservation_id = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
@@ -0,0 +1,56 @@
+from sqlalchemy import select, update
+
+from models import db, ParkingLot, ParkingSpot
+
+
+# ParkingLot.available_count / occupied_count mirror the spot statuses so lot
+# listings never have to count parking_spot rows. Every write that changes a
+# spot status adjusts them in the same transaction; reconcile() repairs any
+# drift (manual edits, writes from older code) from the spot table.
+
+def adjust_counts(lot_id, available=0, occupied=0):
+    db.session.execute(
+        update(ParkingLot)
+        .where(ParkingLot.id == lot_id)
+        .values(available_count=ParkingLot.available_count + available,
+                occupied_count=ParkingLot.occupied_count + occupied)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _spot_count(status):
+    return select(db.func.count(ParkingSpot.id)) \
+        .where(ParkingSpot.lot_id == ParkingLot.id, ParkingSpot.status == status) \
+        .scalar_subquery()
+
+
+def find_drift():
+    available, occupied = _spot_count('A'), _spot_count('O')
+    rows = db.session.query(ParkingLot.id, ParkingLot.available_count, ParkingLot.occupied_count,
+                            available, occupied).all()
+    return [
+        {
+            "lot_id": lot_id,
+            "available_count": stored_available,
+            "occupied_count": stored_occupied,
+            "available": actual_available,
+            "occupied": actual_occupied,
+        }
+        for lot_id, stored_available, stored_occupied, actual_available, actual_occupied in rows
+        if (stored_available, stored_occupied) != (actual_available, actual_occupied)
+    ]
+
+
+def reconcile():
+    # Returns the drift that was found; the fix recounts inside the UPDATE so
+    # reservations committed in the meantime are not overwritten.
+    drift = find_drift()
+    if drift:
+        db.session.execute(
+            update(ParkingLot)
+            .where(ParkingLot.id.in_([d["lot_id"] for d in drift]))
+            .values(available_count=_spot_count('A'), occupied_count=_spot_count('O'))
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+    return drift
@@ -0,0 +1,90 @@
+import base64
+from datetime import datetime
+
+from flask import Response, current_app, jsonify, request, stream_with_context
+from sqlalchemy import and_, or_
+
+from models import Reservation
+
+
+# Keyset pagination over reservations ordered newest first by
+# (parking_time, id). The cursor is the sort key of the last row returned, so
+# every page is an index range scan no matter how deep into history it is.
+#
+#   ?limit=50&cursor=<next_cursor>   one page of JSON plus next_cursor
+#   ?format=ndjson                   every row from the cursor on, one JSON
+#                                    object per line, read from a server-side
+#                                    cursor so memory stays flat
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+STREAM_BATCH = 1000
+
+
+def encode_cursor(parking_time, reservation_id):
+    raw = f"{parking_time.isoformat()}|{reservation_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+    parking_time, reservation_id = raw.split('|')
+    return datetime.fromisoformat(parking_time), int(reservation_id)
+
+
+def page_args():
+    # Returns (limit, cursor, streaming) or raises ValueError on bad input.
+    streaming = request.args.get('format') == 'ndjson'
+    limit = request.args.get('limit', type=int)
+    if limit is None:
+        limit = None if streaming else DEFAULT_LIMIT
+    elif limit < 1:
+        raise ValueError('limit must be positive')
+    elif not streaming:
+        limit = min(limit, MAX_LIMIT)
+
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            cursor = decode_cursor(cursor)
+        except Exception:
+            raise ValueError('invalid cursor')
+    return limit, cursor, streaming
+
+
+def newest_first(query, cursor=None):
+    if cursor:
+        parking_time, reservation_id = cursor
+        query = query.filter(or_(
+            Reservation.parking_time < parking_time,
+            and_(Reservation.parking_time == parking_time, Reservation.id < reservation_id)
+        ))
+    return query.order_by(Reservation.parking_time.desc(), Reservation.id.desc())
+
+
+def paginated_response(query, serialize, key):
+    # query must select Reservation.id and Reservation.parking_time as "id"
+    # and "parking_time" columns and be ordered by newest_first().
+    try:
+        limit, cursor, streaming = page_args()
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
+    query = newest_first(query, cursor)
+
+    if streaming:
+        if limit:
+            query = query.limit(limit)
+        rows = query.yield_per(STREAM_BATCH)
+
+        def generate():
+            for row in rows:
+                yield current_app.json.dumps(serialize(row)) + '\n'
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+    rows = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].parking_time, rows[-1].id)
+    return jsonify({key: [serialize(row) for row in rows], "next_cursor": next_cursor})
@@ -0,0 +1,238 @@
+import json
+import math
+from bisect import bisect_right
+from datetime import datetime, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+
+# Parking tariffs. A lot without a tariff keeps the old price: lot.price per
+# hour, pro rata. A tariff is JSON stored on the lot:
+#
+#   {
+#     "rate": 40,                       hourly base rate (default: lot.price)
+#     "periods": [                      time-of-day / weekday rates, later wins
+#       {"days": ["sat", "sun"], "rate": 20},
+#       {"days": ["mon", "tue", "wed", "thu", "fri"], "from": "08:00", "to": "20:00", "rate": 60},
+#       {"from": "22:00", "to": "06:00", "rate": 10}
+#     ],
+#     "tiers": [{"after_minutes": 180, "multiplier": 0.5}],   by length of stay
+#     "daily_cap": 300,                 most charged per 24 hours from entry
+#     "grace_minutes": 10               shorter stays are free
+#   }
+#
+# compile_tariff() turns that into one week of rate intervals with the
+# cumulative cost at every interval boundary. The cost between two instants is
+# the difference of two lookups (a bisect each), tiers multiply whole elapsed
+# ranges and the cap repeats with the week every 7 days, so a stay of any
+# length costs O(tiers x log intervals). The same arithmetic runs over NumPy
+# arrays in price_many() to price a whole reservation history at once.
+#
+# Times are local (PRICING_TIMEZONE); reservations are stored in UTC.
+
+MINUTES_PER_DAY = 24 * 60
+WEEK = 7 * MINUTES_PER_DAY
+DAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+
+def _minute_of_day(value, default):
+    if value is None:
+        return default
+    hours, _, minutes = str(value).partition(':')
+    result = int(hours) * 60 + int(minutes or 0)
+    if not 0 <= result <= MINUTES_PER_DAY:
+        raise ValueError(f"invalid time {value!r}")
+    return result
+
+
+def _number(value, name):
+    number = float(value)
+    if not math.isfinite(number) or number < 0:
+        raise ValueError(f"{name} must be finite and not negative")
+    return number
+
+
+def _rate(value):
+    return _number(value, 'rates')
+
+
+def _objects(spec, name):
+    items = spec.get(name)
+    if items is None:
+        return []
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        raise ValueError(f"{name} must be a list of objects")
+    return items
+
+
+class Tariff:
+
+    def __init__(self, spec, base_rate):
+        spec = spec or {}
+        rate = _rate(spec.get('rate', base_rate))
+        minute_rates = [rate] * WEEK
+
+        for period in _objects(spec, 'periods'):
+            days = period.get('days', DAYS)
+            if any(day not in DAYS for day in days):
+                raise ValueError(f"days must be among {DAYS}")
+            start = _minute_of_day(period.get('from'), 0)
+            end = _minute_of_day(period.get('to'), MINUTES_PER_DAY)
+            period_rate = _rate(period['rate'])
+            for day in days:
+                base = DAYS.index(day) * MINUTES_PER_DAY
+                # A period like 22:00-06:00 runs into the next day
+                length = end - start if end > start else MINUTES_PER_DAY - start + end
+                for minute in range(base + start, base + start + length):
+                    minute_rates[minute % WEEK] = period_rate
+
+        # Collapse equal-rate minutes into intervals; cumulative[i] is the cost
+        # from the start of the week to boundaries[i].
+        self.boundaries, self.rates, self.cumulative = [], [], []
+        total = 0.0
+        for minute, per_hour in enumerate(minute_rates):
+            if not self.rates or per_hour / 60 != self.rates[-1]:
+                if self.rates:
+                    total += (minute - self.boundaries[-1]) * self.rates[-1]
+                self.boundaries.append(minute)
+                self.rates.append(per_hour / 60)
+                self.cumulative.append(total)
+        self.week_cost = total + (WEEK - self.boundaries[-1]) * self.rates[-1]
+
+        tiers = [(0, 1.0)] + sorted((int(_number(t['after_minutes'], 'after_minutes')),
+                                     _number(t['multiplier'], 'multipliers'))
+                                    for t in _objects(spec, 'tiers'))
+        if any(m < 0 for _, m in tiers) or any(a <= 0 for a, _ in tiers[1:]):
+            raise ValueError('tiers need after_minutes > 0 and a non-negative multiplier')
+        self.tiers = tiers
+        self.cap = _number(spec['daily_cap'], 'daily_cap') if spec.get('daily_cap') is not None else None
+        self.grace = int(_number(spec.get('grace_minutes', 0), 'grace_minutes'))
+        # Whole 24 hour blocks before the last tier starts are capped one by one
+        self.ramp_blocks = math.ceil(tiers[-1][0] / MINUTES_PER_DAY)
+
+    # Cumulative cost W(x) from the start of the entry week to x minutes
+    # after it, as a scalar and over arrays.
+
+    def _cost_to(self, x):
+        weeks, x = divmod(x, WEEK)
+        i = bisect_right(self.boundaries, x) - 1
+        return weeks * self.week_cost + self.cumulative[i] + (x - self.boundaries[i]) * self.rates[i]
+
+    def _cost_to_many(self, x):
+        import numpy as np
+        weeks = x // WEEK
+        x = x - weeks * WEEK
+        i = np.searchsorted(np.asarray(self.boundaries), x, side='right') - 1
+        return (weeks * self.week_cost + np.asarray(self.cumulative)[i]
+                + (x - np.asarray(self.boundaries)[i]) * np.asarray(self.rates)[i])
+
+    def _cost(self, offset, minutes, cost_to, minimum, maximum):
+        # offset: entry time in minutes since Monday 00:00; minutes: length of
+        # stay. Written with minimum/maximum only, so it works on scalars and
+        # arrays alike.
+        def raw(a, b):
+            total = 0.0
+            for k, (tier_start, multiplier) in enumerate(self.tiers):
+                tier_end = self.tiers[k + 1][0] if k + 1 < len(self.tiers) else math.inf
+                lo, hi = maximum(a, tier_start), minimum(b, tier_end)
+                hi = maximum(hi, lo)
+                total = total + multiplier * (cost_to(offset + hi) - cost_to(offset + lo))
+            return total
+
+        if self.cap is None:
+            return raw(0, minutes)
+
+        cap = self.cap
+        total = 0.0
+        for block in range(self.ramp_blocks):
+            a = block * MINUTES_PER_DAY
+            b = maximum(minimum(minutes, a + MINUTES_PER_DAY), a)
+            total = total + minimum(cap, raw(a, b))
+
+        # After the ramp the multiplier is constant and a full block's cost
+        # depends only on its weekday, so the blocks repeat every 7.
+        multiplier = self.tiers[-1][1]
+        ramp_end = self.ramp_blocks * MINUTES_PER_DAY
+        full = maximum(minutes - ramp_end, 0) // MINUTES_PER_DAY
+        cycles, rest = full // 7, full % 7
+        for k in range(7):
+            a = offset + ramp_end + k * MINUTES_PER_DAY
+            block_cost = minimum(cap, multiplier * (cost_to(a + MINUTES_PER_DAY) - cost_to(a)))
+            total = total + block_cost * (cycles + minimum(maximum(rest - k, 0), 1))
+
+        tail_start = ramp_end + full * MINUTES_PER_DAY
+        tail_end = maximum(minutes, tail_start)
+        total = total + minimum(cap, multiplier * (cost_to(offset + tail_end) - cost_to(offset + tail_start)))
+        return total
+
+    def price_minutes(self, offset, minutes):
+        if minutes <= self.grace:
+            return 0.0
+        return round(self._cost(offset, minutes, self._cost_to, min, max), 2)
+
+    def price_many(self, offsets, minutes):
+        import numpy as np
+        offsets = np.asarray(offsets, dtype=float)
+        minutes = np.asarray(minutes, dtype=float)
+        cost = self._cost(offsets, minutes, self._cost_to_many, np.minimum, np.maximum)
+        return np.where(minutes <= self.grace, 0.0, np.round(cost, 2))
+
+
+@lru_cache(maxsize=256)
+def _compiled(spec_json, base_rate):
+    return Tariff(json.loads(spec_json) if spec_json else None, base_rate)
+
+
+def compile_tariff(spec, base_rate):
+    # Validates a tariff dict (ValueError when invalid) and returns its JSON
+    # form for ParkingLot.tariff, or None for the plain hourly price.
+    if not spec:
+        return None
+    if not isinstance(spec, dict):
+        raise ValueError('tariff must be an object')
+    try:
+        spec_json = json.dumps(spec, sort_keys=True)
+        _compiled(spec_json, float(base_rate))
+    except (KeyError, TypeError) as e:
+        raise ValueError(f"invalid tariff: {e}")
+    return spec_json
+
+
+def tariff_for(spec_json, base_rate):
+    return _compiled(spec_json or None, float(base_rate))
+
+
+def week_offset(moment, zone):
+    # Minutes since Monday 00:00 local time of a naive UTC datetime.
+    local = moment.replace(tzinfo=timezone.utc).astimezone(ZoneInfo(zone))
+    return local.weekday() * MINUTES_PER_DAY + local.hour * 60 + local.minute + local.second / 60
+
+
+def price_stay(spec_json, base_rate, start, end, zone):
+    minutes = max((end - start).total_seconds() / 60, 0)
+    return tariff_for(spec_json, base_rate).price_minutes(week_offset(start, zone), minutes)
+
+
+def week_offsets_many(starts, zone):
+    # week_offset over a datetime64 array of UTC instants. The UTC offset is
+    # looked up once per distinct day.
+    import numpy as np
+    starts = np.asarray(starts, dtype='datetime64[s]')
+    days, inverse = np.unique(starts.astype('datetime64[D]'), return_inverse=True)
+    tz = ZoneInfo(zone)
+    shifts = np.array([
+        tz.utcoffset(datetime.fromisoformat(str(day)).replace(hour=12)).total_seconds() / 60
+        for day in days
+    ])
+    local = starts.astype('int64') / 60 + shifts[inverse]
+    # 1970-01-01 was a Thursday, three days after a Monday
+    return (local + 3 * MINUTES_PER_DAY) % WEEK
+
+
+def price_many(spec_json, base_rate, starts, ends, zone):
+    # Costs for arrays of UTC start/end instants (datetime64 or datetimes).
+    import numpy as np
+    starts = np.asarray(starts, dtype='datetime64[s]')
+    ends = np.asarray(ends, dtype='datetime64[s]')
+    minutes = np.maximum((ends - starts).astype('int64') / 60, 0)
+    return tariff_for(spec_json, base_rate).price_many(week_offsets_many(starts, zone), minutes)
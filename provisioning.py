@@ -0,0 +1,56 @@
+from sqlalchemy import insert, select, update
+
+from models import db, ParkingSpot
+from occupancy import adjust_counts
+
+# Bulk creation and resizing of a lot's spots. Spots are added with a single
+# executemany INSERT and retired or reactivated with one SELECT and UPDATEs of
+# CHUNK ids, all inside the caller's transaction. Shrinking a lot never
+# touches occupied spots and retires spots (status 'R') instead of deleting
+# them, so reservation history keeps pointing at real rows.
+
+CHUNK = 5000  # ids per UPDATE, below SQLite's bound-parameter limit
+
+def add_spots(lot_id, count):
+    if count > 0:
+        db.session.execute(insert(ParkingSpot.__table__), [{"lot_id": lot_id, "status": 'A'}] * count)
+
+
+def _set_status(lot_id, from_status, to_status, count, newest_first=False):
+    # The ids are selected (and locked) first: MySQL rejects LIMIT inside an
+    # IN subquery.
+    order = ParkingSpot.id.desc() if newest_first else ParkingSpot.id
+    ids = list(db.session.execute(
+        select(ParkingSpot.id)
+        .where(ParkingSpot.lot_id == lot_id, ParkingSpot.status == from_status)
+        .order_by(order)
+        .limit(count)
+        .with_for_update()
+    ).scalars())
+    changed = 0
+    for i in range(0, len(ids), CHUNK):
+        result = db.session.execute(
+            update(ParkingSpot)
+            .where(ParkingSpot.id.in_(ids[i:i + CHUNK]), ParkingSpot.status == from_status)
+            .values(status=to_status)
+            .execution_options(synchronize_session=False)
+        )
+        changed += result.rowcount
+    return changed
+
+
+def resize_lot(lot, total_spots):
+    # Returns an error message when the lot cannot shrink that far, otherwise
+    # None. The caller commits (or rolls back on error).
+    change = total_spots - lot.total_spots
+    if change > 0:
+        reactivated = _set_status(lot.id, 'R', 'A', change)
+        add_spots(lot.id, change - reactivated)
+        adjust_counts(lot.id, available=change)
+    elif change < 0:
+        retired = _set_status(lot.id, 'A', 'R', -change, newest_first=True)
+        if retired < -change:
+            return f"Cannot shrink lot to {total_spots} spots; only {retired} free spots can be removed"
+        adjust_counts(lot.id, available=change)
+    lot.total_spots = total_spots
+    return None
@@ -0,0 +1,119 @@
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import func, select
+
+from caching import cache
+from mailing import chunked, user_email
+from models import db, User, ParkingLot, ParkingSpot, Reservation
+
+
+# Monthly activity reports computed set-wise: one grouped query for booking
+# count and total spent per user and one windowed query for each user's most
+# used lot, both over a half-open parking_time range so the parking_time index
+# applies. Rows stream out in user order. Once a month has ended and every
+# reservation that started in it has been released, its summaries no longer
+# change, so they are cached in chunks and a re-run or resend skips the SQL.
+# Until then a release can still add a cost to the month, so it is computed
+# afresh each time.
+
+def month_range(year, month):
+    start = datetime(year, month, 1)
+    end = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    return start, end
+
+
+def previous_month(today):
+    return (today.year - 1, 12) if today.month == 1 else (today.year, today.month - 1)
+
+
+def settled(year, month):
+    # No reservation that started in the month is still open
+    start, end = month_range(year, month)
+    open_stay = select(Reservation.id) \
+        .where(Reservation.parking_time >= start, Reservation.parking_time < end,
+               Reservation.leaving_time.is_(None)) \
+        .limit(1)
+    return db.session.scalar(open_stay) is None
+
+
+def monthly_summaries(year, month):
+    # Yields (user_id, username, bookings, total_spent, most_used_lot).
+    start, end = month_range(year, month)
+    in_month = (Reservation.parking_time >= start, Reservation.parking_time < end)
+
+    totals = select(Reservation.user_id,
+                    func.count(Reservation.id).label('bookings'),
+                    func.coalesce(func.sum(Reservation.cost), 0).label('spent')) \
+        .where(*in_month) \
+        .group_by(Reservation.user_id) \
+        .subquery()
+
+    lot_usage = select(Reservation.user_id,
+                       ParkingLot.name,
+                       func.row_number().over(
+                           partition_by=Reservation.user_id,
+                           order_by=(func.count(Reservation.id).desc(), ParkingLot.name)
+                       ).label('rank')) \
+        .join(ParkingSpot, Reservation.spot_id == ParkingSpot.id) \
+        .join(ParkingLot, ParkingSpot.lot_id == ParkingLot.id) \
+        .where(*in_month) \
+        .group_by(Reservation.user_id, ParkingLot.id, ParkingLot.name) \
+        .subquery()
+
+    query = select(User.id, User.username,
+                   func.coalesce(totals.c.bookings, 0),
+                   func.coalesce(totals.c.spent, 0),
+                   lot_usage.c.name) \
+        .outerjoin(totals, totals.c.user_id == User.id) \
+        .outerjoin(lot_usage, (lot_usage.c.user_id == User.id) & (lot_usage.c.rank == 1)) \
+        .where(User.role == 'user') \
+        .order_by(User.id) \
+        .execution_options(yield_per=2000)
+
+    for row in db.session.execute(query):
+        yield tuple(row)
+
+
+def report_chunks(year, month, now=None):
+    # Summaries in chunks of MAIL_BATCH_SIZE rows, from the cache when the
+    # month is closed and settled and was computed before.
+    size = current_app.config['MAIL_BATCH_SIZE']
+    closed = month_range(year, month)[1] <= (now or datetime.now()) and settled(year, month)
+    prefix = f"monthly-report:{year}-{month:02d}:{size}"
+
+    if closed:
+        count = cache.get(f"{prefix}:chunks")
+        if count is not None:
+            chunks = cache.get_many(*[f"{prefix}:{i}" for i in range(count)])
+            if all(chunk is not None for chunk in chunks):
+                yield from chunks
+                return
+
+    timeout = current_app.config['REPORT_CACHE_TIMEOUT']
+    count = 0
+    for chunk in chunked(monthly_summaries(year, month), size):
+        if closed:
+            cache.set(f"{prefix}:{count}", chunk, timeout=timeout)
+        count += 1
+        yield chunk
+    if closed:
+        cache.set(f"{prefix}:chunks", count, timeout=timeout)
+
+
+def report_message(row, year, month):
+    _, username, bookings, spent, most_used_lot = row
+    period = datetime(year, month, 1).strftime('%B %Y')
+    html_body = f"""
+    <h2>Monthly Parking Report</h2>
+    <p>Hi {username}, here is your activity summary for {period}:</p>
+    <ul>
+        <li><strong>Total Bookings:</strong> {bookings}</li>
+        <li><strong>Total Amount Spent:</strong> ₹{spent:.2f}</li>
+        <li><strong>Most Used Parking Lot:</strong> {most_used_lot or "N/A"}</li>
+    </ul>
+    <p>Thank you for using our Parking App!</p>
+    """
+    return {"subject": f"Monthly Parking Report - {period}",
+            "recipients": [user_email(username)],
+            "html": html_body}
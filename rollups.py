@@ -0,0 +1,197 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, bindparam, func, insert, or_, select, tuple_, update
+
+from models import db, LotUsageHourly, ParkingLot, ParkingSpot, Reservation, RollupWatermark
+
+
+# Per lot and hour usage rollups for admin analytics.
+#
+# tasks.rollup_lot_usage folds reservations into lot_usage_hourly as they
+# close, in (leaving_time, id) order from a stored watermark, so each run only
+# reads what closed since the last one (ix_reservation_leaving_time):
+#   bookings          completed bookings that started in the hour
+#   occupied_minutes  minutes of those bookings that fall in the hour
+#   revenue           cost charged at leaving time in the hour
+#   peak_occupancy    highest occupied_count seen by a run in the hour (sampled)
+# Reservations still active are not counted until they close. Rows are only
+# read back by the analytics endpoints and total_revenue(), whose cost does not
+# grow with the reservation history.
+
+WATERMARK = 'lot_usage'
+
+
+def hour_of(value):
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def split_by_hour(start, end):
+    # Yields (hour, minutes of [start, end) inside that hour).
+    hour = hour_of(start)
+    while hour < end:
+        following = hour + timedelta(hours=1)
+        minutes = (min(end, following) - max(start, hour)).total_seconds() / 60
+        if minutes > 0:
+            yield hour, minutes
+        hour = following
+
+
+def _watermark():
+    mark = db.session.get(RollupWatermark, WATERMARK)
+    if mark is None:
+        mark = RollupWatermark(name=WATERMARK, leaving_time=None, reservation_id=0, revenue=0.0)
+        db.session.add(mark)
+        db.session.flush()
+    return mark
+
+
+def _after(leaving_time, reservation_id):
+    if leaving_time is None:
+        return Reservation.leaving_time.isnot(None)
+    return or_(Reservation.leaving_time > leaving_time,
+               and_(Reservation.leaving_time == leaving_time, Reservation.id > reservation_id))
+
+
+def _peak(column, value):
+    greatest = func.max if db.session.get_bind().dialect.name == 'sqlite' else func.greatest
+    return greatest(column, value)
+
+
+def _apply(buckets):
+    # Adds {(lot_id, hour): (bookings, minutes, revenue, peak)} to the rollup
+    # rows: one lookup per 500 keys, then an executemany UPDATE for the rows
+    # that exist and an executemany INSERT for the rest.
+    table = LotUsageHourly.__table__
+    keys = list(buckets)
+    existing = {}
+    for i in range(0, len(keys), 500):
+        chunk = keys[i:i + 500]
+        for row_id, lot_id, hour in db.session.execute(
+                select(table.c.id, table.c.lot_id, table.c.hour)
+                .where(tuple_(table.c.lot_id, table.c.hour).in_(chunk))):
+            existing[lot_id, hour] = row_id
+
+    updates, inserts = [], []
+    for key, (bookings, minutes, revenue, peak) in buckets.items():
+        values = {'b_bookings': bookings, 'b_minutes': minutes, 'b_revenue': revenue, 'b_peak': peak}
+        if key in existing:
+            updates.append({'row_id': existing[key], **values})
+        else:
+            inserts.append({'lot_id': key[0], 'hour': key[1], 'bookings': bookings,
+                            'occupied_minutes': minutes, 'revenue': revenue, 'peak_occupancy': peak})
+    if updates:
+        db.session.execute(
+            update(table)
+            .where(table.c.id == bindparam('row_id'))
+            .values(bookings=table.c.bookings + bindparam('b_bookings'),
+                    occupied_minutes=table.c.occupied_minutes + bindparam('b_minutes'),
+                    revenue=table.c.revenue + bindparam('b_revenue'),
+                    peak_occupancy=_peak(table.c.peak_occupancy, bindparam('b_peak'))),
+            updates)
+    if inserts:
+        db.session.execute(insert(table), inserts)
+
+
+def fold_batch(batch_size):
+    # Folds the next batch of closed reservations into the rollups and moves
+    # the watermark past them, in one transaction. Returns the rows folded.
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config['ROLLUP_LAG_SECONDS'])
+    mark = _watermark()
+    rows = db.session.execute(
+        select(Reservation.id, Reservation.parking_time, Reservation.leaving_time,
+               Reservation.cost, ParkingSpot.lot_id)
+        .outerjoin(ParkingSpot, Reservation.spot_id == ParkingSpot.id)
+        .where(_after(mark.leaving_time, mark.reservation_id), Reservation.leaving_time <= cutoff)
+        .order_by(Reservation.leaving_time, Reservation.id)
+        .limit(batch_size)
+    ).all()
+    if not rows:
+        db.session.rollback()
+        return 0
+
+    buckets = defaultdict(lambda: [0, 0.0, 0.0, 0])
+    revenue = 0.0
+    for _, parking_time, leaving_time, cost, lot_id in rows:
+        revenue += cost or 0
+        if lot_id is None:
+            # Spot deleted with its lot; only the revenue total keeps it
+            continue
+        buckets[lot_id, hour_of(parking_time)][0] += 1
+        buckets[lot_id, hour_of(leaving_time)][2] += cost or 0
+        for hour, minutes in split_by_hour(parking_time, leaving_time):
+            buckets[lot_id, hour][1] += minutes
+
+    _apply(buckets)
+
+    last = rows[-1]
+    # Guarded on the old position so two overlapping runs cannot both apply
+    moved = db.session.execute(
+        update(RollupWatermark)
+        .where(RollupWatermark.name == WATERMARK,
+               RollupWatermark.reservation_id == mark.reservation_id,
+               RollupWatermark.leaving_time.is_(None) if mark.leaving_time is None
+               else RollupWatermark.leaving_time == mark.leaving_time)
+        .values(leaving_time=last.leaving_time, reservation_id=last.id,
+                revenue=RollupWatermark.revenue + revenue)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not moved:
+        db.session.rollback()
+        return 0
+    db.session.commit()
+    return len(rows)
+
+
+def sample_peaks(now=None):
+    hour = hour_of(now or datetime.utcnow())
+    _apply({(lot_id, hour): (0, 0.0, 0.0, occupied)
+            for lot_id, occupied in db.session.query(ParkingLot.id, ParkingLot.occupied_count)})
+    db.session.commit()
+
+
+def run_rollup():
+    batch_size = current_app.config['ROLLUP_BATCH_SIZE']
+    folded = 0
+    while True:
+        count = fold_batch(batch_size)
+        folded += count
+        if count < batch_size:
+            break
+    sample_peaks()
+    return folded
+
+
+def total_revenue():
+    # Revenue folded into the rollups plus whatever closed after the watermark.
+    mark = db.session.get(RollupWatermark, WATERMARK)
+    if mark is None:
+        return db.session.query(func.coalesce(func.sum(Reservation.cost), 0)).scalar()
+    recent = db.session.query(func.coalesce(func.sum(Reservation.cost), 0)) \
+        .filter(_after(mark.leaving_time, mark.reservation_id)).scalar()
+    return mark.revenue + recent
+
+
+def usage_series(start, end, lot_id=None, granularity='hour'):
+    bucket = LotUsageHourly.hour if granularity == 'hour' else func.date(LotUsageHourly.hour)
+    query = db.session.query(bucket.label('bucket'),
+                             func.sum(LotUsageHourly.bookings),
+                             func.sum(LotUsageHourly.occupied_minutes),
+                             func.sum(LotUsageHourly.revenue),
+                             func.max(LotUsageHourly.peak_occupancy)) \
+        .filter(LotUsageHourly.hour >= start, LotUsageHourly.hour < end)
+    if lot_id is not None:
+        query = query.filter(LotUsageHourly.lot_id == lot_id)
+    return query.group_by(bucket).order_by(bucket).all()
+
+
+def usage_by_lot(start, end):
+    return db.session.query(LotUsageHourly.lot_id,
+                            func.sum(LotUsageHourly.bookings),
+                            func.sum(LotUsageHourly.occupied_minutes),
+                            func.sum(LotUsageHourly.revenue),
+                            func.max(LotUsageHourly.peak_occupancy)) \
+        .filter(LotUsageHourly.hour >= start, LotUsageHourly.hour < end) \
+        .group_by(LotUsageHourly.lot_id) \
+        .all()
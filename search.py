@@ -0,0 +1,182 @@
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+from flask import current_app
+
+from caching import versions
+from models import db, ParkingLot
+
+
+# Lot search for /user/lots/search: prefix match on pin_code and substring
+# match on name and address, without scanning parking_lot per request.
+#
+# Each process keeps an in-memory index: every lot's normalised text is split
+# into trigrams, and a query word of three or more characters only has to be
+# checked against the lots holding all of its trigrams. Pin codes sit in a
+# sorted list, so a prefix is a bisect. Only the matching ids go to the
+# database, in one query per chunk, for the current price and availability
+# counters.
+#
+# The admin endpoints update the index in place for the lot they changed.
+# Other processes notice the change through the 'lot-details' cache version
+# and rebuild, and every index is rebuilt after SEARCH_INDEX_MAX_AGE seconds
+# to pick up anything written outside the API.
+
+CHUNK = 500
+
+
+def normalise(text):
+    return ' '.join(re.findall(r'[a-z0-9]+', (text or '').lower()))
+
+
+def trigrams(word):
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+class LotIndex:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._docs = {}
+        self._postings = defaultdict(set)
+        self._pins = []
+        self._version = None
+        self._built_at = 0
+
+    def _add(self, lot_id, name, address, pin_code):
+        name = normalise(name)
+        text = f"{name} {normalise(address)} {normalise(pin_code)}"
+        pin = (pin_code or '').strip()
+        self._docs[lot_id] = (name, text, pin)
+        for word in text.split():
+            for gram in trigrams(word):
+                self._postings[gram].add(lot_id)
+        insort(self._pins, (pin, lot_id))
+
+    def _remove(self, lot_id):
+        doc = self._docs.pop(lot_id, None)
+        if doc is None:
+            return
+        name, text, pin = doc
+        for word in text.split():
+            for gram in trigrams(word):
+                ids = self._postings.get(gram)
+                if ids is not None:
+                    ids.discard(lot_id)
+                    if not ids:
+                        del self._postings[gram]
+        i = bisect_left(self._pins, (pin, lot_id))
+        if i < len(self._pins) and self._pins[i] == (pin, lot_id):
+            del self._pins[i]
+
+    def rebuild(self, version=None):
+        rows = db.session.query(ParkingLot.id, ParkingLot.name, ParkingLot.address,
+                                ParkingLot.pin_code).all()
+        fresh = LotIndex()
+        for row in rows:
+            fresh._add(*row)
+        with self._lock:
+            self._docs, self._postings, self._pins = fresh._docs, fresh._postings, fresh._pins
+            self._version = version
+            self._built_at = time.monotonic()
+        return len(rows)
+
+    def update(self, lot_id):
+        # Call after the commit (and the 'lot-details' bump) of an admin change.
+        row = db.session.query(ParkingLot.id, ParkingLot.name, ParkingLot.address,
+                               ParkingLot.pin_code) \
+            .filter(ParkingLot.id == lot_id).first()
+        version = versions('lot-details')[0]
+        with self._lock:
+            if self._version is None:
+                return
+            self._remove(lot_id)
+            if row is not None:
+                self._add(*row)
+            self._version = version
+
+    def ensure_current(self):
+        version = versions('lot-details')[0]
+        max_age = current_app.config['SEARCH_INDEX_MAX_AGE']
+        with self._lock:
+            current = (self._version == version
+                       and time.monotonic() - self._built_at < max_age)
+        if not current:
+            self.rebuild(version)
+
+    def match(self, query='', pin=''):
+        # Ids of the lots matching every word of query and the pin prefix, best
+        # first: name starting with the query, then name containing every word,
+        # then matches in the address or pin code; ties by name.
+        words = normalise(query).split()
+        phrase = ' '.join(words)
+        pin = (pin or '').strip()
+        with self._lock:
+            if pin:
+                start = bisect_left(self._pins, (pin,))
+                candidates = set()
+                for code, lot_id in self._pins[start:]:
+                    if not code.startswith(pin):
+                        break
+                    candidates.add(lot_id)
+            else:
+                candidates = None
+
+            for word in sorted(words, key=len, reverse=True):
+                grams = trigrams(word)
+                if not grams:
+                    continue
+                ids = set.intersection(*(self._postings.get(g, set()) for g in grams))
+                candidates = ids if candidates is None else candidates & ids
+            if candidates is None:
+                candidates = self._docs.keys()
+
+            ranked = []
+            for lot_id in candidates:
+                name, text, _ = self._docs[lot_id]
+                if not all(word in text for word in words):
+                    continue
+                if phrase and name.startswith(phrase):
+                    rank = 0
+                elif all(word in name for word in words):
+                    rank = 1
+                else:
+                    rank = 2
+                ranked.append((rank, name, lot_id))
+        ranked.sort()
+        return [lot_id for _, _, lot_id in ranked]
+
+
+lot_index = LotIndex()
+
+
+def search_lots(query='', pin='', available_only=False, limit=20):
+    lot_index.ensure_current()
+    ids = lot_index.match(query, pin)
+    results = []
+    for i in range(0, len(ids), CHUNK):
+        chunk = ids[i:i + CHUNK]
+        rows = db.session.query(ParkingLot.id, ParkingLot.name, ParkingLot.address,
+                                ParkingLot.pin_code, ParkingLot.price, ParkingLot.available_count) \
+            .filter(ParkingLot.id.in_(chunk))
+        if available_only:
+            rows = rows.filter(ParkingLot.available_count > 0)
+        found = {row.id: row for row in rows}
+        for lot_id in chunk:
+            row = found.get(lot_id)
+            if row is None:
+                continue
+            results.append({
+                "id": row.id,
+                "name": row.name,
+                "address": row.address,
+                "pin_code": row.pin_code,
+                "price": row.price,
+                "available_spots": row.available_count
+            })
+            if len(results) == limit:
+                return results
+    return results
@@ -0,0 +1,71 @@
+import os
+
+
+# Gunicorn configuration for production serving. Two modes, picked with
+# SERVING_MODE:
+#
+#   async   gevent workers. Socket I/O (Redis, PostgreSQL through psycogreen,
+#           SMTP, the SSE streams) yields to other requests, so one worker
+#           holds WEB_WORKER_CONNECTIONS requests at once instead of one per
+#           thread.
+#   sync    gthread workers with WEB_THREADS threads each. A live lot stream
+#           (/events/lots) holds a thread for as long as it is open, so each
+#           worker accepts only SSE_SYNC_MAX_SUBSCRIBERS of them (events.py);
+#           use async mode where many browsers watch the lots.
+#
+# The default is async when DATABASE_URL names a server database and sync
+# for SQLite (the default database): SQLite calls block the gevent hub, and
+# once the CPU is busy async mode has the worse tail latency
+# (benchmark.py serving).
+#
+#   gunicorn -c serving.py 'app:create_app()'
+#   SERVING_MODE=async gunicorn -c serving.py 'app:create_app()'
+#
+# The routes, the ORM and the cache code are the same in both modes: gevent
+# patches the standard library in each worker before the app is imported, and
+# CPU-bound work that would stall a worker (password hashing) runs in real
+# threads (auth.py). SQLite statements do not yield; they are short with WAL,
+# but a write waiting out SQLITE_BUSY_TIMEOUT_MS holds its whole worker, so
+# use PostgreSQL (pip install psycopg2 psycogreen) for high concurrency, and
+# size DB_POOL_SIZE + DB_MAX_OVERFLOW per worker for the requests that are
+# in the database at the same moment, not for WEB_WORKER_CONNECTIONS.
+
+
+def _server_database(url):
+    # Scheme check only; importing SQLAlchemy here would load it in the
+    # master before gevent patches the workers.
+    return bool(url) and url.split(':', 1)[0].split('+', 1)[0] != 'sqlite'
+
+
+SERVING_MODE = os.environ.get('SERVING_MODE') or (
+    'async' if _server_database(os.environ.get('DATABASE_URL')) else 'sync')
+if SERVING_MODE not in ('async', 'sync'):
+    raise ValueError(f"SERVING_MODE must be 'async' or 'sync', not {SERVING_MODE!r}")
+
+bind = os.environ.get('WEB_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_WORKERS', os.cpu_count() or 1))
+timeout = int(os.environ.get('WEB_TIMEOUT', 30))
+keepalive = int(os.environ.get('WEB_KEEPALIVE', 5))
+backlog = int(os.environ.get('WEB_BACKLOG', 2048))
+accesslog = os.environ.get('WEB_ACCESS_LOG')  # '-' for stdout
+
+if SERVING_MODE == 'async':
+    worker_class = 'gevent'
+    worker_connections = int(os.environ.get('WEB_WORKER_CONNECTIONS', 1000))
+else:
+    worker_class = 'gthread'
+    threads = int(os.environ.get('WEB_THREADS', 8))
+
+# The app is imported in each worker after gevent has patched it; preloading
+# would import redis and SQLAlchemy unpatched in the master.
+preload_app = False
+
+
+def post_fork(server, worker):
+    if SERVING_MODE != 'async':
+        return
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        return  # SQLite, or PostgreSQL without cooperative waits
+    patch_psycopg()
@@ -1,116 +1,178 @@
+from celery import chord
 from celery_worker import celery
 from flask_mail import Message
-from app import mail, app
-from models import User, Reservation
-from datetime import datetime
-import csv
-from io import StringIO
+from flask import current_app
+from extensions import mail
+from models import db, User
+from mailing import chunked, merge_results, send_messages, user_email
+from datetime import datetime, timedelta
+
+_flask_app = None
+
+def flask_app():
+    # Built on first use and without the web layer (routes, JWT, CORS), so
+    # importing this module in a worker stays cheap.
+    global _flask_app
+    if _flask_app is None:
+        from app import create_app
+        _flask_app = create_app(web=False)
+    return _flask_app
 
 @celery.task
 def send_email(subject, recipient, body):
-    with app.app_context():
+    with flask_app().app_context():
         msg = Message(subject=subject, recipients=[recipient], body=body)
         mail.send(msg)
     return f"Email sent to {recipient}"
 
 @celery.task
-def send_daily_reminder():
-    with app.app_context():
-        users = User.query.filter_by(role='user').all()
-        for user in users:
-            email = f"{user.username}@example.com"  
-            msg = Message(subject="Daily Parking Reminder",
-                          recipients=[email],
-                          body="Don't forget to reserve your parking spot today!")
-            mail.send(msg)
-        return f"Daily reminders sent to {len(users)} users"
+def send_mail_batch(messages):
+    with flask_app().app_context():
+        return send_messages(mail, messages)
 
 @celery.task
-def send_monthly_report():
-    from app import app
-    from sqlalchemy import extract
-    from datetime import datetime
-
-    with app.app_context():
-        users = User.query.filter_by(role='user').all()
-        current_month = datetime.now().month
-        current_year = datetime.now().year
-
-        for user in users:
-            reservations = Reservation.query.filter(
-                Reservation.user_id == user.id,
-                extract('month', Reservation.parking_time) == current_month,
-                extract('year', Reservation.parking_time) == current_year
-            ).all()
-
-            total_spent = sum(r.cost for r in reservations if r.cost)
-            total_bookings = len(reservations)
-
-            # Find most used lot
-            lot_counts = {}
-            for r in reservations:
-                if r.spot and r.spot.lot:
-                    lot_name = r.spot.lot.name
-                    lot_counts[lot_name] = lot_counts.get(lot_name, 0) + 1
-                else:
-                    print(f"[WARN] Reservation {r.id} has no valid spot or lot.")
-
-            most_used_lot = max(lot_counts, key=lot_counts.get) if lot_counts else "N/A"
-
-            # Compose HTML email
-            html_body = f"""
-            <h2>Monthly Parking Report</h2>
-            <p>Hi {user.username}, here is your activity summary for this month:</p>
-            <ul>
-                <li><strong>Total Bookings:</strong> {total_bookings}</li>
-                <li><strong>Total Amount Spent:</strong> ₹{total_spent:.2f}</li>
-                <li><strong>Most Used Parking Lot:</strong> {most_used_lot}</li>
-            </ul>
-            <p>Thank you for using our Parking App!</p>
-            """
-
-            msg = Message("Monthly Parking Report",
-                          recipients=[f"{user.username}@example.com"],
-                          html=html_body)
-
-            try:
-                mail.send(msg)
-            except Exception as e:
-                print(f"Error sending monthly report to {user.username}: {e}")
-
-    return "Monthly reports sent!"
+def summarize_mail_results(results, label):
+    summary = merge_results(results, label)
+    print(f"{label}: {summary['sent']} sent, {summary['failed']} failed")
+    return summary
+
+def dispatch_mail(messages, label):
+    # Fans messages out into send_mail_batch chunks; a chord collects the
+    # per-chunk counts into one summary. Returns the number of chunks queued.
+    batches = [send_mail_batch.s(chunk)
+               for chunk in chunked(messages, current_app.config['MAIL_BATCH_SIZE'])]
+    if batches:
+        chord(batches)(summarize_mail_results.s(label))
+    return len(batches)
 
 @celery.task
-def export_reservations_csv(user_id, username):
-    from app import app
-    from models import Reservation
-    from flask_mail import Message
-
-    with app.app_context():
-        reservations = Reservation.query.filter_by(user_id = user_id).all()
-
-        output = StringIO()
-        writer = csv.writer(output)
-        writer.writerow(['Lot', 'Spot ID', 'Start', 'End', 'Cost'])
-        for r in reservations:
-            if not r.spot or not r.spot.lot:
-                 continue
-            writer.writerow([r.spot.lot.name,
-                             r.spot_id,
-                             str(r.parking_time),
-                             str(r.leaving_time) or 'Active',
-                             str(r.cost) or '0'
-                             ])
-        msg = Message("Your Parking History Export",
-                       recipients=[f"{username}@example.com"])
-        msg.body = 'Attached is your parking history export.'
-        msg.attach("parking_history.csv", "text/csv", output.getvalue())
+def send_daily_reminder():
+    with flask_app().app_context():
+        usernames = db.session.query(User.username) \
+            .filter_by(role='user') \
+            .order_by(User.id) \
+            .yield_per(5000)
+        messages = ({"subject": "Daily Parking Reminder",
+                     "recipients": [user_email(username)],
+                     "body": "Don't forget to reserve your parking spot today!"}
+                    for (username,) in usernames)
+        batches = dispatch_mail(messages, "Daily reminders")
+    return f"Daily reminders queued in {batches} batches"
+
+@celery.task
+def send_monthly_report(year=None, month=None):
+    # Defaults to the month that just ended; beat runs this on the 1st.
+    from reports import previous_month, report_chunks, report_message
+
+    with flask_app().app_context():
+        if year is None or month is None:
+            year, month = previous_month(datetime.now())
+        messages = (report_message(row, year, month)
+                    for chunk in report_chunks(year, month)
+                    for row in chunk)
+        batches = dispatch_mail(messages, f"Monthly reports {year}-{month:02d}")
+
+    return f"Monthly reports for {year}-{month:02d} queued in {batches} batches"
+
+@celery.task(bind=True)
+def export_reservations_csv(self, user_id, username, start=None, end=None, compress=False):
+    # user_id=None exports every user's reservations (admin export); start and
+    # end are optional ISO dates, end inclusive.
+    from exports import count_rows, export_query, size_of, store_export, write_csv
+
+    with flask_app().app_context():
+        start = datetime.fromisoformat(start) if start else None
+        end = datetime.fromisoformat(end) + timedelta(days=1) if end else None
+        query, header = export_query(user_id, start, end)
+        total = count_rows(query)
+
+        def progress(rows):
+            if self.request.id:
+                self.update_state(state='PROGRESS', meta={'rows': rows, 'total': total})
+
+        spooled, rows = write_csv(query, header, compress, progress)
+        size = size_of(spooled)
+        filename = "parking_history.csv" + (".gz" if compress else "")
+        link = None
+
+        msg = Message("Your Parking History Export", recipients=[user_email(username)])
+        if size <= current_app.config['EXPORT_ATTACH_MAX_BYTES']:
+            msg.body = 'Attached is your parking history export.'
+            msg.attach(filename, "application/gzip" if compress else "text/csv", spooled.read())
+        else:
+            link = f"{current_app.config['EXPORT_BASE_URL']}/exports/{store_export(spooled, compress)}"
+            msg.body = (f"Your parking history export ({rows} reservations) is ready to download:\n"
+                        f"{link}\n\nThe link expires in {current_app.config['EXPORT_TTL'] // 3600} hours.")
+        spooled.close()
 
         try:
             mail.send(msg)
             print(f"CSV export sent to {username}")
         except Exception as e:
-            print(f"Error sending CSV: {e}")              
+            print(f"Error sending CSV: {e}")
+
+    return {'rows': rows, 'bytes': size, 'download': link}
+
+
+@celery.task
+def reconcile_lot_counters():
+    from occupancy import reconcile
+
+    with flask_app().app_context():
+        drift = reconcile()
+    for d in drift:
+        print(f"[WARN] Lot {d['lot_id']} counters drifted: "
+              f"available {d['available_count']} -> {d['available']}, "
+              f"occupied {d['occupied_count']} -> {d['occupied']}")
+    return f"Reconciled {len(drift)} lots"
+
+
+@celery.task
+def rollup_lot_usage():
+    from caching import bump
+    from rollups import run_rollup
+
+    with flask_app().app_context():
+        folded = run_rollup()
+        bump('rollups')
+    return f"Folded {folded} reservations into the usage rollups"
+
+
+@celery.task
+def sweep_expired_reservations():
+    from caching import bump
+    from events import publish_lots
+    from expiry import expiry_message, sweep
+
+    with flask_app().app_context():
+        closed = sweep()
+        if closed is None:
+            return "Another sweep is running"
+        if closed:
+            lot_ids = sorted({row['lot_id'] for row in closed})
+            bump('lots', 'reservations', *(f'lot:{lot_id}' for lot_id in lot_ids),
+                 *{f"user:{row['user_id']}" for row in closed})
+            publish_lots(*lot_ids)
+            dispatch_mail((expiry_message(row) for row in closed), "Expired reservations")
+    return f"Closed {len(closed)} expired reservations"
+
+
+@celery.task
+def purge_idempotency_keys():
+    from transactions import purge_idempotency_keys as purge
+
+    with flask_app().app_context():
+        deleted = purge()
+    return f"Purged {deleted} idempotency keys"
+
+
+@celery.task
+def purge_expired_exports():
+    from exports import purge_exports
+
+    with flask_app().app_context():
+        deleted = purge_exports()
+    return f"Deleted {deleted} expired exports"
 
     
 @celery.task
@@ -0,0 +1,128 @@
+import random
+import time
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import Response, current_app, jsonify, make_response, request
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy.exc import DBAPIError, IntegrityError
+
+from models import db, IdempotencyKey
+
+
+# Transaction helpers for the booking endpoints.
+#
+# retry_transaction re-runs a view whose transaction lost a lock conflict:
+# deadlocks and serialization failures on PostgreSQL/MySQL, "database is
+# locked" on SQLite. The view must roll back its own side effects on error
+# (reserve_spot returns the claimed spot to the allocator) so that running it
+# again is safe.
+#
+# idempotent makes client retries of a POST safe: the first response sent with
+# a given Idempotency-Key header is stored per user and replayed for every
+# repeat; a repeat that arrives while the first is still running gets 409.
+
+RETRYABLE_SQLSTATES = {'40001', '40P01'}   # serialization failure, deadlock
+RETRYABLE_MYSQL_ERRORS = {1205, 1213}       # lock wait timeout, deadlock
+
+
+def is_retryable(error):
+    if not isinstance(error, DBAPIError) or isinstance(error, IntegrityError):
+        return False
+    orig = error.orig
+    sqlstate = getattr(orig, 'sqlstate', None) or getattr(orig, 'pgcode', None)
+    if sqlstate in RETRYABLE_SQLSTATES:
+        return True
+    if orig is not None and orig.args and orig.args[0] in RETRYABLE_MYSQL_ERRORS:
+        return True
+    return 'database is locked' in str(orig)
+
+
+def retry_transaction(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        attempts = current_app.config['TRANSACTION_RETRIES'] + 1
+        for attempt in range(attempts):
+            try:
+                return view(*args, **kwargs)
+            except DBAPIError as e:
+                db.session.rollback()
+                if attempt == attempts - 1 or not is_retryable(e):
+                    raise
+                # Jittered backoff so the conflicting transactions do not
+                # collide again in lockstep
+                time.sleep(random.uniform(0, 0.02 * 2 ** attempt))
+    return wrapper
+
+
+def _replay(record):
+    return Response(record.body, status=record.status, mimetype='application/json')
+
+
+def idempotent(view):
+    # Must sit under @jwt_required(): keys are scoped to the calling user.
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > 100:
+            return jsonify(message='Idempotency-Key is too long'), 400
+
+        user_id = get_jwt_identity()['id']
+        now = datetime.utcnow()
+        expired = now - timedelta(seconds=current_app.config['IDEMPOTENCY_TTL'])
+        abandoned = now - timedelta(seconds=60)
+        record = IdempotencyKey.query.filter_by(user_id=user_id, key=key).first()
+        if record is not None and (record.created_at < expired
+                                   or record.status is None and record.created_at < abandoned):
+            # Expired, or claimed by a request that died before finishing
+            db.session.delete(record)
+            db.session.commit()
+            record = None
+
+        if record is None:
+            # Claim the key before running the view; the unique index decides
+            # between concurrent first attempts.
+            record = IdempotencyKey(user_id=user_id, key=key, method=request.method, path=request.path)
+            db.session.add(record)
+            try:
+                db.session.commit()
+            except IntegrityError:
+                db.session.rollback()
+                record = IdempotencyKey.query.filter_by(user_id=user_id, key=key).first()
+            else:
+                return _run_and_store(view, record.id, args, kwargs)
+
+        if record is None or record.status is None:
+            return jsonify(message='A request with this Idempotency-Key is in progress'), 409
+        if record.method != request.method or record.path != request.path:
+            return jsonify(message='Idempotency-Key was used for a different request'), 422
+        return _replay(record)
+    return wrapper
+
+
+def _run_and_store(view, record_id, args, kwargs):
+    try:
+        response = make_response(view(*args, **kwargs))
+    except Exception:
+        db.session.rollback()
+        IdempotencyKey.query.filter_by(id=record_id).delete()
+        db.session.commit()
+        raise
+
+    if response.status_code >= 500:
+        # Server errors are not final; let the client try again.
+        IdempotencyKey.query.filter_by(id=record_id).delete()
+    else:
+        IdempotencyKey.query.filter_by(id=record_id).update(
+            {'status': response.status_code, 'body': response.get_data(as_text=True)})
+    db.session.commit()
+    return response
+
+
+def purge_idempotency_keys():
+    expired = datetime.utcnow() - timedelta(seconds=current_app.config['IDEMPOTENCY_TTL'])
+    deleted = IdempotencyKey.query.filter(IdempotencyKey.created_at < expired).delete()
+    db.session.commit()
+    return deleted